@@ -6,6 +6,7 @@ from flask_login import login_user, login_required, logout_user, current_user
 from werkzeug.security import check_password_hash, generate_password_hash
 from datetime import datetime, date
 from pathlib import Path
+from sqlalchemy.exc import IntegrityError
 import os, io, uuid
 
 # PIL pour l'upload image (même logique que côté app.py)
@@ -16,6 +17,12 @@ except Exception:
     _PIL_OK = False
 
 from models import db, User, Professional, Appointment, ProfessionalAvailability, UnavailableSlot
+import ranking_snapshot
+import result_cache
+import http_client
+import slot_engine
+import booking_guard
+import image_worker
 
 admin_bp = Blueprint('admin', __name__, template_folder='templates', static_folder=None)
 
@@ -48,7 +55,7 @@ def _admin_upload_dir() -> Path:
     up.mkdir(parents=True, exist_ok=True)
     return up
 
-def _admin_process_and_save_profile_image(file_storage) -> str:
+def _admin_process_and_save_profile_image(file_storage, professional=None) -> str:
     filename = getattr(file_storage, "filename", None)
     if not filename or not _ext_ok(filename):
         raise ValueError("Extension non autorisée")
@@ -56,28 +63,12 @@ def _admin_process_and_save_profile_image(file_storage) -> str:
     if not _PIL_OK:
         raise RuntimeError("Pillow n'est pas installé sur le serveur.")
 
-    raw = file_storage.read()
-    try:
-        img = Image.open(io.BytesIO(raw))
-        img.verify()
-    except Exception:
-        raise ValueError("Fichier image invalide ou corrompu")
-
-    img = Image.open(io.BytesIO(raw))
-    if img.mode not in ("RGB", "RGBA"):
-        img = img.convert("RGB")
-
-    # strip exif
-    img_no_exif = Image.new(img.mode, img.size)
-    img_no_exif.putdata(list(img.getdata()))
-
-    TARGET_SIZE = (512, 512)
-    img_square = ImageOps.fit(img_no_exif, TARGET_SIZE, Image.Resampling.LANCZOS)
-
-    out_name = f"{uuid.uuid4().hex}.jpg"
-    out_path = _admin_upload_dir() / out_name
-    img_square.save(out_path, format="JPEG", quality=88, optimize=True)
-    return out_name
+    # Même chaîne que côté app : upload brut puis traitement en arrière-plan (image_worker)
+    out_name = image_worker.content_name(file_storage.stream)
+    revert = None
+    if professional is not None and professional.id:
+        revert = (professional.id, "image_url", professional.image_url, f"/media/profiles/{out_name}")
+    return image_worker.submit(file_storage.stream, _admin_upload_dir(), out_name, revert=revert)
 
 # ============================================================================
 
@@ -284,6 +275,15 @@ def _load_order_map() -> dict[int, int]:
     rows = ProfessionalOrder.query.all()
     return {r.professional_id: (r.order_priority if r.order_priority is not None else 9999) for r in rows}
 
+def _refresh_ranking(*pro_ids):
+    """Repositionne les pros dans le classement en mémoire de la page d'accueil (après commit)."""
+    try:
+        ranking_snapshot.refresh(pro_ids)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning("Snapshot classement non mis à jour (%s), reconstruction au prochain accès.", e)
+        ranking_snapshot.snapshot.invalidate()
+
 @admin_bp.route('/professionals/order', methods=['GET', 'POST'], endpoint='admin_professional_order')
 @login_required
 def admin_professional_order():
@@ -295,6 +295,7 @@ def admin_professional_order():
 
     if request.method == 'POST':
         updated = 0
+        changed_ids = []
         for key, val in request.form.items():
             if not key.startswith('order_priority_'):
                 continue
@@ -314,8 +315,10 @@ def admin_professional_order():
             else:
                 row.order_priority = priority
             updated += 1
+            changed_ids.append(pro_id)
 
         db.session.commit()
+        _refresh_ranking(*changed_ids)
         flash(f"Classement mis à jour pour {updated} professionnels.")
         return redirect(url_for('admin.admin_professional_order'))
 
@@ -574,12 +577,13 @@ def admin_edit_product(product_id):
         file = request.files.get('image_file')
         if file and getattr(file, 'filename', ''):
             try:
-                saved = _admin_process_and_save_profile_image(file)
+                saved = _admin_process_and_save_profile_image(file, professional)
                 professional.image_url = f"/media/profiles/{saved}"
             except Exception as e:
                 flash(f"Image non enregistrée ({e}).", "warning")
 
         db.session.commit()
+        _refresh_ranking(professional.id)
         flash('Professionnel modifié avec succès!')
         _notify_admin_event("[ADMIN] Profil pro mis à jour", f"Pro: {professional.name} (id {professional.id})")
         return redirect(url_for('admin.admin_products'))
@@ -594,6 +598,7 @@ def admin_delete_product(product_id):
     professional = Professional.query.get_or_404(product_id)
     db.session.delete(professional)
     db.session.commit()
+    _refresh_ranking(product_id)
     return jsonify({'success': True, 'message': 'Professionnel supprimé avec succès'})
 
 # Variante CRUD /professionals
@@ -705,12 +710,13 @@ def edit_professional(professional_id):
         file = request.files.get('image_file')
         if file and getattr(file, 'filename', ''):
             try:
-                saved = _admin_process_and_save_profile_image(file)
+                saved = _admin_process_and_save_profile_image(file, professional)
                 professional.image_url = f"/media/profiles/{saved}"
             except Exception as e:
                 flash(f"Image non enregistrée ({e}).", "warning")
 
         db.session.commit()
+        _refresh_ranking(professional.id)
         flash('Professionnel modifié avec succès!')
         _notify_admin_event("[ADMIN] Profil pro modifié (route edit_professional)", f"Pro: {professional.name} (id {professional.id})")
         return redirect(url_for('admin.admin_professionals'))
@@ -729,6 +735,7 @@ def delete_professional(professional_id):
     professional = Professional.query.get_or_404(professional_id)
     db.session.delete(professional)
     db.session.commit()
+    _refresh_ranking(professional_id)
 
     # Réponse selon le contexte (XHR vs navigation)
     if request.method == 'POST' or request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -758,7 +765,12 @@ def admin_professional_availability(professional_id):
     professional = Professional.query.get_or_404(professional_id)
 
     if request.method == 'POST':
-        ProfessionalAvailability.query.filter_by(professional_id=professional.id).delete()
+        # Suppression par objet (et non en masse) : le flush voit les anciennes plages et
+        # invalide les disponibilités matérialisées, même si aucune plage n'est recréée
+        for old_window in ProfessionalAvailability.query.filter_by(professional_id=professional.id).all():
+            db.session.delete(old_window)
+        # Grille enregistrée, même vide : plus de plages par défaut (slot_engine.FALLBACK_WINDOWS)
+        professional.availability_saved_at = datetime.utcnow()
 
         def add_window(day, s, e, avail_flag):
             s = (s or '').strip()
@@ -789,10 +801,15 @@ def admin_professional_availability(professional_id):
         windows_by_day.get(av.day_of_week, []).append(av)
     availability_dict = {d: (windows_by_day[d][0] if windows_by_day[d] else None) for d in range(7)}
 
+    # Aperçu des 7 prochains jours tel que vu par les patients (même moteur que la réservation)
+    now = datetime.utcnow()
+    upcoming_slots = slot_engine.grouped_by_day(slot_engine.load(professional, now.date(), 7), not_before=now)
+
     return render_template('admin_professional_availability.html',
                            professional=professional,
                            availabilities=availability_dict,
-                           windows_by_day=windows_by_day)
+                           windows_by_day=windows_by_day,
+                           upcoming_slots=upcoming_slots)
 
 # ---------- Gestion des indisponibilités (ADMIN) ----------
 
@@ -1054,7 +1071,14 @@ def update_appointment_status(appointment_id):
             return jsonify({'success': False, 'message': 'Statut invalide'}), 400
         appointment = Appointment.query.get_or_404(appointment_id)
         appointment.status = new_status
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            # Réactivation d'un rendez-vous dont le créneau a été repris entre-temps
+            db.session.rollback()
+            if not booking_guard.is_slot_conflict(e):
+                raise
+            return jsonify({'success': False, 'message': 'Créneau déjà pris par un autre rendez-vous.'}), 409
 
         if new_status == 'confirme':
             _notify_patient('accepted', appointment)
@@ -1089,7 +1113,9 @@ def api_stats():
         'total_users': len(users),
         'total_appointments': len(appointments),
         'confirmed_appointments': len([a for a in appointments if a.status == 'confirme']),
-        'pending_appointments': len([a for a in appointments if a.status == 'en_attente'])
+        'pending_appointments': len([a for a in appointments if a.status == 'en_attente']),
+        'result_cache': result_cache.stats(),
+        'outbound_hosts': http_client.stats(),
     }
     return jsonify(stats)
 
@@ -1102,6 +1128,7 @@ def validate_professional(professional_id):
         professional = Professional.query.get_or_404(professional_id)
         professional.status = 'valide'
         db.session.commit()
+        _refresh_ranking(professional.id)
 
         pro_user = User.query.filter_by(username=professional.name).first()
         _notify_user_account(getattr(pro_user, 'email', None), "pro_validated", pro=professional)
@@ -1121,6 +1148,7 @@ def reject_professional(professional_id):
         professional = Professional.query.get_or_404(professional_id)
         professional.status = 'rejete'
         db.session.commit()
+        _refresh_ranking(professional.id)
 
         pro_user = User.query.filter_by(username=professional.name).first()
         _notify_user_account(getattr(pro_user, 'email', None), "pro_rejected", pro=professional)
@@ -16,18 +16,20 @@ import requests
 from dotenv import load_dotenv
 from flask import (
     Flask, render_template, request, redirect, url_for, flash, jsonify,
-    send_from_directory, Response, current_app, make_response, g, abort, session
+    send_from_directory, Response, Request, current_app, make_response, g, abort, session
 )
 from flask_login import (
     LoginManager, login_user, login_required, logout_user, current_user
 )
 from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.datastructures import MultiDict
 from werkzeug.security import generate_password_hash, check_password_hash
 from jinja2 import TemplateNotFound
 from sqlalchemy import or_, and_, text, func, case
 
 # === Extensions (db) ===
 from extensions import db  # db.init_app(app) sera appelé après config
+import upload_stream
 
 # -------------------------------------------------------------------
 # Environnement
@@ -45,13 +47,29 @@ UPLOAD_FOLDER = UPLOAD_ROOT / "profiles"
 ATTACHMENTS_FOLDER = UPLOAD_ROOT / "attachments"  # pièces jointes
 
 ALLOWED_IMAGE_EXT = {".jpg", ".jpeg", ".png", ".gif"}
-ALLOWED_DOC_EXT = {".pdf", ".doc", ".docx", ".xls", ".xlsx", ".txt"} | ALLOWED_IMAGE_EXT
+ALLOWED_MEDIA_EXT = upload_stream.AUDIO_EXT | upload_stream.VIDEO_EXT  # notes vocales, exercices audio/vidéo
+ALLOWED_DOC_EXT = {".pdf", ".doc", ".docx", ".xls", ".xlsx", ".txt"} | ALLOWED_IMAGE_EXT | ALLOWED_MEDIA_EXT
 MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", str(5 * 1024 * 1024)))  # 5 Mo
+# Routes qui reçoivent audio / vidéo : plafond relevé au plus grand plafond par type
+# (upload_stream, copie en flux) ; partout ailleurs MAX_CONTENT_LENGTH s'applique.
+MEDIA_UPLOAD_ENDPOINTS = {
+    "pro_thread", "patient_thread", "pro_library", "pro_patient_exercises",
+    "patient_exercise_detail", "pro_office.messages_thread",
+}
 
 # -------------------------------------------------------------------
 # Flask app
 # -------------------------------------------------------------------
+class _UploadRequest(Request):
+    @property
+    def max_content_length(self):
+        if self.endpoint in MEDIA_UPLOAD_ENDPOINTS:
+            return max(upload_stream.max_upload_bytes(), MAX_CONTENT_LENGTH)
+        return super().max_content_length
+
+
 app = Flask(__name__)
+app.request_class = _UploadRequest
 
 # Jinja helper: has_endpoint("name")
 @app.context_processor
@@ -185,7 +203,29 @@ from models import (
     PersonalJournalEntry, TherapyNotebookEntry,
     Specialty, City,
     ProfessionalReview,
+    backfill_consultation_modes,
 )
+from search_engine import apply_text_search, install_search_schema
+import keyset
+import ranking_snapshot
+import taxonomy_cache
+import facet_index
+import geo_search
+import suggest_index
+import family_index
+import result_cache
+import photo_proxy
+import image_variants
+import image_worker
+import blob_store
+import file_delivery
+import media_transcode
+import avatar_cache
+import slot_engine
+import availability_bitmap
+import first_available
+import booking_guard
+import slot_holds
 
 def _get_or_create_thread(professional_id: int, patient_user_id: int):
     thr = MessageThread.query.filter_by(
@@ -665,40 +705,26 @@ def _doc_ext_ok(filename: str) -> bool:
     _, ext = os.path.splitext(filename.lower())
     return ext in ALLOWED_DOC_EXT
 
-def _process_and_save_profile_image(file_storage) -> str:
+def _process_and_save_profile_image(file_storage, pro: Optional[Professional] = None, field: str = "image_url") -> str:
     filename = getattr(file_storage, "filename", None)
     if not filename or not _ext_ok(filename):
         raise ValueError("Extension non autorisée")
-    raw = file_storage.read()
     if not _PIL_OK:
         raise RuntimeError("Le traitement d'image nécessite Pillow (PIL).")
-    try:
-        img = Image.open(io.BytesIO(raw)); img.verify()
-    except Exception:
-        raise ValueError("Fichier image invalide ou corrompu")
-    img = Image.open(io.BytesIO(raw))
-    if img.mode not in ("RGB", "RGBA"):
-        img = img.convert("RGB")
-    img_no_exif = Image.new(img.mode, img.size)
-    img_no_exif.putdata(list(img.getdata()))
-    img_square = ImageOps.fit(img_no_exif, (512, 512), Image.Resampling.LANCZOS)
-    out_name = f"{uuid.uuid4().hex}.jpg"
-    out_path = UPLOAD_FOLDER / out_name
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    img_square.save(out_path, format="JPEG", quality=88, optimize=True)
-    return out_name
+    # Upload brut sur disque, décodage + déclinaisons 96…1024 WebP/JPEG en arrière-plan
+    # (image_worker) ; si le traitement échoue, `field` de `pro` reprend sa valeur actuelle.
+    out_name = image_worker.content_name(file_storage.stream)
+    revert = None
+    if pro is not None and pro.id:
+        revert = (pro.id, field, getattr(pro, field, None), f"/u/profiles/{out_name}")
+    return image_worker.submit(file_storage.stream, UPLOAD_FOLDER, out_name, revert=revert)
 
 def _save_attachment(file_storage) -> str:
     filename = getattr(file_storage, "filename", None)
     if not filename or not _doc_ext_ok(filename):
         raise ValueError("Extension non autorisée")
-    content = file_storage.read()
-    name = f"{uuid.uuid4().hex}{Path(filename).suffix.lower()}"
-    out_path = ATTACHMENTS_FOLDER / name
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_path, "wb") as f:
-        f.write(content)
-    return name
+    # Adressé par contenu (sha256) : un fichier déjà reçu n'est pas réécrit
+    return blob_store.put(file_storage.stream, Path(filename).suffix.lower())
 
 def _avatar_file_for(pid: int) -> Optional[str]:
     if not os.path.isdir(AVATAR_DIR):
@@ -712,35 +738,57 @@ def _avatar_file_for(pid: int) -> Optional[str]:
 def _avatar_fallback_response():
     static_avatar = Path(app.static_folder or (BASE_DIR / "static")) / AVATAR_DEFAULT_REL
     if static_avatar.exists():
-        resp = send_from_directory(app.static_folder, AVATAR_DEFAULT_REL, conditional=True)
-        resp.headers["Cache-Control"] = "public, max-age=86400"
-        return resp
+        return file_delivery.send(static_avatar, max_age=86400)
     return redirect(PHOTO_PLACEHOLDER)
 
 # -------------------------------------------------------------------
 # Fichiers (Render Disk)
 # -------------------------------------------------------------------
+def _send_profile_file(filename: str):
+    """Photo locale (UPLOAD_FOLDER) ; ?w=<px> sert la déclinaison adaptée (WebP si accepté)."""
+    name = os.path.basename(filename)
+    width = request.args.get("w", type=int)
+    if width:
+        accept_webp = "image/webp" in (request.headers.get("Accept") or "")
+        name = image_variants.resolve(UPLOAD_FOLDER, name, width, accept_webp)
+    if not (UPLOAD_FOLDER / name).exists():
+        resp = _avatar_fallback_response()
+        if image_worker.is_pending(name):
+            resp.headers["Cache-Control"] = "no-store"  # photo en cours de traitement
+        return resp
+    resp = file_delivery.send(UPLOAD_FOLDER / name, max_age=31536000)
+    if width:
+        resp.headers["Vary"] = "Accept"
+    return resp
+
 @app.route("/u/profiles/<path:filename>", endpoint="u_profiles")
 def u_profiles(filename: str):
     if not filename or ".." in filename or filename.startswith("/"):
         abort(404)
-    fpath = UPLOAD_FOLDER / os.path.basename(filename)
-    if not fpath.exists():
-        return _avatar_fallback_response()
-    resp = send_from_directory(str(UPLOAD_FOLDER), os.path.basename(filename), conditional=True)
-    resp.headers["Cache-Control"] = "public, max-age=31536000"
-    return resp
+    return _send_profile_file(filename)
 
 @app.route("/u/attachments/<path:filename>", endpoint="u_attachments")
 def u_attachments(filename: str):
     if not filename or ".." in filename or filename.startswith("/"):
         abort(404)
-    fpath = ATTACHMENTS_FOLDER / os.path.basename(filename)
+    name = os.path.basename(filename)
+    if blob_store.is_blob_name(name):
+        fpath = blob_store.blob_path(name)
+        if not fpath.exists():
+            abort(404)
+        # ?q=low : uniquement la version audio allégée (émise par low_audio_url une fois prête) ;
+        # une URL ne change jamais de contenu, les requêtes Range d'un lecteur restent cohérentes
+        if request.args.get("q") == "low":
+            low = media_transcode.ready(name)
+            if low is None:
+                abort(404)
+            return file_delivery.send(low, mimetype="audio/mp4", cache_control="public, max-age=31536000, immutable")
+        return file_delivery.send(fpath, cache_control="public, max-age=31536000, immutable")
+    # Anciens noms uuid : dossier plat historique
+    fpath = ATTACHMENTS_FOLDER / name
     if not fpath.exists():
         abort(404)
-    resp = send_from_directory(str(ATTACHMENTS_FOLDER), os.path.basename(filename), conditional=True)
-    resp.headers["Cache-Control"] = "public, max-age=31536000"
-    return resp
+    return file_delivery.send(fpath, max_age=31536000)
 
 def _normalize_disk_url(value: str | None) -> Optional[str]:
     if not value:
@@ -772,12 +820,67 @@ def _pro_photo_field(pro: Professional, index: int) -> Optional[str]:
                 return str(val)
     return None
 
+_AVATAR_ROW_MISSING = object()
+
+def _compute_avatar_entry(pid: int, raw):
+    """
+    Résolution (coûteuse : stat disque) de la photo principale ; voir avatar_cache.
+    Retourne toujours (entrée, mémorisable).
+    """
+    if raw is _AVATAR_ROW_MISSING:
+        return {"kind": None, "path": None, "url": None, "srcset": "", "etag": None}, True
+    raw = (raw or "").strip()
+    if raw.startswith("/media/profiles/") or raw.startswith("/u/profiles/"):
+        name = os.path.basename(raw.split("?", 1)[0])
+        url = url_for("u_profiles", filename=name)
+        entry = {"kind": "profile", "path": str(UPLOAD_FOLDER / name), "url": url,
+                 "srcset": image_variants.srcset(UPLOAD_FOLDER, url), "etag": None}
+        return entry, not image_worker.is_pending(name)  # pas de mémorisation avant les déclinaisons
+    if raw:
+        if raw.startswith("http://"):
+            raw = "https://" + raw[len("http://"):]
+        if urlparse(raw).scheme == "https":
+            return {"kind": "remote", "path": None, "url": url_for("profile_photo", professional_id=pid),
+                    "srcset": "", "etag": None, "source": raw}, True
+    else:
+        file_path = _avatar_file_for(pid)
+        if file_path:
+            st = os.stat(file_path)
+            return {"kind": "file", "path": file_path,
+                    "url": url_for("static", filename=f"avatars/{os.path.basename(file_path)}"),
+                    "srcset": "", "etag": f"av{pid}-{int(st.st_mtime)}-{st.st_size}"}, True
+        if os.path.isfile(PLACEHOLDER_AVATAR):
+            return {"kind": "placeholder", "path": PLACEHOLDER_AVATAR,
+                    "url": url_for("static", filename="avatar_default.webp"), "srcset": "", "etag": None}, True
+    # URL inexploitable ou aucun avatar sur disque : avatar par défaut
+    static_avatar = Path(app.static_folder or (BASE_DIR / "static")) / AVATAR_DEFAULT_REL
+    url = url_for("static", filename=AVATAR_DEFAULT_REL) if static_avatar.exists() else PHOTO_PLACEHOLDER
+    return {"kind": "placeholder", "path": None, "url": url, "srcset": "", "etag": None}, True
+
+def _avatar_entry(pid: int, raw=_AVATAR_ROW_MISSING, load: bool = True):
+    """Entrée mémorisée (avatar_cache) ; sans `raw`, la seule colonne image_url est lue en base."""
+    def compute():
+        value = raw
+        if load:
+            row = db.session.query(Professional.image_url).filter(Professional.id == pid).first()
+            value = row[0] if row is not None else _AVATAR_ROW_MISSING
+        return _compute_avatar_entry(pid, value)
+    return avatar_cache.get(pid, compute)
+
+def professional_avatar_url(pro: Professional, w: Optional[int] = None) -> str:
+    """URL finale (fichier statique, /u/profiles/…?w=, ou proxy pour une photo externe)."""
+    entry = _avatar_entry(pro.id, getattr(pro, "image_url", None), load=False)
+    url = entry["url"]
+    if w and entry["kind"] == "profile":
+        url = f"{url}?w={int(w)}"
+    return url
+
 def professional_photo_url(pro: Professional, index: int) -> Optional[str]:
     raw = _pro_photo_field(pro, index)
     if raw:
         return _normalize_disk_url(raw)
     if index == 1 and not raw:
-        return url_for("profile_photo", professional_id=pro.id)
+        return professional_avatar_url(pro)
     return None
 
 def professional_gallery_urls(pro: Professional) -> list[str]:
@@ -788,11 +891,40 @@ def professional_gallery_urls(pro: Professional) -> list[str]:
             urls.append(u)
     return urls
 
+def professional_photo_srcset(pro: Professional, index: int = 1) -> str:
+    """srcset des déclinaisons (96…1024 px) d'une photo locale ; "" sinon (photo externe, ancienne)."""
+    url = professional_photo_url(pro, index)
+    if not url or not url.startswith("/u/profiles/"):
+        return ""
+    if index == 1:
+        return _avatar_entry(pro.id, getattr(pro, "image_url", None), load=False)["srcset"]
+    return image_variants.srcset(UPLOAD_FOLDER, url)
+
+def attachment_media_kind(url: str) -> Optional[str]:
+    """'audio' / 'video' pour une pièce jointe lisible dans un lecteur, sinon None."""
+    if not url:
+        return None
+    kind = upload_stream.kind_for(Path(url.split("?", 1)[0]).suffix)
+    return kind if kind in ("audio", "video") else None
+
+def low_audio_url(url: str) -> str:
+    """URL ?q=low si la version allégée de l'audio `url` est prête, sinon `url` (conversion lancée)."""
+    name = blob_store.name_from_url(url)
+    if name is None or url != f"{blob_store.URL_PREFIX}{name}":
+        return url
+    if media_transcode.lookup(name, blob_store.blob_path(name)) is None:
+        return url
+    return f"{url}?q=low"
+
 @app.context_processor
 def inject_gallery_helpers():
     return {
         "professional_photo_url": professional_photo_url,
         "professional_gallery_urls": professional_gallery_urls,
+        "professional_photo_srcset": professional_photo_srcset,
+        "professional_avatar_url": professional_avatar_url,
+        "attachment_media_kind": attachment_media_kind,
+        "low_audio_url": low_audio_url,
     }
 
 # -------------------------------------------------------------------
@@ -814,32 +946,26 @@ except Exception:
         "Orthophoniste", "Psychomotricien", "Kinésithérapeute"
     ]
 
+# Référentiels servis depuis taxonomy_cache (invalidé à chaque écriture City/Specialty)
 def _ui_cities():
     try:
-        return [{"id": c.id, "name": c.name} for c in City.query.order_by(City.name.asc()).all()]
+        return taxonomy_cache.cities()
     except Exception:
+        db.session.rollback()
         return []
 
 def _ui_specialties():
     try:
-        return [{"id": s.id, "name": s.name, "category": s.category} for s in Specialty.query.order_by(Specialty.name.asc()).all()]
+        return taxonomy_cache.specialties()
     except Exception:
+        db.session.rollback()
         return []
 
 def _ui_families_rows():
     try:
-        rows = (
-            db.session.query(Specialty.category)
-            .filter(Specialty.category.isnot(None), Specialty.category != "")
-            .distinct()
-            .order_by(Specialty.category.asc())
-            .all()
-        )
-        out = []
-        for i, r in enumerate(rows, start=1):
-            out.append({"id": i, "name": r[0]})
-        return out
+        return taxonomy_cache.families()
     except Exception:
+        db.session.rollback()
         return []
 
 @app.context_processor
@@ -907,12 +1033,12 @@ def render_or_text(template_name: str, fallback_title: str, **kwargs):
 @app.get("/favicon.ico", endpoint="favicon_ico")
 def favicon_ico():
     static_dir = os.path.join(app.root_path, "static")
-    return send_from_directory(static_dir, "favicon.ico", mimetype="image/x-icon")
+    return file_delivery.send_from(static_dir, "favicon.ico", mimetype="image/x-icon", max_age=86400)
 
 @app.get("/favicon.png", endpoint="favicon_png")
 def favicon_png():
     static_dir = os.path.join(app.root_path, "static")
-    return send_from_directory(static_dir, "favicon.png", mimetype="image/png")
+    return file_delivery.send_from(static_dir, "favicon.png", mimetype="image/png", max_age=86400)
 
 # Filet de sécurité global : rollback si une exception survient dans la requête
 @app.teardown_request
@@ -928,23 +1054,24 @@ def _rollback_on_teardown(exc):
 # -------------------------------------------------------------------
 @app.route("/", endpoint="index")
 def index():
+    # 9 en vedette + une page "autres", lus dans le classement précalculé (ranking_snapshot) ;
+    # la suite se charge via /professionals?after=...
+    top_n = 9
+    wanted = top_n + keyset.DEFAULT_PAGE_SIZE
     try:
-        base = (
-            db.session.query(Professional)
-            .outerjoin(ProfessionalOrder, ProfessionalOrder.professional_id == Professional.id)
-            .filter(Professional.status == 'valide')
-            .order_by(
-                db.func.coalesce(ProfessionalOrder.order_priority, 999999).asc(),
-                Professional.is_featured.desc(),
-                db.func.coalesce(Professional.featured_rank, 999999).asc(),
-                Professional.created_at.desc(),
-                Professional.id.desc()
-            )
-        )
-        top_professionals = base.limit(9).all()
-        top_ids = [p.id for p in top_professionals]
-        more_professionals = base.filter(~Professional.id.in_(top_ids)).all() if top_ids else base.offset(9).all()
+        keys = ranking_snapshot.head(wanted + 1)
+        ids = [k[-1] for k in keys[:wanted]]
+        by_id = {
+            p.id: p for p in Professional.query.filter(
+                Professional.id.in_(ids), Professional.status == 'valide'
+            ).all()
+        } if ids else {}
+        ranked_pros = [by_id[i] for i in ids if i in by_id]
+        more_cursor = keyset.encode_cursor(keys[wanted - 1]) if len(keys) > wanted else None
+        top_professionals = ranked_pros[:top_n]
+        more_professionals = ranked_pros[top_n:]
     except Exception as e:
+        db.session.rollback()
         app.logger.warning("Classement admin indisponible (%s), fallback 'featured puis récents'.", e)
         fb = (
             Professional.query
@@ -956,9 +1083,10 @@ def index():
                 Professional.id.desc()
             )
         )
-        top_professionals = fb.limit(9).all()
-        top_ids = [p.id for p in top_professionals]
-        more_professionals = fb.filter(~Professional.id.in_(top_ids)).all() if top_ids else fb.offset(9).all()
+        first = fb.limit(wanted).all()
+        more_cursor = None
+        top_professionals = first[:top_n]
+        more_professionals = first[top_n:]
 
     cities = _ui_cities()
     specialties = _ui_specialties()
@@ -967,6 +1095,7 @@ def index():
     return render_template("index.html",
         top_professionals=top_professionals,
         more_professionals=more_professionals,
+        more_url=(url_for("professionals", after=more_cursor) if more_cursor else None),
         cities=cities, families=families, specialties=specialties
     )
 
@@ -983,28 +1112,25 @@ def about():
 def contact():
     return render_template("contact.html")
 
-@app.route("/professionals", endpoint="professionals")
-def professionals():
-    q = (request.args.get("q") or "").strip()
-    city = (request.args.get("city") or "").strip()
-    city_id = request.args.get("city_id", type=int)
-    family = (request.args.get("family") or "").strip()
-    specialty = (request.args.get("specialty") or "").strip()
-    specialty_id = request.args.get("specialty_id", type=int)
-    mode = (request.args.get("mode") or "").strip().lower()
+def _directory_query(args):
+    """
+    Filtres publics de l'annuaire (pros validés).
+    Retourne (query, rank|None, near|None) ; near = (distance_expr, k|None) si lat/lng fournis.
+    """
+    q = (args.get("q") or "").strip()
+    city = (args.get("city") or "").strip()
+    city_id = args.get("city_id", type=int)
+    family = (args.get("family") or "").strip()
+    specialty = (args.get("specialty") or "").strip()
+    specialty_id = args.get("specialty_id", type=int)
+    mode = (args.get("mode") or "").strip().lower()
     if mode == "visio":
         mode = "en_ligne"
 
     qry = Professional.query.filter_by(status='valide')
 
-    if q:
-        like = f"%{q}%"
-        conds = []
-        for attr in ("name", "full_name", "description", "specialty", "location", "address"):
-            if hasattr(Professional, attr):
-                conds.append(getattr(Professional, attr).ilike(like))
-        if conds:
-            qry = qry.filter(or_(*conds))
+    # Plein texte (tsvector/GIN) ; rank=None si q vide
+    qry, rank = apply_text_search(qry, q)
 
     if city_id is not None and hasattr(Professional, "city_id"):
         qry = qry.filter(Professional.city_id == city_id)
@@ -1012,24 +1138,67 @@ def professionals():
         qry = qry.filter(Professional.location.ilike(f"%{city}%"))
 
     if specialty_id is not None and hasattr(Professional, "primary_specialty_id"):
-        qry = qry.filter(Professional.primary_specialty_id == specialty_id)
+        # Principale ou secondaire : mêmes pros que le compteur de facet_index
+        qry = qry.filter(or_(
+            Professional.primary_specialty_id == specialty_id,
+            Professional.specialties.any(Specialty.id == specialty_id),
+        ))
     elif specialty and hasattr(Professional, "specialty"):
         qry = qry.filter(Professional.specialty.ilike(f"%{specialty}%"))
 
     if family:
-        like_family = family
-        qry = qry.filter(
-            or_(
-                Professional.primary_specialty.has(Specialty.category.ilike(like_family)),
-                Professional.specialties.any(Specialty.category.ilike(like_family)),
-                Professional.specialty.ilike(f"%{family}%"),
-            )
-        )
+        qry = qry.filter(family_index.family_filter(family, [f["name"] for f in _ui_families_rows()]))
 
-    if mode and hasattr(Professional, "consultation_types"):
-        qry = qry.filter(Professional.consultation_types.ilike(f"%{mode}%"))
+    if mode:
+        mode_crit = Professional.mode_filter(mode)
+        if mode_crit is not None:
+            qry = qry.filter(mode_crit)
 
-    pros = qry.order_by(Professional.is_featured.desc(), Professional.created_at.desc()).all()
+    # Près de moi (lat/lng [+ radius_km | k]) : index geohash + distance exacte
+    qry, dist, k = geo_search.apply_geo(qry, args)
+    near = (dist, k) if dist is not None else None
+
+    return qry, rank, near
+
+def _directory_facets(args):
+    """Compteurs ville/famille/spécialité/mode pour les filtres courants (None si indisponible)."""
+    def _text_ids(textual):
+        qry, _, _ = _directory_query(MultiDict(textual))
+        return [r[0] for r in qry.with_entities(Professional.id).all()]
+    try:
+        return facet_index.facet_counts(args, text_ids=_text_ids)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning("Facettes indisponibles: %s", e)
+        return None
+
+@app.route("/professionals", endpoint="professionals")
+def professionals():
+    q = (request.args.get("q") or "").strip()
+    specialty = (request.args.get("specialty") or "").strip()
+
+    qry, rank, near = _directory_query(request.args)
+    dist, k = near if near else (None, None)
+    after = (request.args.get("after") or "").strip() or None
+    try:
+        cached = _cached_directory_page(request.args, qry, rank, after, keyset.DEFAULT_PAGE_SIZE) if not near else None
+    except keyset.InvalidCursor:
+        after, cached = None, None
+    if cached is not None:
+        pros, next_cursor = cached
+    else:
+        try:
+            pros, next_cursor = keyset.page(qry, after, k or keyset.DEFAULT_PAGE_SIZE, rank=rank, distance=dist)
+        except keyset.InvalidCursor:
+            pros, next_cursor = keyset.page(qry, None, k or keyset.DEFAULT_PAGE_SIZE, rank=rank, distance=dist)
+    if k:
+        next_cursor = None  # mode "k plus proches" : une seule page
+
+    next_url = None
+    if next_cursor:
+        nav_args = request.args.to_dict()
+        nav_args["after"] = next_cursor
+        next_url = url_for("professionals", **nav_args)
 
     cities = _ui_cities()
     specialties = _ui_specialties()
@@ -1037,9 +1206,101 @@ def professionals():
 
     return render_template("professionals.html",
                            professionals=pros,
+                           next_cursor=next_cursor, next_url=next_url,
+                           facets=_directory_facets(request.args),
+                           distances=_distances_for(pros, request.args),
                            specialty=specialty, search_query=q,
                            cities=cities, families=families, specialties=specialties)
 
+def _load_in_order(ids):
+    """Pros chargés par clé primaire, dans l'ordre de `ids`."""
+    if not ids:
+        return []
+    by_id = {p.id: p for p in Professional.query.filter(Professional.id.in_(ids)).all()}
+    return [by_id[i] for i in ids if i in by_id]
+
+def _cached_directory_page(args, qry, rank, cursor, limit):
+    """
+    (pros, next_cursor) servi depuis result_cache (clés de classement du jeu de filtres),
+    ou None si la page sort de la liste en cache — keyset.page() prend alors le relais.
+    """
+    key = result_cache.cache_key("directory", args)
+    keys = result_cache.get_or_compute(
+        key, lambda: keyset.ordered_keys(qry, rank, limit=result_cache.MAX_IDS + 1)
+    )
+    sliced = keyset.page_from_keys(keys, cursor, limit, cap=result_cache.MAX_IDS)
+    if sliced is None:
+        return None
+    ids, next_cursor = sliced
+    return _load_in_order(ids), next_cursor
+
+def _distances_for(pros, args) -> dict:
+    """{pro_id: km} pour l'affichage quand une position est fournie."""
+    geo = geo_search.parse_geo_args(args)
+    if geo is None:
+        return {}
+    lat, lng = geo[0], geo[1]
+    return {
+        p.id: round(geo_search.haversine_km(lat, lng, p.latitude, p.longitude), 1)
+        for p in pros if p.latitude is not None and p.longitude is not None
+    }
+
+@app.route("/api/professionals", methods=["GET"], endpoint="api_professionals")
+def api_professionals():
+    """Page JSON (scroll infini) : mêmes filtres que /professionals + ?after=<curseur>&limit=n."""
+    qry, rank, near = _directory_query(request.args)
+    dist, k = near if near else (None, None)
+    limit = k or request.args.get("limit", type=int) or keyset.DEFAULT_PAGE_SIZE
+    limit = max(1, min(limit, keyset.MAX_PAGE_SIZE))
+    try:
+        pros, next_cursor = keyset.page(qry, request.args.get("after") or None, limit, rank=rank, distance=dist)
+    except keyset.InvalidCursor:
+        return jsonify({"error": "invalid_cursor"}), 400
+    if k:
+        next_cursor = None
+    distances = _distances_for(pros, request.args)
+
+    items = []
+    for p in pros:
+        items.append({
+            "id": p.id,
+            "name": p.name,
+            "specialty": p.primary_specialty.name if p.primary_specialty else p.specialty,
+            "city": p.city.name if p.city else p.location,
+            "consultation_types": p.consultation_types_list,
+            "certified_tighri": bool(p.certified_tighri),
+            "approved_anthecc": bool(p.approved_anthecc),
+            "photo_url": url_for("profile_photo", professional_id=p.id),
+            "profile_url": url_for("professional_detail", professional_id=p.id),
+            "distance_km": distances.get(p.id),
+        })
+    return jsonify({"items": items, "next": next_cursor})
+
+@app.route("/api/suggest", methods=["GET"], endpoint="api_suggest")
+def api_suggest():
+    """Autocomplétion de la barre de recherche (index en mémoire, sans requête SQL en régime établi)."""
+    q = (request.args.get("q") or "").strip()
+    try:
+        items = suggest_index.suggest(q, request.args.get("limit", type=int) or 8)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning("Suggestions indisponibles: %s", e)
+        items = []
+
+    for it in items:
+        if it["type"] == "professional":
+            it["url"] = url_for("professional_detail", professional_id=it["id"])
+        elif it["type"] == "specialty":
+            it["url"] = url_for("professionals", specialty_id=it["id"])
+        elif it["type"] == "family":
+            it["url"] = url_for("professionals", family=it["id"])
+        else:
+            it["url"] = url_for("professionals", city_id=it["id"])
+
+    resp = jsonify({"q": q, "suggestions": items})
+    resp.headers["Cache-Control"] = "public, max-age=60"
+    return resp
+
 @app.route("/professional/<int:professional_id>", endpoint="professional_detail")
 def professional_detail(professional_id: int):
     professional = Professional.query.get_or_404(professional_id)
@@ -1050,47 +1311,35 @@ def professional_detail(professional_id: int):
 # -------------------------------------------------------------------
 @app.route("/media/profile/<int:professional_id>", endpoint="profile_photo")
 def profile_photo(professional_id: int):
-    pro = Professional.query.get_or_404(professional_id)
-    raw_url = (pro.image_url or "").strip()
-
-    if raw_url.startswith("/media/profiles/"):
-        fname = raw_url.split("/media/profiles/")[-1]
-        safe_name = os.path.basename(fname)
-        fpath = UPLOAD_FOLDER / safe_name
-        if fpath.exists():
-            resp = send_from_directory(str(UPLOAD_FOLDER), safe_name, as_attachment=False, conditional=True)
-            resp.headers["Cache-Control"] = "public, max-age=31536000"
-            return resp
-        return _avatar_fallback_response()
+    # Résolution mémorisée (avatar_cache) : ni requête ni stat() disque en régime établi
+    entry = _avatar_entry(professional_id)
+    kind = entry["kind"]
+    if kind is None:
+        abort(404)
 
-    if not raw_url:
-        file_path = _avatar_file_for(professional_id)
-        if file_path and os.path.isfile(file_path):
-            return send_from_directory(AVATAR_DIR, os.path.basename(file_path), max_age=60*60*24*7)
-        if os.path.isfile(PLACEHOLDER_AVATAR):
-            return send_from_directory(os.path.join(app.root_path, "static"), "avatar_default.webp", max_age=86400)
-        return _avatar_fallback_response()
+    if kind == "profile":
+        return _send_profile_file(entry["path"])
 
-    if raw_url.startswith("http://"):
-        raw_url = "https://" + raw_url[len("http://"):]
-    parsed = urlparse(raw_url)
-    if parsed.scheme not in ("http", "https"):
-        return _avatar_fallback_response()
+    if kind == "file":
+        if entry["etag"] and request.if_none_match.contains(entry["etag"]):
+            resp = make_response("", 304)
+        elif os.path.isfile(entry["path"]):
+            resp = file_delivery.send(entry["path"])
+        else:
+            avatar_cache.invalidate(professional_id)
+            return _avatar_fallback_response()
+        resp.set_etag(entry["etag"])
+        resp.headers["Cache-Control"] = f"public, max-age={60*60*24*7}"
+        return resp
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (compatible; TighriBot/1.0; +https://www.tighri.com)",
-        "Referer": "https://www.tighri.com",
-    }
-    try:
-        r = requests.get(raw_url, headers=headers, timeout=8, stream=True)
-        r.raise_for_status()
-    except Exception:
+    if kind == "placeholder":
+        if entry["path"]:
+            return file_delivery.send(entry["path"], max_age=86400)
         return _avatar_fallback_response()
 
-    content_type = r.headers.get("Content-Type", "image/jpeg")
-    resp = Response(r.content, mimetype=content_type)
-    resp.headers["Cache-Control"] = "public, max-age=86400"
-    return resp
+    # Image distante : cache disque + revalidation conditionnelle (photo_proxy)
+    resp = photo_proxy.send(entry["source"])
+    return resp if resp is not None else _avatar_fallback_response()
 
 @app.route("/media/profile/<int:professional_id>/<int:index>", endpoint="profile_photo_n")
 def profile_photo_n(professional_id: int, index: int):
@@ -1106,22 +1355,11 @@ def profile_photo_n(professional_id: int, index: int):
     if url and (url.startswith("http://") or url.startswith("https://")):
         if url.startswith("http://"):
             url = "https://" + url[len("http://"):]
-        try:
-            r = requests.get(url, timeout=8, stream=True)
-            r.raise_for_status()
-        except Exception:
-            return _avatar_fallback_response()
-        resp = Response(r.content, mimetype=r.headers.get("Content-Type", "image/jpeg"))
-        resp.headers["Cache-Control"] = "public, max-age=86400"
-        return resp
+        resp = photo_proxy.send(url)
+        return resp if resp is not None else _avatar_fallback_response()
 
     if url:
-        fname = url.split("/u/profiles/")[-1]
-        fpath = UPLOAD_FOLDER / os.path.basename(fname)
-        if fpath.exists():
-            resp = send_from_directory(str(UPLOAD_FOLDER), os.path.basename(fname), conditional=True)
-            resp.headers["Cache-Control"] = "public, max-age=31536000"
-            return resp
+        return _send_profile_file(url.split("/u/profiles/")[-1])
 
     return _avatar_fallback_response()
 
@@ -1155,7 +1393,7 @@ def professional_upload_photo():
             flash("Veuillez sélectionner une image.", "warning")
             return redirect(url_for("professional_upload_photo"))
         try:
-            saved_name = _process_and_save_profile_image(file)
+            saved_name = _process_and_save_profile_image(file, pro, "image_url")
             pro.image_url = f"/u/profiles/{saved_name}"
             db.session.commit()
             flash("Photo de profil mise à jour avec succès.", "success")
@@ -1190,8 +1428,8 @@ def professional_upload_photo_n(index: int):
             flash("Veuillez sélectionner une image.", "warning")
             return redirect(url_for("professional_upload_photo_n", index=index))
         try:
-            saved_name = _process_and_save_profile_image(file)
             field = "image_url" if index == 1 else ("image_url2" if index == 2 else "image_url3")
+            saved_name = _process_and_save_profile_image(file, pro, field)
             setattr(pro, field, f"/u/profiles/{saved_name}")
             db.session.commit()
             flash(f"Photo #{index} mise à jour avec succès.", "success")
@@ -1660,7 +1898,12 @@ def professional_availability():
         flash("Profil professionnel non trouvé"); return redirect(url_for("index"))
 
     if request.method == "POST":
-        ProfessionalAvailability.query.filter_by(professional_id=professional.id).delete()
+        # Suppression par objet (et non en masse) : le flush voit les anciennes plages et
+        # invalide les disponibilités matérialisées, même si aucune plage n'est recréée
+        for old_window in ProfessionalAvailability.query.filter_by(professional_id=professional.id).all():
+            db.session.delete(old_window)
+        # Grille enregistrée, même vide : plus de plages par défaut (slot_engine.FALLBACK_WINDOWS)
+        professional.availability_saved_at = datetime.utcnow()
 
         def add_window(day, s, e, flag):
             s = (s or "").strip(); e = (e or "").strip()
@@ -2021,7 +2264,15 @@ def professional_appointment_action(appointment_id: int, action: str):
     except Exception:
         pass
 
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError as e:
+        # Réactivation d'un rendez-vous dont le créneau a été repris entre-temps (booking_guard.py)
+        db.session.rollback()
+        if not booking_guard.is_slot_conflict(e):
+            raise
+        flash("Créneau déjà pris par un autre rendez-vous.", "warning")
+        return redirect(request.referrer or url_for("professional_appointments"))
     flash("Rendez-vous mis à jour.", "success")
     return redirect(request.referrer or url_for("professional_appointments"))
 
@@ -3370,16 +3621,9 @@ def _build_professional_query_from_args(args):
     # elif hasattr(Professional, "is_active"):
     #     qs = qs.filter(Professional.is_active.is_(True))
 
-    # 3) Recherche plein texte simple
+    # 3) Recherche plein texte (tsvector/GIN, classement ts_rank)
     q = (args.get("q") or "").strip()
-    if q:
-        like = f"%{q}%"
-        conds = []
-        for attr in ("name", "full_name", "description", "specialty", "location", "address"):
-            if hasattr(Professional, attr):
-                conds.append(getattr(Professional, attr).ilike(like))
-        if conds:
-            qs = qs.filter(or_(*conds))
+    qs, rank = apply_text_search(qs, q)
 
     # 4) Ville
     city_id = args.get("city_id", type=int)
@@ -3394,13 +3638,7 @@ def _build_professional_query_from_args(args):
     family = (args.get("family") or "").strip()
     if family:
         try:
-            qs = qs.filter(
-                or_(
-                    Professional.primary_specialty.has(Specialty.category.ilike(family)),
-                    Professional.specialties.any(Specialty.category.ilike(family)),
-                    Professional.specialty.ilike(f"%{family}%"),
-                )
-            )
+            qs = qs.filter(family_index.family_filter(family, [f["name"] for f in _ui_families_rows()]))
         except Exception:
             pass
 
@@ -3423,10 +3661,19 @@ def _build_professional_query_from_args(args):
     mode = (args.get("mode") or "").strip().lower()
     if mode == "visio":
         mode = "en_ligne"
-    if mode and hasattr(Professional, "consultation_types"):
-        qs = qs.filter(Professional.consultation_types.ilike(f"%{mode}%"))
-
-    # 8) Tri
+    if mode:
+        mode_crit = Professional.mode_filter(mode)
+        if mode_crit is not None:
+            qs = qs.filter(mode_crit)
+
+    # 7bis) Près de moi (lat/lng [+ radius_km | k])
+    qs, dist, _k = geo_search.apply_geo(qs, args)
+
+    # 8) Tri (distance, sinon pertinence si recherche texte)
+    if dist is not None:
+        qs = qs.order_by(dist.asc())
+    if rank is not None:
+        qs = qs.order_by(rank.desc())
     if hasattr(Professional, "is_featured"):
         qs = qs.order_by(Professional.is_featured.desc(), Professional.created_at.desc())
     elif hasattr(Professional, "created_at"):
@@ -3436,41 +3683,94 @@ def _build_professional_query_from_args(args):
 
     return qs
 
+def _professionals_from_args(args, limit: int):
+    """
+    Résultats de _build_professional_query_from_args, ids ordonnés mis en cache
+    (result_cache). Les recherches géolocalisées ne sont pas mises en cache.
+    """
+    if geo_search.parse_geo_args(args) is not None:
+        return _build_professional_query_from_args(args).limit(limit).all()
+    key = result_cache.cache_key("builder", args)
+    ids = result_cache.get_or_compute(key, lambda: [
+        r[0] for r in _build_professional_query_from_args(args)
+        .with_entities(Professional.id).limit(result_cache.MAX_IDS).all()
+    ])
+    return _load_in_order(ids[:limit])
+
+def _first_available_ranking(args):
+    """[(id, premier créneau | None)] pour les filtres de `args`, trié par prochaine disponibilité."""
+    def compute():
+        # Endpoint public : seuls les pros validés sont classés (le constructeur ne filtre pas le statut)
+        candidates = (_build_professional_query_from_args(args)
+                      .filter(Professional.status == 'valide')
+                      .with_entities(Professional.id, Professional.consultation_duration_minutes,
+                                     Professional.buffer_between_appointments_minutes)
+                      .limit(first_available.MAX_CANDIDATES).all())
+        return first_available.rank(candidates)
+    if geo_search.parse_geo_args(args) is not None:
+        return compute()
+    return first_available.get_or_compute(result_cache.cache_key("first_available", args), compute)
+
+@app.route("/api/professionals/first-available", methods=["GET"], endpoint="api_first_available")
+def api_first_available():
+    """
+    Pros triés par premier créneau libre (horizon first_available.HORIZON_DAYS) : mêmes
+    filtres que /professionals + ?after=<position>&limit=n.
+    """
+    raw_after = request.args.get("after") or "0"
+    if not raw_after.isdigit():
+        return jsonify({"error": "invalid_cursor"}), 400
+    offset = int(raw_after)
+    limit = request.args.get("limit", type=int) or keyset.DEFAULT_PAGE_SIZE
+    limit = max(1, min(limit, keyset.MAX_PAGE_SIZE))
+
+    ranked = _first_available_ranking(request.args)
+    window = ranked[offset:offset + limit]
+    pros = {p.id: p for p in _load_in_order([pid for pid, _ in window])}
+
+    items = []
+    for pid, slot in window:
+        p = pros.get(pid)
+        if p is None:
+            continue
+        items.append({
+            "id": p.id,
+            "name": p.name,
+            "specialty": p.primary_specialty.name if p.primary_specialty else p.specialty,
+            "city": p.city.name if p.city else p.location,
+            "photo_url": professional_avatar_url(p),
+            "profile_url": url_for("professional_detail", professional_id=p.id),
+            "booking_url": url_for("patient_availability", professional_id=p.id),
+            "next_slot": slot.strftime("%Y-%m-%d %H:%M") if slot else None,
+        })
+    next_offset = offset + limit
+    return jsonify({"items": items, "next": str(next_offset) if next_offset < len(ranked) else None})
+
 # ---------- Prendre RDV (formulaire) ----------
 @app.route("/patient/booking", methods=["GET"], endpoint="patient_booking")
 @login_required
 def patient_booking():
     _require_patient()
 
-    # Sélections filtres
-    try:
-        cities = City.query.order_by(City.name).all()
-    except Exception:
-        cities = []
-    try:
-        families = Family.query.order_by(Family.name).all()
-    except Exception:
-        families = []
-    try:
-        specialties = Specialty.query.order_by(Specialty.name).all()
-    except Exception:
-        specialties = []
+    # Sélections filtres (cache référentiels)
+    cities = _ui_cities()
+    families = _ui_families_rows()
+    specialties = _ui_specialties()
 
-    # Pros listés (construction depuis l'URL)
+    # Pros listés (construction depuis l'URL, résultats en cache)
     try:
-        qs = _build_professional_query_from_args(request.args)
+        pros = _professionals_from_args(request.args, 12)
     except Exception:
+        db.session.rollback()
+        # (sécurité) appliquer professional_id si présent même en cas d'exception au-dessus
         qs = Professional.query
-
-    # (sécurité) appliquer professional_id si présent même en cas d'exception au-dessus
-    prof_id = request.args.get("professional_id", type=int)
-    if prof_id:
-        qs = qs.filter(Professional.id == prof_id)
-
-    try:
-        pros = qs.limit(12).all()
-    except Exception:
-        pros = []
+        prof_id = request.args.get("professional_id", type=int)
+        if prof_id:
+            qs = qs.filter(Professional.id == prof_id)
+        try:
+            pros = qs.limit(12).all()
+        except Exception:
+            pros = []
 
     # Fallback si rien
     fallback = False
@@ -3490,6 +3790,7 @@ def patient_booking():
         "patient/booking.html",
         "Prendre un rendez-vous",
         cities=cities, families=families, specialties=specialties,
+        facets=_directory_facets(request.args),
         pros=pros, professionals=pros, pro=first_pro,
         fallback=fallback
     )
@@ -3501,8 +3802,7 @@ if "patient_resources" not in app.view_functions:
     def patient_resources():
         _require_patient()
         try:
-            qs = _build_professional_query_from_args(request.args)
-            professionals = qs.limit(100).all()
+            professionals = _professionals_from_args(request.args, 100)
         except Exception:
             professionals = []
 
@@ -3554,10 +3854,12 @@ if "patient_resources" not in app.view_functions:
 @login_required
 def patient_resources_api():
     _require_patient()
-    qs = _build_professional_query_from_args(request.args).limit(50).all()
+    qs = _professionals_from_args(request.args, 50)
+    distances = _distances_for(qs, request.args)
     payload = []
     for p in qs:
         payload.append({
+            "distance_km": distances.get(p.id),
             "id": p.id,
             "name": getattr(p, "name", None),
             "specialty": (
@@ -3923,102 +4225,6 @@ def book_appointment(professional_id: int):
 #   DISPONIBILITÉS PATIENT
 # =========================
 
-def _get_availability_model():
-    for name in (
-        "ProfessionalDayWindow",
-        "AvailabilityWindow",
-        "ProfessionalAvailabilityWindow",
-        "WorkingWindow",
-        "AvailabilitySlotDefinition",
-    ):
-        if name in globals():
-            return globals()[name]
-    return None
-
-def _weekly_windows_for(professional_id: int):
-    Model = _get_availability_model()
-    result = {i: [] for i in range(7)}
-    if not Model:
-        return result
-
-    try:
-        q = Model.query.filter(getattr(Model, "professional_id") == professional_id)
-        rows = q.all()
-        from datetime import time as _Time
-        for r in rows:
-            wd = int(getattr(r, "weekday"))
-            s = getattr(r, "start_time")
-            e = getattr(r, "end_time")
-            def _to_time(v):
-                if isinstance(v, _Time): return v
-                if isinstance(v, str) and v:
-                    hh, mm = v.split(":")[:2]
-                    return _Time(int(hh), int(mm))
-                return None
-            ts, te = _to_time(s), _to_time(e)
-            if ts and te and 0 <= wd <= 6:
-                result[wd].append((ts, te))
-        for k in result:
-            result[k].sort(key=lambda t: (t[0].hour, t[0].minute))
-    except Exception:
-        pass
-    return result
-
-def _session_settings_for(pro):
-    duration = 60
-    buffer_m = 0
-    try:
-        profile = getattr(pro, "profile", None)
-        if profile:
-            duration = int(getattr(profile, "session_duration_minutes", duration) or duration)
-            buffer_m = int(getattr(profile, "buffer_between_sessions_minutes", buffer_m) or buffer_m)
-        duration = int(getattr(pro, "session_duration_minutes", duration) or duration)
-        buffer_m = int(getattr(pro, "buffer_between_sessions_minutes", buffer_m) or buffer_m)
-    except Exception:
-        pass
-    duration = max(15, min(duration, 180))
-    buffer_m = max(0, min(buffer_m, 60))
-    return duration, buffer_m
-
-def _build_slots_from_weekly(pro, start_date: date, days: int):
-    weekly = _weekly_windows_for(pro.id)
-    duration, buffer_m = _session_settings_for(pro)
-    step = duration + buffer_m
-    slots = []
-    for i in range(days):
-        day = start_date + timedelta(days=i)
-        wd = day.weekday()
-        for (t1, t2) in weekly.get(wd, []):
-            cur = datetime.combine(day, t1)
-            end = datetime.combine(day, t2)
-            while cur + timedelta(minutes=duration) <= end:
-                slots.append(cur.replace(second=0, microsecond=0))
-                cur += timedelta(minutes=step)
-    if not slots:
-        for i in range(days):
-            day = start_date + timedelta(days=i)
-            for h in range(9, 17):
-                slots.append(datetime.combine(day, dtime(hour=h)).replace(second=0, microsecond=0))
-    return slots
-
-def _taken_keys_for(professional_id: int, start_date: date, days: int):
-    start_dt = datetime.combine(start_date, dtime.min)
-    end_dt   = datetime.combine(start_date + timedelta(days=days), dtime.min)
-    taken = set()
-    try:
-        q = Appointment.query.filter(Appointment.professional_id == professional_id)
-        dt_field = Appointment.appointment_date if hasattr(Appointment, "appointment_date") else getattr(Appointment, "start_at")
-        q = q.filter(dt_field >= start_dt, dt_field < end_dt)
-        if hasattr(Appointment, "status"):
-            q = q.filter(Appointment.status.in_(["confirmed", "requested"]))
-        for a in q.all():
-            dt = getattr(a, "appointment_date", None) or getattr(a, "start_at", None)
-            if isinstance(dt, datetime):
-                taken.add(dt.replace(second=0, microsecond=0))
-    except Exception:
-        pass
-    return taken
-
 # -- 1) Page d’affichage des créneaux patient --------------------------------
 @app.route("/patient/availability/<int:professional_id>", methods=["GET"], endpoint="patient_availability")
 @login_required
@@ -4027,27 +4233,67 @@ def patient_availability(professional_id: int):
     pro = Professional.query.get_or_404(professional_id)
     days = int(request.args.get("days", 7))
     days = max(1, min(days, 30))
-    start_date = datetime.utcnow().date()
-
-    all_slots = _build_slots_from_weekly(pro, start_date, days)
-    taken = _taken_keys_for(professional_id, start_date, days)
-
-    grouped = {}
-    for dt in all_slots:
-        key = dt.replace(second=0, microsecond=0)
-        d = key.strftime("%Y-%m-%d")
-        grouped.setdefault(d, []).append({
-            "iso": key.strftime("%Y-%m-%d %H:%M"),
-            "time": key.strftime("%H:%M"),
-            "free": key not in taken
-        })
+    now = datetime.utcnow()
+
+    # Bitmaps journaliers matérialisés (availability_bitmap), construits par slot_engine
+    calendar = availability_bitmap.calendar(pro, now.date(), days)
+    grouped = slot_engine.grouped_by_day(calendar, not_before=now)
+
+    # Options temporaires (slot_holds) : la sienne est à confirmer, celles des autres bloquent
+    my_hold = None
+    try:
+        holds = slot_holds.active(pro.id, now, now + timedelta(days=days + 1))
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning("Options de créneau illisibles: %s", e)
+        holds = {}
+    by_iso = {at.strftime("%Y-%m-%d %H:%M"): h for at, h in holds.items()}
+    for slots in grouped.values():
+        for s in slots:
+            h = by_iso.get(s["iso"])
+            s["mine"] = bool(h and s["free"] and h[0] == current_user.id)
+            s["held"] = bool(h and s["free"] and h[0] != current_user.id)
+            if s["mine"]:
+                my_hold = {"iso": s["iso"], "expires_at": h[1]}
 
     return render_or_text(
         "patient/availability.html",
         "Choisir un créneau",
-        professional=pro, grouped_slots=grouped, days=days
+        professional=pro, grouped_slots=grouped, days=days, my_hold=my_hold
     )
 
+def _parse_slot_when(when: str):
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M"):
+        try:
+            return datetime.strptime(when, fmt)
+        except ValueError:
+            continue
+    return None
+
+@app.route("/patient/slots/hold", methods=["POST"], endpoint="patient_hold_slot")
+@login_required
+def patient_hold_slot():
+    _require_patient()
+    pro_id = request.form.get("professional_id", type=int)
+    days = request.form.get("days", type=int) or 7
+    appt_dt = _parse_slot_when((request.form.get("when") or "").strip())
+    if not pro_id or not appt_dt:
+        flash("Créneau invalide.", "warning")
+        return redirect(url_for("patient_home"))
+
+    pro = Professional.query.get_or_404(pro_id)
+    back = url_for("patient_availability", professional_id=pro_id, days=days)
+    calendar = availability_bitmap.calendar(pro, appt_dt.date(), 1)
+    if appt_dt < datetime.utcnow() or not calendar.is_free(appt_dt):
+        flash("Ce créneau vient d’être pris, choisissez un autre créneau.", "warning")
+        return redirect(back)
+
+    expires_at = slot_holds.acquire(pro_id, current_user.id, appt_dt)
+    db.session.commit()
+    if expires_at is None:
+        flash("Ce créneau est en cours de réservation par un autre patient, choisissez-en un autre.", "warning")
+    return redirect(back)
+
 @app.route("/patient/appointments/confirm", methods=["POST"], endpoint="patient_confirm_booking")
 @login_required
 def patient_confirm_booking():
@@ -4059,28 +4305,16 @@ def patient_confirm_booking():
         return redirect(url_for("patient_home"))
 
     pro = Professional.query.get_or_404(pro_id)
-    appt_dt = None
-    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M"):
-        try:
-            appt_dt = datetime.strptime(when, fmt)
-            break
-        except ValueError:
-            continue
+    appt_dt = _parse_slot_when(when)
     if not appt_dt:
         flash("Format de date/heure non reconnu.", "warning")
         return redirect(url_for("patient_availability", professional_id=pro_id))
 
-    try:
-        q = Appointment.query.filter(Appointment.professional_id == pro_id)
-        dt_field = Appointment.appointment_date if hasattr(Appointment, "appointment_date") else getattr(Appointment, "start_at")
-        q = q.filter(dt_field == appt_dt)
-        if hasattr(Appointment, "status"):
-            q = q.filter(Appointment.status.in_(["confirmed", "requested"]))
-        if q.first():
-            flash("Ce créneau vient d’être pris, choisissez un autre créneau.", "warning")
-            return redirect(url_for("patient_availability", professional_id=pro_id))
-    except Exception:
-        pass
+    # Créneau de la grille, à venir, et sans chevauchement (durée + marge) avec l'existant
+    calendar = availability_bitmap.calendar(pro, appt_dt.date(), 1)
+    if appt_dt < datetime.utcnow() or not calendar.is_free(appt_dt):
+        flash("Ce créneau vient d’être pris, choisissez un autre créneau.", "warning")
+        return redirect(url_for("patient_availability", professional_id=pro_id))
 
     kwargs = dict(patient_id=current_user.id, professional_id=pro_id)
     if hasattr(Appointment, "appointment_date"):
@@ -4090,9 +4324,23 @@ def patient_confirm_booking():
     if hasattr(Appointment, "status"):
         kwargs["status"] = "requested"
 
+    # L'option posée au choix du créneau devient le rendez-vous, dans la même transaction
+    if not slot_holds.claim(pro_id, current_user.id, appt_dt):
+        db.session.rollback()
+        flash("Ce créneau est en cours de réservation par un autre patient, choisissez-en un autre.", "warning")
+        return redirect(url_for("patient_availability", professional_id=pro_id))
+
+    # La contrainte d'exclusion tranche entre deux confirmations simultanées
     appt = Appointment(**kwargs)
     db.session.add(appt)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        if not booking_guard.is_slot_conflict(e):
+            raise
+        flash("Ce créneau vient d’être pris, choisissez un autre créneau.", "warning")
+        return redirect(url_for("patient_availability", professional_id=pro_id))
 
     try:
         if 'Notification' in globals():
@@ -4171,6 +4419,11 @@ def media_patient_file(file_id: int):
 from auditor import audit as audit_command
 app.cli.add_command(audit_command)
 
+@app.cli.command("blobs-gc")
+def blobs_gc_command():
+    """Supprime les pièces jointes (blobs) qui ne sont plus référencées."""
+    print(f"{blob_store.collect_garbage()} blob(s) supprimé(s)")
+
 # =========================
 #   BOOT (migrations légères + admin seed + TAXONOMIE)
 # =========================
@@ -4214,6 +4467,7 @@ def _bootstrap_taxonomy():
     except Exception as e:
         db.session.rollback()
         current_app.logger.warning("Bootstrap taxonomy commit: %s", e)
+    taxonomy_cache.invalidate()
 
     current_app.logger.info(
         "Taxonomy seed → villes +%d, spécialités +%d, catégories complétées %d",
@@ -4244,6 +4498,27 @@ with app.app_context():
             "ALTER TABLE professionals ADD COLUMN IF NOT EXISTS primary_specialty_id INTEGER REFERENCES specialties(id) ON DELETE SET NULL;",
             "ALTER TABLE professionals ADD COLUMN IF NOT EXISTS image_url2 TEXT;",
             "ALTER TABLE professionals ADD COLUMN IF NOT EXISTS image_url3 TEXT;",
+            "ALTER TABLE professionals ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;",
+            "CREATE INDEX IF NOT EXISTS ix_professionals_search_vector ON professionals USING GIN (search_vector);",
+            # --- classement (keyset) : mêmes expressions que keyset.ranking_columns()
+            "ALTER TABLE professionals ADD COLUMN IF NOT EXISTS ranking_priority INTEGER;",
+            "DROP INDEX IF EXISTS ix_professionals_ranking;",
+            "CREATE INDEX IF NOT EXISTS ix_professionals_ranking_priority ON professionals (status, (COALESCE(ranking_priority, 999999)), (COALESCE(is_featured, false)) DESC, (COALESCE(featured_rank, 999999)), (COALESCE(created_at, '1970-01-01'::timestamp)) DESC, id DESC);",
+            "CREATE INDEX IF NOT EXISTS ix_professional_order_priority ON professional_order (order_priority, professional_id);",
+            # --- géolocalisation : geohash indexé pour les recherches par préfixe
+            "ALTER TABLE professionals ADD COLUMN IF NOT EXISTS geohash VARCHAR(12);",
+            "CREATE INDEX IF NOT EXISTS ix_professionals_geohash ON professionals (geohash varchar_pattern_ops);",
+            # --- modes de consultation : masque (1 cabinet, 2 domicile, 4 en_ligne) + index partiels
+            "ALTER TABLE professionals ADD COLUMN IF NOT EXISTS consultation_modes SMALLINT;",
+            "CREATE INDEX IF NOT EXISTS ix_professionals_mode_cabinet ON professionals (id) WHERE (consultation_modes & 1) <> 0;",
+            "CREATE INDEX IF NOT EXISTS ix_professionals_mode_domicile ON professionals (id) WHERE (consultation_modes & 2) <> 0;",
+            "CREATE INDEX IF NOT EXISTS ix_professionals_mode_en_ligne ON professionals (id) WHERE (consultation_modes & 4) <> 0;",
+            # --- familles dénormalisées (family_index.py)
+            "ALTER TABLE professionals ADD COLUMN IF NOT EXISTS family_keys TEXT[];",
+            "CREATE INDEX IF NOT EXISTS ix_professionals_family_keys ON professionals USING GIN (family_keys);",
+            # --- plages hebdomadaires déjà saisies (slot_engine : pas de plages par défaut)
+            "ALTER TABLE professionals ADD COLUMN IF NOT EXISTS availability_saved_at TIMESTAMP;",
+            "UPDATE professionals AS p SET availability_saved_at = now() WHERE p.availability_saved_at IS NULL AND EXISTS (SELECT 1 FROM professional_availabilities AS a WHERE a.professional_id = p.id);",
 
             # --- users : colonnes OAuth / reset / profil
             "ALTER TABLE users ADD COLUMN IF NOT EXISTS phone VARCHAR(30);",
@@ -4281,6 +4556,9 @@ with app.app_context():
             "CREATE INDEX IF NOT EXISTS ix_threads_pro ON message_threads(professional_id);",
             "CREATE INDEX IF NOT EXISTS ix_threads_patient ON message_threads(patient_id);",
 
+            # --- appointments : plage occupée (trigger + contrainte d'exclusion, booking_guard.py)
+            "ALTER TABLE appointments ADD COLUMN IF NOT EXISTS slot_range TSRANGE;",
+
             # Compat rétro
             "ALTER TABLE therapy_sessions ADD COLUMN IF NOT EXISTS started_at TIMESTAMP;",
             "UPDATE therapy_sessions SET started_at = start_at WHERE started_at IS NULL AND start_at IS NOT NULL;",
@@ -4314,6 +4592,55 @@ with app.app_context():
         db.session.rollback()
         app.logger.warning(f"Mini-migration colonnes: {e}")
 
+    # --- Recherche plein texte : unaccent + indexation des lignes existantes
+    try:
+        install_search_schema(app)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning("Recherche plein texte indisponible (%s), fallback ILIKE.", e)
+
+    # --- Rendez-vous : exclusion des chevauchements par la base
+    try:
+        booking_guard.install_booking_constraint(app)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning("Contrainte de réservation indisponible: %s", e)
+
+    # --- Géolocalisation : geohash des pros déjà géolocalisés
+    try:
+        geo_search.backfill_geohashes()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning("Backfill geohash: %s", e)
+
+    # --- Photos : travaux d'images interrompus par un redémarrage
+    try:
+        image_worker.resume_pending()
+    except Exception as e:
+        app.logger.warning("Reprise des traitements d'images: %s", e)
+
+    # --- Modes de consultation : masque des lignes existantes
+    try:
+        backfill_consultation_modes()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning("Backfill consultation_modes: %s", e)
+
+    # --- Classement : copie de professional_order.order_priority dans professionals
+    try:
+        keyset.sync_priorities(db.session.connection())
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning("Synchronisation ranking_priority: %s", e)
+
+    # --- Familles dénormalisées : remplissage puis filtre indexé
+    try:
+        family_index.install_family_index()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning("Index des familles indisponible (%s), filtre EXISTS conservé.", e)
+
     # --- Taxonomy étendue
     try:
         _bootstrap_taxonomy()
@@ -0,0 +1,319 @@
+# availability_bitmap.py
+# Disponibilités matérialisées par professionnel et par jour (table availability_days).
+#
+# Pour chaque (professionnel, jour) : deux bitmaps de 288 bits (un bit = 5 minutes,
+# 36 octets en bytea) —
+#   open_bits : plages hebdomadaires du jour (arrondies vers l'intérieur) ;
+#   busy_bits : indisponibilités + rendez-vous actifs + séances, élargis de la marge
+#               (arrondis vers l'extérieur, donc jamais trop optimistes).
+# Un créneau [t, t + durée) est libre si tous ses quanta sont ouverts et aucun occupé :
+# deux masques sur des entiers Python, O(1). La page de choix de créneau lit au plus
+# 30 lignes et parcourt les bits ; aucune requête sur appointments.
+#
+# Construction paresseuse : les jours absents (ou plus vieux que MAX_AGE) sont calculés
+# par slot_engine.load sur l'intervalle manquant et insérés (sans écraser une ligne plus
+# récente). Invalidation dans la transaction d'écriture : tout flush qui touche un
+# rendez-vous, une séance ou une indisponibilité supprime les jours concernés ; une
+# modification des plages hebdomadaires, de la durée ou de la marge supprime toutes les
+# lignes du professionnel. Aucun recalcul au commit : la lecture suivante reconstruit.
+# Verrou consultatif par professionnel : exclusif pour l'écriture (pris au flush, tenu
+# jusqu'au commit), partagé pour la construction à la lecture, qui calcule sous ce verrou.
+# Une lecture concurrente ne peut donc pas réinsérer un jour calculé avant le commit.
+# MAX_AGE n'est qu'un filet de sécurité, pas la borne de fraîcheur.
+
+import os
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import bindparam, event, inspect, select, text
+
+from extensions import db
+import slot_engine
+
+QUANTUM = 5
+QUANTA = 24 * 60 // QUANTUM
+NBYTES = QUANTA // 8
+MAX_AGE = timedelta(seconds=int(os.getenv("AVAILABILITY_BITMAP_MAX_AGE", str(6 * 3600))))
+_LOCK_NAMESPACE = 0x5107  # pg_advisory_xact_lock(namespace, professional_id)
+
+_TRACKED_DT = {"appointments": "appointment_date", "therapy_sessions": "start_at"}
+_SETTINGS_FIELDS = ("consultation_duration_minutes", "buffer_between_appointments_minutes", "availability_saved_at")
+
+
+# -------------------------------------------------------------------
+# Bits
+# -------------------------------------------------------------------
+def _span(first: int, last: int) -> int:
+    """Masque des quanta [first, last)."""
+    first, last = max(first, 0), min(last, QUANTA)
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
+def open_mask(intervals) -> int:
+    bits = 0
+    for start, end in intervals:
+        bits |= _span(-(-start // QUANTUM), end // QUANTUM)
+    return bits
+
+
+def busy_mask(intervals) -> int:
+    bits = 0
+    for start, end in intervals:
+        bits |= _span(start // QUANTUM, -(-end // QUANTUM))
+    return bits
+
+
+def pack(bits: int) -> bytes:
+    return bits.to_bytes(NBYTES, "little")
+
+
+def unpack(raw) -> int:
+    return int.from_bytes(bytes(raw or b""), "little")
+
+
+def _runs(bits: int):
+    """[(premier quantum, longueur)] des suites de bits à 1."""
+    out = []
+    while bits:
+        low = (bits & -bits).bit_length() - 1
+        shifted = bits >> low
+        length = (shifted ^ (shifted + 1)).bit_length() - 1
+        out.append((low, length))
+        bits &= ~(((1 << length) - 1) << low)
+    return out
+
+
+class DayBitmapCalendar:
+    """Même interface que slot_engine.Calendar, calculée sur les bitmaps journaliers."""
+
+    def __init__(self, start_date, days: int, rows: dict, duration: int, buffer: int):
+        self.start_date = start_date
+        self.days = days
+        self.duration = duration
+        self.buffer = buffer
+        self._rows = rows  # date -> (open_bits, busy_bits)
+
+    @property
+    def step(self) -> int:
+        return self.duration + self.buffer
+
+    def _slot_mask(self, minute: int) -> int:
+        return _span(minute // QUANTUM, -(-(minute + self.duration) // QUANTUM))
+
+    def _day_grid(self, day, limit_minute=None):
+        open_bits, busy_bits = self._rows.get(day, (0, 0))
+        step = self.step
+        for first, length in _runs(open_bits):
+            t, end = first * QUANTUM, (first + length) * QUANTUM
+            if limit_minute is not None and t < limit_minute:
+                t += -(-(limit_minute - t) // step) * step
+            while t + self.duration <= end:
+                yield t, not (busy_bits & self._slot_mask(t))
+                t += step
+
+    def grid(self, not_before: datetime = None):
+        out = []
+        for d in range(self.days):
+            day = self.start_date + timedelta(days=d)
+            limit = None
+            if not_before is not None:
+                if day < not_before.date():
+                    continue
+                if day == not_before.date():
+                    limit = not_before.hour * 60 + not_before.minute + (1 if not_before.second or not_before.microsecond else 0)
+            origin = datetime.combine(day, time.min)
+            out.extend((origin + timedelta(minutes=t), free) for t, free in self._day_grid(day, limit))
+        return out
+
+    def free_slots(self, not_before: datetime = None):
+        return [dt for dt, free in self.grid(not_before) if free]
+
+    def first_free(self, not_before: datetime = None):
+        for dt, free in self.grid(not_before):
+            if free:
+                return dt
+        return None
+
+    def is_free(self, dt: datetime) -> bool:
+        """Créneau de la grille et libre : deux tests de masque."""
+        if dt.second or dt.microsecond or dt.date() not in self._rows:
+            return False
+        open_bits, busy_bits = self._rows[dt.date()]
+        minute = dt.hour * 60 + dt.minute
+        mask = self._slot_mask(minute)
+        if not mask or (open_bits & mask) != mask or busy_bits & mask:
+            return False
+        for first, length in _runs(open_bits):
+            start = first * QUANTUM
+            if start <= minute < (first + length) * QUANTUM:
+                return (minute - start) % self.step == 0
+        return False
+
+
+# -------------------------------------------------------------------
+# Lecture / construction
+# -------------------------------------------------------------------
+def _rows_from_calendar(cal: slot_engine.Calendar):
+    rows = {}
+    for d in range(cal.days):
+        windows, busy = cal.day_intervals(d)
+        rows[cal.start_date + timedelta(days=d)] = (open_mask(windows), busy_mask(busy))
+    return rows
+
+
+def _lock(conn, professional_id: int, shared: bool = False):
+    if conn.dialect.name == "postgresql":
+        fn = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+        conn.execute(text(f"SELECT {fn}(:ns, :pid)"), {"ns": _LOCK_NAMESPACE, "pid": professional_id})
+
+
+def _write(conn, professional_id: int, rows: dict, overwrite: bool):
+    now = datetime.utcnow()
+    conflict = (
+        "DO UPDATE SET open_bits = EXCLUDED.open_bits, busy_bits = EXCLUDED.busy_bits, computed_at = EXCLUDED.computed_at"
+        if overwrite else
+        # Construction paresseuse : ne remplace qu'une ligne périmée, jamais un recalcul récent
+        "DO UPDATE SET open_bits = EXCLUDED.open_bits, busy_bits = EXCLUDED.busy_bits, computed_at = EXCLUDED.computed_at "
+        "WHERE availability_days.computed_at < :stale_before"
+    )
+    conn.execute(
+        text(
+            "INSERT INTO availability_days (professional_id, day, open_bits, busy_bits, computed_at) "
+            f"VALUES (:pid, :day, :open_bits, :busy_bits, :now) ON CONFLICT (professional_id, day) {conflict}"
+        ),
+        [
+            {"pid": professional_id, "day": day, "open_bits": pack(o), "busy_bits": pack(b),
+             "now": now, "stale_before": now - MAX_AGE}
+            for day, (o, b) in sorted(rows.items())
+        ],
+    )
+
+
+def calendar(pro, start_date, days: int) -> DayBitmapCalendar:
+    """Calendrier de `pro` sur `days` jours, depuis les bitmaps (jours manquants construits)."""
+    duration, buffer_m = slot_engine.session_settings(pro)
+    end_date = start_date + timedelta(days=days)
+    stale_before = datetime.utcnow() - MAX_AGE
+    from models import AvailabilityDay
+    rows = {}
+    for day, o, b, computed_at in db.session.execute(
+        select(AvailabilityDay.day, AvailabilityDay.open_bits, AvailabilityDay.busy_bits, AvailabilityDay.computed_at)
+        .where(AvailabilityDay.professional_id == pro.id, AvailabilityDay.day >= start_date, AvailabilityDay.day < end_date)
+    ):
+        if computed_at is not None and computed_at >= stale_before:
+            rows[day] = (unpack(o), unpack(b))
+
+    missing = [start_date + timedelta(days=d) for d in range(days) if start_date + timedelta(days=d) not in rows]
+    if missing and pro.id in db.session.info.get("availability_locked", ()):
+        # Cette transaction a déjà écrit pour ce pro (verrou exclusif) : calcul direct sur
+        # la session, qui voit ses propres écritures, et rien n'est mémorisé
+        first, last = missing[0], missing[-1]
+        built = _rows_from_calendar(slot_engine.load(pro.id, first, (last - first).days + 1))
+        rows.update({day: bits for day, bits in built.items() if day in set(missing)})
+    elif missing:
+        first, last = missing[0], missing[-1]
+        span = (last - first).days + 1
+        try:
+            with db.engine.begin() as conn:
+                # Calcul sous verrou partagé : une réservation en cours (verrou exclusif) est
+                # attendue puis vue, jamais réinsérée périmée après son commit
+                _lock(conn, pro.id, shared=True)
+                built = _rows_from_calendar(slot_engine.load(pro.id, first, span, conn=conn))
+                built = {day: bits for day, bits in built.items() if day in set(missing)}
+                _write(conn, pro.id, built, overwrite=False)
+                conn.execute(
+                    text("DELETE FROM availability_days WHERE professional_id = :pid AND day < :limit"),
+                    {"pid": pro.id, "limit": start_date - timedelta(days=7)},
+                )
+        except Exception as e:
+            # Matérialisation impossible : calcul direct, rien n'est mémorisé
+            from flask import current_app
+            current_app.logger.warning("Bitmaps de disponibilité du pro %s non écrits: %s", pro.id, e)
+            built = _rows_from_calendar(slot_engine.load(pro.id, first, span))
+            built = {day: bits for day, bits in built.items() if day in set(missing)}
+        rows.update(built)
+    return DayBitmapCalendar(start_date, days, rows, duration, buffer_m)
+
+
+def invalidate(conn, professional_id: int, days=None) -> None:
+    """
+    Supprime les jours `days` (tous si None) de `professional_id`, sous verrou exclusif
+    tenu jusqu'à la fin de la transaction de `conn`.
+    """
+    _lock(conn, professional_id)
+    if days is None:
+        conn.execute(text("DELETE FROM availability_days WHERE professional_id = :pid"), {"pid": professional_id})
+        return
+    days = sorted(set(days))
+    if days:
+        conn.execute(
+            text("DELETE FROM availability_days WHERE professional_id = :pid AND day IN :days")
+            .bindparams(bindparam("days", expanding=True)),
+            {"pid": professional_id, "days": days},
+        )
+
+
+# -------------------------------------------------------------------
+# Invalidation dans la transaction d'écriture (hook de session)
+# -------------------------------------------------------------------
+def _days_around(dt):
+    # Une séance (durée <= 180 min + marge <= 60) peut déborder sur le jour voisin
+    if not isinstance(dt, datetime):
+        return ()
+    return {(dt - timedelta(minutes=60)).date(), dt.date(), (dt + timedelta(minutes=240)).date()}
+
+
+def _history_values(obj, attr):
+    hist = inspect(obj).attrs[attr].history
+    return list(hist.added or ()) + list(hist.deleted or ()) + list(hist.unchanged or ())
+
+
+def collect_writes(session):
+    """({(pro, jour)}, {pro}) touchés par les écritures en attente de `session`."""
+    from models import Professional, ProfessionalAvailability, UnavailableSlot
+    days, pros = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table in _TRACKED_DT:
+            # Anciennes et nouvelles valeurs : un rendez-vous déplacé libère son ancien jour
+            for pid in _history_values(obj, "professional_id"):
+                for dt in _history_values(obj, _TRACKED_DT[table]):
+                    if pid:
+                        days.update((pid, day) for day in _days_around(dt))
+        elif isinstance(obj, UnavailableSlot):
+            for pid in _history_values(obj, "professional_id"):
+                for day in _history_values(obj, "date"):
+                    if pid and day:
+                        days.add((pid, day))
+        elif isinstance(obj, ProfessionalAvailability):
+            pros.update(pid for pid in _history_values(obj, "professional_id") if pid)
+        elif isinstance(obj, Professional) and obj in session.dirty:
+            state = inspect(obj)
+            if any(state.attrs[f].history.has_changes() for f in _SETTINGS_FIELDS):
+                pros.add(obj.id)
+    return days, pros
+
+
+@event.listens_for(db.session, "after_flush")
+def _invalidate_after_flush(session, flush_context):
+    days, pros = collect_writes(session)
+    if not days and not pros:
+        return
+    by_pro = {}
+    for pid, day in days:
+        if pid not in pros:
+            by_pro.setdefault(pid, set()).add(day)
+    conn = session.connection()
+    pids = sorted(pros | set(by_pro))
+    for pid in pids:  # ordre fixe : pas d'interblocage entre transactions
+        invalidate(conn, pid, by_pro.get(pid))
+    session.info.setdefault("availability_locked", set()).update(pids)
+
+
+@event.listens_for(db.session, "after_commit")
+def _release_after_commit(session):
+    session.info.pop("availability_locked", None)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _release_after_rollback(session):
+    session.info.pop("availability_locked", None)
@@ -0,0 +1,127 @@
+# avatar_cache.py
+# Résolution mémorisée de la photo principale d'un professionnel.
+#
+# Sans photo (image_url vide), /media/profile/<id> faisait à chaque requête un
+# Professional.query.get_or_404 pour lire une colonne, puis os.path.isdir + jusqu'à
+# quatre os.path.isfile dans static/avatars ; les cartes ajoutaient les stat() des
+# déclinaisons pour le srcset. Une page de 50 cartes = 50 requêtes SQL et des centaines
+# de stat().
+#
+# Ici, id -> entrée résolue {"kind", "path", "url", "srcset", "etag"} :
+#   kind = "profile" (photo locale /u/profiles/…), "file" (static/avatars/<id>.*),
+#          "remote" (URL externe, servie par le proxy), "placeholder", ou None (pro inconnu) ;
+#   url  = URL finale à mettre directement dans les gabarits.
+# Rempli paresseusement (app.py fournit la fonction de résolution), borné par TTL
+# (AVATAR_CACHE_TTL) et taille (AVATAR_CACHE_SIZE). Toute transaction qui crée, supprime
+# ou modifie la photo d'un professionnel incrémente la version partagée "avatars"
+# (shared_version.py) ; une entrée construite sous une autre version est recalculée, dans
+# tous les workers gunicorn. Le worker qui écrit retire aussi l'entrée au commit ;
+# invalidate(pid) (+ bump_version(conn) côté base) pour les écritures hors ORM.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+
+from extensions import db
+import shared_version
+
+VERSION_NAME = "avatars"
+TTL_SECONDS = int(os.getenv("AVATAR_CACHE_TTL", "600"))
+MAX_ENTRIES = int(os.getenv("AVATAR_CACHE_SIZE", "20000"))
+PHOTO_FIELDS = ("image_url", "image_url2", "image_url3")
+
+_lock = threading.Lock()
+_entries = OrderedDict()   # pid -> (expire_à, version partagée, entrée)
+_state = {"generation": 0}
+
+
+def get(pid: int, compute):
+    """
+    Entrée résolue pour `pid`, sinon `compute()`, qui renvoie (entrée, mémorisable) :
+    mémorisable=False pour une valeur provisoire (photo en cours de traitement).
+    """
+    now = time.monotonic()
+    shared = shared_version.current(VERSION_NAME)
+    with _lock:
+        found = _entries.get(pid)
+        if found is not None and found[0] > now and found[1] == shared:
+            _entries.move_to_end(pid)
+            return found[2]
+        generation = _state["generation"]
+
+    entry, cache = compute()
+
+    if cache:
+        with _lock:
+            if generation == _state["generation"]:
+                _entries[pid] = (now + TTL_SECONDS, shared, entry)
+                _entries.move_to_end(pid)
+                while len(_entries) > MAX_ENTRIES:
+                    _entries.popitem(last=False)
+    return entry
+
+
+def bump_version(conn):
+    """Écriture de photo hors ORM : rend les entrées des autres workers caduques au commit de `conn`."""
+    shared_version.bump(conn, VERSION_NAME)
+
+
+def invalidate(pid: int = None):
+    with _lock:
+        _state["generation"] += 1
+        if pid is None:
+            _entries.clear()
+        else:
+            _entries.pop(pid, None)
+
+
+def size() -> int:
+    with _lock:
+        return len(_entries)
+
+
+# -------------------------------------------------------------------
+# Invalidation sur écriture
+# -------------------------------------------------------------------
+def _photo_changed(obj) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[f].history.has_changes() for f in PHOTO_FIELDS if f in state.attrs)
+
+
+@event.listens_for(db.session, "before_flush")
+def _collect_photo_writes(session, flush_context, instances):
+    from models import Professional
+    ids = session.info.setdefault("avatar_dirty", set())
+    for obj in session.dirty:
+        if isinstance(obj, Professional) and obj.id and _photo_changed(obj):
+            ids.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Professional) and obj.id:
+            ids.add(obj.id)
+
+
+@event.listens_for(db.session, "after_flush")
+def _collect_new_professionals(session, flush_context):
+    from models import Professional
+    for obj in session.new:
+        if isinstance(obj, Professional) and obj.id:
+            session.info.setdefault("avatar_dirty", set()).add(obj.id)  # entrée "inconnu" éventuelle
+    if session.info.get("avatar_dirty") and not session.info.get("avatar_bumped"):
+        bump_version(session.connection())  # une fois par transaction
+        session.info["avatar_bumped"] = True
+
+
+@event.listens_for(db.session, "after_commit")
+def _invalidate_after_commit(session):
+    session.info.pop("avatar_bumped", None)
+    for pid in session.info.pop("avatar_dirty", ()):
+        invalidate(pid)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("avatar_dirty", None)
+    session.info.pop("avatar_bumped", None)
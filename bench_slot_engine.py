@@ -0,0 +1,49 @@
+# bench_slot_engine.py
+# Micro-benchmark du moteur de créneaux (sans base) : horizon de 30 jours, trois plages
+# par jour ouvré, une quarantaine de rendez-vous et quelques indisponibilités.
+#
+#   python bench_slot_engine.py [nombre_d_itérations]
+
+import random
+import sys
+import timeit
+from datetime import date
+
+import slot_engine
+
+
+def build_inputs(days: int = 30, seed: int = 7):
+    rnd = random.Random(seed)
+    weekly = {wd: [(9 * 60, 12 * 60), (13 * 60, 17 * 60), (18 * 60, 20 * 60)] for wd in range(5)}
+    weekly[5] = [(9 * 60, 13 * 60)]
+    duration, buffer_m = 45, 15
+    busy = []
+    for _ in range(40):  # rendez-vous sur la grille, élargis de la marge
+        d = rnd.randrange(days)
+        t = d * 24 * 60 + 9 * 60 + rnd.randrange(8) * (duration + buffer_m)
+        busy.append((t - buffer_m, t + duration + buffer_m))
+    for _ in range(4):  # indisponibilités
+        d = rnd.randrange(days)
+        t = d * 24 * 60 + rnd.choice((10, 14, 18)) * 60
+        busy.append((t, t + 90))
+    return weekly, busy, duration, buffer_m
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    weekly, busy, duration, buffer_m = build_inputs()
+    start = date(2025, 3, 3)
+
+    def run():
+        cal = slot_engine.Calendar(start, 30, weekly, busy, duration, buffer_m)
+        return cal.grid()
+
+    slots = run()
+    per_call = min(timeit.repeat(run, number=number, repeat=5)) / number
+    free = sum(1 for _, ok in slots if ok)
+    print(f"30 jours : {len(slots)} créneaux ({free} libres), {per_call * 1000:.3f} ms par calcul "
+          f"(construction du Calendar comprise)")
+
+
+if __name__ == "__main__":
+    main()
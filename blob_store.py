@@ -0,0 +1,245 @@
+# blob_store.py
+# Stockage adressé par contenu des pièces jointes (/u/attachments/…).
+#
+# Un fichier est nommé d'après son SHA-256 (+ extension d'origine) et rangé dans
+# BLOB_ROOT/ab/cd/<sha256><ext> : le même PDF envoyé à 200 patients, ou la même note
+# vocale transférée, n'est écrit qu'une fois, et aucun dossier ne grossit sans limite.
+# Les URL restent de la forme /u/attachments/<nom> : u_attachments reconnaît les noms
+# "blob" et sert les anciens noms uuid depuis le dossier plat historique.
+#
+# Table `blobs` : une ligne par contenu, ref_count tenu à jour dans la transaction
+# (hooks de flush) d'après FileAttachment.file_url, Message.audio_url et
+# Exercise.file_url. collect_garbage() (flask blobs-gc) recompte puis supprime les
+# contenus qui ne sont plus référencés, ainsi que les fichiers restés sans ligne.
+# put() et la collecte d'un même contenu sont sérialisés par un verrou consultatif.
+
+import os
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import bindparam, event, inspect, text
+
+from extensions import db
+from models import FileAttachment, Message, Exercise
+import media_transcode
+import upload_stream
+
+_UPLOAD_ROOT = Path(os.getenv("UPLOAD_ROOT", Path(__file__).resolve().parent / "uploads"))
+BLOB_ROOT = Path(os.getenv("BLOB_ROOT", _UPLOAD_ROOT / "blobs"))
+URL_PREFIX = "/u/attachments/"
+GC_GRACE = timedelta(days=1)  # un upload pas encore rattaché n'est pas collecté
+_LOCK_NAMESPACE = 0x5108  # pg_advisory_xact_lock(namespace, hashtext(nom))
+
+_NAME_RE = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]{1,10})?$")
+
+
+def is_blob_name(name: str) -> bool:
+    return bool(_NAME_RE.match(name or ""))
+
+
+def blob_path(name: str) -> Path:
+    return BLOB_ROOT / name[:2] / name[2:4] / name
+
+
+def name_from_url(url: str):
+    """Nom de blob référencé par une URL /u/attachments/<nom>, sinon None."""
+    if not url or not url.startswith(URL_PREFIX):
+        return None
+    name = url[len(URL_PREFIX):].split("?", 1)[0]
+    return name if is_blob_name(name) else None
+
+
+def _lock_name(conn, name: str):
+    # Sérialise put() et la collecte pour un même contenu (fichier et ligne)
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:ns, hashtext(:name))"), {"ns": _LOCK_NAMESPACE, "name": name})
+
+
+def put(stream, suffix: str = "") -> str:
+    """
+    Écrit le contenu de `stream` (copie en flux avec plafond par type, hachage à la volée,
+    puis renommage) et enregistre le blob. Retourne le nom à utiliser dans /u/attachments/<nom>.
+    upload_stream.UploadTooLarge (ValueError) si le plafond du type est dépassé.
+
+    La ligne est validée sur sa propre connexion, avant le fichier et indépendamment de la
+    transaction de l'appelant : si celui-ci annule, le blob reste sans référence et sera
+    collecté après GC_GRACE. created_at est rafraîchi à chaque envoi, pour qu'un ancien
+    contenu non référencé renvoyé à l'instant ne soit pas collecté avant son rattachement.
+    """
+    suffix = (suffix or "").lower()
+    if suffix and not re.match(r"^\.[a-z0-9]{1,10}$", suffix):
+        suffix = ""
+    tmp, sha256, size = upload_stream.stream_to_temp(stream, BLOB_ROOT, upload_stream.size_limit(suffix))
+    name = sha256 + suffix
+    try:
+        with db.engine.begin() as conn:
+            _lock_name(conn, name)
+            conn.execute(
+                text(
+                    "INSERT INTO blobs (name, size_bytes, ref_count, created_at) "
+                    "VALUES (:name, :size, 0, :now) "
+                    "ON CONFLICT (name) DO UPDATE SET created_at = EXCLUDED.created_at"
+                ),
+                {"name": name, "size": size, "now": datetime.utcnow()},
+            )
+            target = blob_path(name)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, target)  # même contenu : remplacement atomique sans effet
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return name
+
+
+def recount():
+    """
+    Recalcule ref_count depuis les tables (rattrape les suppressions faites hors ORM,
+    ex. ON DELETE CASCADE des messages d'un fil).
+    """
+    db.session.execute(text(f"""
+        WITH refs AS (
+            SELECT substr(url, {len(URL_PREFIX) + 1}) AS name, count(*) AS n
+              FROM (SELECT file_url AS url FROM file_attachments
+                    UNION ALL SELECT audio_url FROM messages
+                    UNION ALL SELECT file_url FROM exercises) u
+             WHERE url LIKE '{URL_PREFIX}%'
+             GROUP BY 1
+        )
+        UPDATE blobs b SET ref_count = COALESCE(r.n, 0)
+          FROM blobs b2 LEFT JOIN refs r ON r.name = b2.name
+         WHERE b.name = b2.name AND b.ref_count IS DISTINCT FROM COALESCE(r.n, 0)
+    """))
+
+
+def _unlink_unless_registered(name: str) -> bool:
+    """Supprime le fichier de `name` si aucune ligne ne le référence (sous le verrou de put())."""
+    with db.engine.begin() as conn:
+        _lock_name(conn, name)
+        if conn.execute(text("SELECT 1 FROM blobs WHERE name = :name"), {"name": name}).first():
+            return False  # renvoyé entre-temps
+        try:
+            os.unlink(blob_path(name))
+        except OSError:
+            return False
+    media_transcode.discard(name)
+    return True
+
+
+def sweep_orphan_files() -> int:
+    """Supprime les fichiers de BLOB_ROOT sans ligne (ex. arrêt brutal), au-delà de GC_GRACE."""
+    limit = (datetime.utcnow() - GC_GRACE).timestamp()
+    removed = 0
+    batch = []
+
+    def _flush():
+        nonlocal removed
+        known = {
+            n for (n,) in db.session.execute(
+                text("SELECT name FROM blobs WHERE name IN :names").bindparams(bindparam("names", expanding=True)),
+                {"names": batch},
+            )
+        }
+        db.session.rollback()
+        removed += sum(1 for n in batch if n not in known and _unlink_unless_registered(n))
+        batch.clear()
+
+    if not BLOB_ROOT.is_dir():
+        return 0
+    for path in BLOB_ROOT.glob("??/??/*"):
+        if not is_blob_name(path.name):
+            continue
+        try:
+            if path.stat().st_mtime >= limit:
+                continue
+        except OSError:
+            continue
+        batch.append(path.name)
+        if len(batch) >= 500:
+            _flush()
+    if batch:
+        _flush()
+    return removed
+
+
+def collect_garbage() -> int:
+    """Supprime les blobs non référencés (au-delà de GC_GRACE), puis les fichiers orphelins."""
+    recount()
+    rows = db.session.execute(
+        text("DELETE FROM blobs WHERE ref_count <= 0 AND created_at < :limit RETURNING name"),
+        {"limit": datetime.utcnow() - GC_GRACE},
+    ).all()
+    db.session.commit()
+    removed = sum(1 for (name,) in rows if _unlink_unless_registered(name))
+    return removed + sweep_orphan_files()
+
+
+# -------------------------------------------------------------------
+# Comptage des références
+# -------------------------------------------------------------------
+_TRACKED = ((FileAttachment, "file_url"), (Message, "audio_url"), (Exercise, "file_url"))
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+# active_history : l'ancienne URL est chargée même si l'attribut était expiré,
+# sinon un remplacement après commit ne décrémenterait pas l'ancien blob.
+for _model, _attr in _TRACKED:
+    event.listen(getattr(_model, _attr), "set", _keep_old_value, active_history=True, retval=True)
+
+
+def _collect_deltas(session):
+    deltas = {}
+
+    def _add(url, n):
+        name = name_from_url(url)
+        if name:
+            deltas[name] = deltas.get(name, 0) + n
+
+    for model, attr in _TRACKED:
+        for obj in session.new:
+            if isinstance(obj, model):
+                _add(getattr(obj, attr), 1)
+        for obj in session.dirty:
+            if isinstance(obj, model):
+                hist = inspect(obj).attrs[attr].history
+                for url in hist.added or ():
+                    _add(url, 1)
+                for url in hist.deleted or ():
+                    _add(url, -1)
+        for obj in session.deleted:
+            if isinstance(obj, model):
+                hist = inspect(obj).attrs[attr].history
+                _add(hist.deleted[0] if hist.deleted else getattr(obj, attr), -1)
+    return {k: v for k, v in deltas.items() if v}
+
+
+@event.listens_for(db.session, "before_flush")
+def _count_refs_before_flush(session, flush_context, instances):
+    # L'historique des attributs n'est fiable qu'avant le flush
+    deltas = _collect_deltas(session)
+    if deltas:
+        pending = session.info.setdefault("blob_ref_deltas", {})
+        for name, n in deltas.items():
+            pending[name] = pending.get(name, 0) + n
+
+
+@event.listens_for(db.session, "after_flush")
+def _apply_refs_after_flush(session, flush_context):
+    pending = session.info.pop("blob_ref_deltas", None)
+    if not pending:
+        return
+    session.connection().execute(
+        text("UPDATE blobs SET ref_count = ref_count + :n WHERE name = :name"),
+        [{"name": name, "n": n} for name, n in sorted(pending.items())],
+    )
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("blob_ref_deltas", None)
@@ -0,0 +1,157 @@
+# booking_guard.py
+# Exclusion des réservations qui se chevauchent, garantie par PostgreSQL.
+#
+# patient_confirm_booking vérifiait le créneau puis insérait : deux patients pouvaient
+# passer la vérification en même temps, et rien n'empêchait des rendez-vous décalés de
+# quelques minutes de se chevaucher. Désormais :
+#   - appointments.slot_range (tsrange) = [début, début + durée + marge) du pro, rempli
+#     par un trigger BEFORE INSERT / UPDATE (toutes les écritures sont couvertes, y compris
+#     celles faites hors de l'application) et recalculé pour les rendez-vous à venir quand
+#     le pro change sa durée ou sa marge (trigger AFTER UPDATE sur professionals) ;
+#   - contrainte d'exclusion GiST (btree_gist) : même professional_id et plages qui se
+#     recouvrent interdits, pour les statuts actifs seulement (slot_engine.ACTIVE_APPOINTMENT_STATUSES) ;
+#   - l'insertion concurrente perdante reçoit une IntegrityError (SQLSTATE 23P01), que
+#     is_slot_conflict() reconnaît : la route affiche « Ce créneau vient d'être pris ».
+# Deux rendez-vous [a, a + d + m) et [b, b + d + m) sont disjoints si et seulement si
+# |a - b| >= d + m : même règle que la grille de slot_engine, sans verrou applicatif.
+# Si des chevauchements existent déjà en base, la contrainte n'est pas posée (avertissement
+# au démarrage, vérification applicative seule) jusqu'à leur résolution.
+
+from sqlalchemy import text
+
+from extensions import db
+from slot_engine import ACTIVE_APPOINTMENT_STATUSES, DEFAULT_BUFFER, DEFAULT_DURATION
+
+CONSTRAINT_NAME = "ex_appointments_professional_slot"
+EXCLUSION_VIOLATION = "23P01"
+
+_ACTIVE_SQL = ", ".join(f"'{s}'" for s in ACTIVE_APPOINTMENT_STATUSES)
+
+# Mêmes bornes que slot_engine.session_settings
+_RANGE_SQL = f"""
+    SELECT tsrange(
+        a.appointment_date,
+        a.appointment_date + make_interval(mins =>
+            GREATEST(15, LEAST(COALESCE(p.consultation_duration_minutes, {DEFAULT_DURATION}), 180))
+            + GREATEST(0, LEAST(COALESCE(p.buffer_between_appointments_minutes, {DEFAULT_BUFFER}), 60))),
+        '[)')
+"""
+
+_TRIGGER_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION appointments_slot_range() RETURNS trigger AS $$
+BEGIN
+    NEW.slot_range := (
+        {_RANGE_SQL.replace("a.appointment_date", "NEW.appointment_date")}
+        FROM (SELECT 1) AS one
+        LEFT JOIN professionals AS p ON p.id = NEW.professional_id
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+_TRIGGER = """
+DO $$
+BEGIN
+    -- status inclus : un rendez-vous réactivé reprend la durée et la marge actuelles
+    DROP TRIGGER IF EXISTS trg_appointments_slot_range ON appointments;
+    CREATE TRIGGER trg_appointments_slot_range
+        BEFORE INSERT OR UPDATE OF appointment_date, professional_id, status ON appointments
+        FOR EACH ROW EXECUTE PROCEDURE appointments_slot_range();
+END $$;
+"""
+
+# Durée ou marge modifiée : les rendez-vous à venir du pro reprennent la nouvelle plage,
+# comme la grille de slot_engine. Un rendez-vous qui chevaucherait alors un autre garde
+# son ancienne plage (la grille le voit de toute façon occupé) plutôt que de bloquer la
+# modification du profil.
+_SETTINGS_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION professionals_slot_settings() RETURNS trigger AS $$
+DECLARE
+    appt RECORD;
+BEGIN
+    FOR appt IN
+        SELECT id FROM appointments
+        WHERE professional_id = NEW.id
+          AND appointment_date >= (now() AT TIME ZONE 'utc') - interval '1 day'
+    LOOP
+        BEGIN
+            UPDATE appointments AS a SET slot_range = (
+                {_RANGE_SQL} FROM professionals AS p WHERE p.id = a.professional_id
+            ) WHERE a.id = appt.id;
+        EXCEPTION WHEN exclusion_violation THEN
+            RAISE NOTICE USING MESSAGE = 'appointment ' || appt.id || ' : plage inchangée (chevauchement)';
+        END;
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+_SETTINGS_TRIGGER = """
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_professionals_slot_settings') THEN
+        CREATE TRIGGER trg_professionals_slot_settings
+            AFTER UPDATE OF consultation_duration_minutes, buffer_between_appointments_minutes ON professionals
+            FOR EACH ROW
+            WHEN (OLD.consultation_duration_minutes IS DISTINCT FROM NEW.consultation_duration_minutes
+                  OR OLD.buffer_between_appointments_minutes IS DISTINCT FROM NEW.buffer_between_appointments_minutes)
+            EXECUTE PROCEDURE professionals_slot_settings();
+    END IF;
+END $$;
+"""
+
+_BACKFILL = f"""
+UPDATE appointments AS a SET slot_range = ({_RANGE_SQL} FROM professionals AS p WHERE p.id = a.professional_id)
+WHERE a.slot_range IS NULL AND a.professional_id IS NOT NULL
+"""
+
+_CONSTRAINT = f"""
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = '{CONSTRAINT_NAME}') THEN
+        ALTER TABLE appointments ADD CONSTRAINT {CONSTRAINT_NAME}
+            EXCLUDE USING gist (professional_id WITH =, slot_range WITH &&)
+            WHERE (status IN ({_ACTIVE_SQL}));
+    END IF;
+END $$;
+"""
+
+
+def install_booking_constraint(app=None):
+    """
+    Boot : extension btree_gist, trigger de slot_range, rattrapage des lignes existantes
+    et contrainte d'exclusion. La colonne est créée par les mini-migrations de app.py.
+    """
+    try:
+        db.session.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gist;"))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        if app is not None:
+            app.logger.warning("Extension btree_gist indisponible: %s", e)
+
+    db.session.execute(text(_TRIGGER_FUNCTION))
+    db.session.execute(text(_TRIGGER))
+    db.session.execute(text(_SETTINGS_FUNCTION))
+    db.session.execute(text(_SETTINGS_TRIGGER))
+    db.session.execute(text(_BACKFILL))
+    db.session.commit()
+
+    try:
+        db.session.execute(text(_CONSTRAINT))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        if app is not None:
+            app.logger.warning(
+                "Contrainte d'exclusion des rendez-vous non posée (chevauchements existants ?): %s", e
+            )
+
+
+def is_slot_conflict(exc) -> bool:
+    """Vrai si `exc` (IntegrityError) vient de la contrainte d'exclusion des créneaux."""
+    orig = getattr(exc, "orig", exc)
+    code = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+    return code == EXCLUSION_VIOLATION
@@ -0,0 +1,246 @@
+# facet_index.py
+# Compteurs de facettes (ville / famille / spécialité / mode) pour les filtres de l'annuaire.
+#
+# Index bitmap en mémoire sur les pros validés : chaque pro reçoit une position,
+# chaque valeur de facette un entier Python dont les bits marquent les pros concernés.
+# Pour un jeu de filtres, les compteurs d'une facette = popcount(ET des autres filtres
+# & bitmap de la valeur) — comptage "disjonctif" : les options d'une liste déroulante
+# restent comptées comme si on changeait seulement cette liste.
+#
+# Les filtres non indexables (q, ville/spécialité en texte libre, position) sont résolus
+# par une seule requête d'ids fournie par l'appelant.
+# L'index est reconstruit après tout commit touchant un Professional, ou si les
+# référentiels ont changé (taxonomy_cache.version()), ou au-delà de FACET_INDEX_TTL.
+
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+from extensions import db
+import taxonomy_cache
+
+TTL_SECONDS = int(os.getenv("FACET_INDEX_TTL", "300"))
+MODES = ("cabinet", "domicile", "en_ligne")
+DIMENSIONS = ("city", "family", "specialty", "mode")
+
+_lock = threading.Lock()
+_state = {"index": None, "built_at": 0.0, "taxonomy_version": None}
+
+if hasattr(int, "bit_count"):
+    def _popcount(x: int) -> int:
+        return x.bit_count()
+else:  # Python < 3.10
+    def _popcount(x: int) -> int:
+        return bin(x).count("1")
+
+
+class FacetIndex:
+    def __init__(self, ids, bitmaps):
+        self.ids = ids              # position -> professional id
+        self.all = (1 << len(ids)) - 1
+        self.bitmaps = bitmaps      # dim -> {valeur: int}
+        self.positions = {pid: i for i, pid in enumerate(ids)}
+
+    def mask_for_ids(self, ids) -> int:
+        mask = 0
+        for pid in ids:
+            pos = self.positions.get(pid)
+            if pos is not None:
+                mask |= 1 << pos
+        return mask
+
+    def counts(self, selected: dict, base: int) -> dict:
+        out = {}
+        for dim in DIMENSIONS:
+            mask = base
+            for other, value in selected.items():
+                if other != dim:
+                    mask &= self.bitmaps[other].get(value, 0)
+            out[dim] = {v: _popcount(mask & bm) for v, bm in self.bitmaps[dim].items()}
+        total = base
+        for dim, value in selected.items():
+            total &= self.bitmaps[dim].get(value, 0)
+        out["total"] = _popcount(total)
+        return out
+
+
+def _build() -> FacetIndex:
+    from models import Professional, professional_specialties, CONSULTATION_MODE_BITS, consultation_modes_mask
+
+    tax = taxonomy_cache.get()
+    spec_cat = {sid: (s["category"] or "").strip() for sid, s in tax["specialty_by_id"].items()}
+    family_names = [f["name"] for f in tax["families"]]
+    family_folded = [(name, name.casefold()) for name in family_names]
+
+    rows = (
+        db.session.query(
+            Professional.id, Professional.city_id, Professional.primary_specialty_id,
+            Professional.specialty, Professional.consultation_modes, Professional.consultation_types,
+        )
+        .filter(Professional.status == 'valide')
+        .order_by(Professional.id.asc())
+        .all()
+    )
+    ids = [r[0] for r in rows]
+    positions = {pid: i for i, pid in enumerate(ids)}
+
+    secondary = {}
+    if ids:
+        pivot = db.session.execute(
+            db.select(professional_specialties.c.professional_id, professional_specialties.c.specialty_id)
+            .join(Professional, Professional.id == professional_specialties.c.professional_id)
+            .where(Professional.status == 'valide')
+        ).all()
+        for pid, sid in pivot:
+            secondary.setdefault(pid, set()).add(sid)
+
+    bitmaps = {dim: {} for dim in DIMENSIONS}
+
+    def _set(dim, value, bit):
+        bitmaps[dim][value] = bitmaps[dim].get(value, 0) | bit
+
+    for pid, city_id, primary_id, legacy_specialty, modes, types in rows:
+        bit = 1 << positions[pid]
+        if city_id is not None:
+            _set("city", city_id, bit)
+        specialty_ids = ({primary_id} | secondary.get(pid, set())) - {None}
+        for sid in specialty_ids:
+            _set("specialty", sid, bit)
+
+        families = set()
+        for sid in specialty_ids:
+            cat = spec_cat.get(sid)
+            if cat:
+                families.add(cat)
+        legacy = (legacy_specialty or "").casefold()
+        if legacy:
+            families.update(name for name, folded in family_folded if folded in legacy)
+        for fam in families:
+            _set("family", fam, bit)
+
+        if modes is None:  # ligne pas encore rétro-remplie
+            modes = consultation_modes_mask(types)
+        for mode in MODES:
+            if modes & CONSULTATION_MODE_BITS[mode]:
+                _set("mode", mode, bit)
+
+    return FacetIndex(ids, bitmaps)
+
+
+def get_index() -> FacetIndex:
+    tax_version = taxonomy_cache.version()
+    idx = _state["index"]
+    fresh = (
+        idx is not None
+        and (time.monotonic() - _state["built_at"]) <= TTL_SECONDS
+        and _state["taxonomy_version"] == tax_version
+    )
+    if fresh:
+        return idx
+    with _lock:
+        idx = _state["index"]
+        if idx is not None and _state["built_at"] and (time.monotonic() - _state["built_at"]) <= TTL_SECONDS \
+                and _state["taxonomy_version"] == tax_version:
+            return idx
+        idx = _build()
+        _state["index"] = idx
+        _state["built_at"] = time.monotonic()
+        _state["taxonomy_version"] = taxonomy_cache.version()
+        return idx
+
+
+def invalidate():
+    _state["index"] = None
+
+
+# -------------------------------------------------------------------
+# Jeu de filtres
+# -------------------------------------------------------------------
+def split_filters(args, family_names):
+    """
+    Sépare request.args en (filtres indexés {dim: valeur}, filtres texte {arg: valeur}).
+    Normalisation identique à _directory_query (visio → en_ligne, famille insensible à la casse).
+    """
+    selected, textual = {}, {}
+
+    city_id = args.get("city_id", type=int)
+    if city_id is not None:
+        selected["city"] = city_id
+    elif (args.get("city") or "").strip():
+        textual["city"] = args.get("city").strip()
+
+    specialty_id = args.get("specialty_id", type=int)
+    if specialty_id is not None:
+        selected["specialty"] = specialty_id
+    elif (args.get("specialty") or "").strip():
+        textual["specialty"] = args.get("specialty").strip()
+
+    family = (args.get("family") or "").strip()
+    if family:
+        match = next((n for n in family_names if n.casefold() == family.casefold()), None)
+        if match:
+            selected["family"] = match
+        else:
+            textual["family"] = family
+
+    mode = (args.get("mode") or "").strip().lower()
+    if mode == "visio":
+        mode = "en_ligne"
+    if mode:
+        if mode in MODES:
+            selected["mode"] = mode
+        else:
+            textual["mode"] = mode
+
+    q = (args.get("q") or "").strip()
+    if q:
+        textual["q"] = q
+
+    # Position (lat/lng/radius_km/k) : résolue en SQL avec les filtres texte
+    if args.get("lat") and args.get("lng"):
+        for key in ("lat", "lng", "radius_km", "k"):
+            if args.get(key):
+                textual[key] = args.get(key)
+    return selected, textual
+
+
+def facet_counts(args, text_ids=None) -> dict:
+    """
+    {"city": {city_id: n}, "family": {nom: n}, "specialty": {id: n}, "mode": {mode: n}, "total": n}
+    `text_ids(filtres_texte)` renvoie les ids correspondant aux filtres non indexés (une requête).
+    """
+    idx = get_index()
+    family_names = [f["name"] for f in taxonomy_cache.families()]
+    selected, textual = split_filters(args, family_names)
+
+    base = idx.all
+    if textual and text_ids is not None:
+        base = idx.mask_for_ids(text_ids(textual))
+    counts = idx.counts(selected, base)
+    counts["mode"]["visio"] = counts["mode"].get("en_ligne", 0)  # libellé des formulaires
+    return counts
+
+
+# -------------------------------------------------------------------
+# Invalidation sur écriture
+# -------------------------------------------------------------------
+@event.listens_for(db.session, "after_flush")
+def _mark_directory_writes(session, flush_context):
+    from models import Professional
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Professional):
+            session.info["facets_dirty"] = True
+            return
+
+
+@event.listens_for(db.session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("facets_dirty", False):
+        invalidate()
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("facets_dirty", None)
@@ -0,0 +1,142 @@
+# family_index.py
+# Appartenance dénormalisée pro → familles (catégories de spécialités).
+#
+# professionals.family_keys (TEXT[], index GIN) contient les familles du pro, en
+# minuscules : catégorie de la spécialité principale, des spécialités secondaires
+# (professional_specialties) et familles citées dans l'ancien champ texte `specialty`.
+# Le filtre "famille" devient `family_keys @> ARRAY['psychologie']` : une seule
+# sonde d'index au lieu de deux EXISTS corrélés + un ILIKE par ligne candidate.
+#
+# Maintenue à l'écriture (hook after_flush, comme search_engine.py) : tout flush
+# qui touche un Professional (dont ses spécialités) ou une Specialty recalcule
+# les lignes concernées dans la même transaction — pour une Specialty, seulement les
+# pros rattachés à elle ou liés à ses anciennes / nouvelles familles, jamais la table entière.
+
+from sqlalchemy import event, inspect, or_, text, bindparam
+
+from extensions import db
+
+_state = {"ready": False}
+
+_KEYS_SQL = """
+    COALESCE((
+        SELECT array_agg(DISTINCT k.key ORDER BY k.key)
+        FROM (
+            SELECT lower(btrim(s.category)) AS key
+              FROM specialties s WHERE s.id = p.primary_specialty_id
+            UNION
+            SELECT lower(btrim(s.category))
+              FROM professional_specialties x JOIN specialties s ON s.id = x.specialty_id
+             WHERE x.professional_id = p.id
+            UNION
+            SELECT lower(btrim(f.category))
+              FROM (SELECT DISTINCT category FROM specialties WHERE coalesce(btrim(category), '') <> '') f
+             WHERE p.specialty ILIKE '%' || btrim(f.category) || '%'
+        ) k
+        WHERE coalesce(k.key, '') <> ''
+    ), ARRAY[]::text[])
+"""
+
+
+def family_key(name: str) -> str:
+    return (name or "").strip().lower()
+
+
+def refresh_family_keys(conn, ids=None, only_missing=False):
+    """Recalcule family_keys pour `ids` (tous les pros si None)."""
+    sql = f"UPDATE professionals p SET family_keys = {_KEYS_SQL}"
+    params = {}
+    if ids is not None:
+        ids = sorted(i for i in ids if i is not None)
+        if not ids:
+            return
+        sql += " WHERE p.id IN :ids"
+        params["ids"] = ids
+    elif only_missing:
+        sql += " WHERE p.family_keys IS NULL"
+    stmt = text(sql)
+    if "ids" in params:
+        stmt = stmt.bindparams(bindparam("ids", expanding=True))
+    conn.execute(stmt, params)
+
+
+def install_family_index():
+    """Boot : remplit family_keys pour les lignes existantes puis active le filtre indexé."""
+    refresh_family_keys(db.session.connection(), only_missing=True)
+    db.session.commit()
+    _state["ready"] = True
+
+
+def family_filter(family: str, known_families=()):
+    """
+    Critère SQL "appartient à la famille `family`".
+    Famille connue + index prêt : sonde GIN. Sinon (index pas encore rempli, ou
+    saisie libre qui n'est pas une famille) : ancien filtre EXISTS / ILIKE.
+    """
+    from models import Professional, Specialty
+    key = family_key(family)
+    if _state["ready"] and key in {family_key(f) for f in known_families}:
+        return Professional.family_keys.contains([key])
+    return or_(
+        Professional.primary_specialty.has(Specialty.category.ilike(family)),
+        Professional.specialties.any(Specialty.category.ilike(family)),
+        Professional.specialty.ilike(f"%{family}%"),
+    )
+
+
+# -------------------------------------------------------------------
+# Maintenance à l'écriture
+# -------------------------------------------------------------------
+def refresh_for_specialties(conn, specialty_ids, categories):
+    """
+    Recalcule family_keys des seuls pros concernés par un changement de spécialités :
+    rattachés à l'une d'elles, porteurs d'une des familles touchées, ou dont le champ
+    texte `specialty` cite l'une de ces familles.
+    """
+    specialty_ids = sorted({int(i) for i in specialty_ids if i is not None})
+    keys = sorted({family_key(c) for c in categories if family_key(c)})
+    if not specialty_ids and not keys:
+        return
+    conds, params = [], {}
+    if specialty_ids:
+        conds.append("p.primary_specialty_id IN :sids")
+        conds.append(
+            "EXISTS (SELECT 1 FROM professional_specialties x "
+            "WHERE x.professional_id = p.id AND x.specialty_id IN :sids)"
+        )
+        params["sids"] = specialty_ids
+    if keys:
+        conds.append("p.family_keys && CAST(:keys AS text[])")
+        conds.append("p.specialty ILIKE ANY (CAST(:patterns AS text[]))")
+        params["keys"] = keys
+        params["patterns"] = [f"%{k}%" for k in keys]
+    stmt = text(f"UPDATE professionals p SET family_keys = {_KEYS_SQL} WHERE " + " OR ".join(conds))
+    if specialty_ids:
+        stmt = stmt.bindparams(bindparam("sids", expanding=True))
+    conn.execute(stmt, params)
+
+
+def _category_values(obj):
+    hist = inspect(obj).attrs["category"].history
+    return list(hist.added or ()) + list(hist.deleted or ()) + list(hist.unchanged or ())
+
+
+@event.listens_for(db.session, "after_flush")
+def _refresh_after_flush(session, flush_context):
+    from models import Professional, Specialty
+    if not _state["ready"]:
+        return
+    pro_ids = set()
+    specialty_ids, categories = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Professional) and obj not in session.deleted:
+            pro_ids.add(obj.id)
+        elif isinstance(obj, Specialty):
+            # Nouvelle catégorie / renommage : ne touche que les pros liés à ces familles
+            specialty_ids.add(obj.id)
+            categories.update(c for c in _category_values(obj) if c)
+
+    if specialty_ids:
+        refresh_for_specialties(session.connection(), specialty_ids, categories)
+    if pro_ids:
+        refresh_family_keys(session.connection(), pro_ids)
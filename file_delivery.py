@@ -0,0 +1,131 @@
+# file_delivery.py
+# Envoi des fichiers servis par l'application (photos, pièces jointes, favicons…).
+#
+# L'application fait toujours le contrôle d'accès et fixe les en-têtes de cache ; selon
+# FILE_DELIVERY_MODE, les octets sont ensuite pompés par :
+#   send_file  (défaut, développement local) : le worker Python lit et envoie le fichier ;
+#   x-accel    (nginx)  : réponse vide + X-Accel-Redirect vers une location "internal" ;
+#   x-sendfile (Apache mod_xsendfile, lighttpd) : réponse vide + X-Sendfile: <chemin absolu>.
+#
+# x-accel demande la correspondance dossier disque → préfixe interne nginx :
+#   FILE_DELIVERY_ACCEL_MAP="/var/data/uploads=/_files/uploads,/opt/render/project/src/static=/_files/static"
+# avec côté nginx, par exemple :
+#   location /_files/uploads/ { internal; alias /var/data/uploads/; }
+# nginx conserve Content-Type, Content-Disposition, Cache-Control et Expires de la réponse
+# applicative et gère lui-même ETag, Last-Modified et Range. Un fichier hors des dossiers
+# déclarés est servi par send_file (jamais d'erreur côté client).
+#
+# Range (send_file) : werkzeug valide Range / If-Range et répond 206 + Content-Range ;
+# le corps partiel est ensuite remplacé par le fichier positionné sur le début de la
+# plage et confié à wsgi.file_wrapper : gunicorn envoie alors exactement Content-Length
+# octets par sendfile(2), sans passer les données dans Python. Ailleurs (serveur de dev),
+# le découpage de werkzeug est conservé tel quel.
+
+import mimetypes
+import os
+from pathlib import Path
+from urllib.parse import quote
+
+from flask import Response, abort, request, send_file
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+MODE = (os.getenv("FILE_DELIVERY_MODE") or "send_file").strip().lower()
+MODES = ("send_file", "x-accel", "x-sendfile")
+if MODE not in MODES:
+    MODE = "send_file"
+
+
+def _parse_accel_map(raw: str):
+    pairs = []
+    for item in (raw or "").split(","):
+        if "=" not in item:
+            continue
+        root, prefix = item.split("=", 1)
+        root, prefix = root.strip(), prefix.strip()
+        if root and prefix:
+            pairs.append((os.path.realpath(root), "/" + prefix.strip("/")))
+    # Le dossier le plus précis d'abord (uploads/blobs avant uploads)
+    return sorted(pairs, key=lambda p: len(p[0]), reverse=True)
+
+
+ACCEL_MAP = _parse_accel_map(os.getenv("FILE_DELIVERY_ACCEL_MAP", ""))
+
+
+def _accel_uri(path: str):
+    for root, prefix in ACCEL_MAP:
+        if path == root or path.startswith(root + os.sep):
+            rel = os.path.relpath(path, root).replace(os.sep, "/")
+            return f"{prefix}/{quote(rel)}"
+    return None
+
+
+def _disposition(download_name: str) -> str:
+    try:
+        download_name.encode("ascii")
+        return f'attachment; filename="{download_name}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(download_name)}"
+
+
+def send(path, mimetype: str = None, as_attachment: bool = False, download_name: str = None,
+         max_age: int = None, cache_control: str = None):
+    """
+    Réponse Flask pour le fichier `path` (existant, déjà autorisé par l'appelant).
+    `cache_control` (en-tête complet) prime sur `max_age`.
+    """
+    path = os.path.realpath(str(path))
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    resp = None
+    if MODE == "x-accel":
+        uri = _accel_uri(path)
+        if uri is not None:
+            resp = Response(b"", mimetype=mimetype)
+            resp.headers["X-Accel-Redirect"] = uri
+    elif MODE == "x-sendfile":
+        resp = Response(b"", mimetype=mimetype)
+        resp.headers["X-Sendfile"] = path
+
+    if resp is None:
+        resp = send_file(path, mimetype=mimetype, as_attachment=as_attachment,
+                         download_name=download_name, conditional=True, max_age=max_age)
+        if resp.status_code == 206:
+            _sendfile_range(resp, path)
+        else:
+            resp.headers.setdefault("Accept-Ranges", "bytes")  # les lecteurs audio/vidéo savent qu'ils peuvent sauter
+    elif as_attachment:
+        resp.headers["Content-Disposition"] = _disposition(download_name or os.path.basename(path))
+
+    if cache_control:
+        resp.headers["Cache-Control"] = cache_control
+    elif max_age is not None:
+        resp.headers["Cache-Control"] = f"public, max-age={int(max_age)}"
+    return resp
+
+
+def _sendfile_range(resp, path: str):
+    environ = request.environ
+    # gunicorn borne l'envoi à Content-Length ; un file_wrapper quelconque lirait jusqu'à la fin
+    if "wsgi.file_wrapper" not in environ or not environ.get("SERVER_SOFTWARE", "").startswith("gunicorn"):
+        return
+    rng = resp.content_range
+    if rng is None or rng.start is None:
+        return
+    fh = open(path, "rb")
+    fh.seek(rng.start)
+    partial = resp.response
+    resp.response = wrap_file(environ, fh)
+    resp.direct_passthrough = True
+    close = getattr(partial, "close", None)
+    if close is not None:
+        close()
+
+
+def send_from(directory, filename: str, **kwargs):
+    """Équivalent de send_from_directory : chemin sûr sous `directory`, 404 sinon."""
+    path = safe_join(str(directory), filename)
+    if path is None or not Path(path).is_file():
+        abort(404)
+    return send(path, **kwargs)
@@ -0,0 +1,119 @@
+# first_available.py
+# Recherche « premier créneau disponible » sur tous les professionnels d'un jeu de filtres.
+#
+# Trier l'annuaire par prochaine disponibilité revenait à ouvrir la page de créneaux de
+# chaque pro (quatre requêtes et une grille chacun). Ici :
+#   - ids candidats : mêmes filtres que la recherche (app.py fournit la requête),
+#     plafonnés à MAX_CANDIDATES ;
+#   - plages, indisponibilités, rendez-vous et séances de tous les candidats chargés en
+#     un seul passage (slot_engine.load_many : quatre requêtes IN, horizon HORIZON_DAYS) ;
+#   - premier créneau libre de chaque pro, puis tri (créneau, rang dans la recherche) ;
+#     les pros sans créneau dans l'horizon ferment la liste.
+# Le classement [(id, créneau | None)] est gardé TTL_SECONDS (FIRST_AVAILABLE_TTL) par
+# jeu de filtres et servi par tranches (?after=<position>) ; il est recalculé plus tôt
+# dès que son premier créneau est passé (heure UTC, comme tout le parcours de
+# réservation). Tout commit qui touche les disponibilités d'un pro (rendez-vous, séance,
+# indisponibilité, plages, durée) supprime les classements où il figure ; les autres
+# workers rattrapent via le TTL.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import event
+
+from extensions import db
+import availability_bitmap
+import slot_engine
+
+HORIZON_DAYS = int(os.getenv("FIRST_AVAILABLE_DAYS", "30"))
+TTL_SECONDS = int(os.getenv("FIRST_AVAILABLE_TTL", "60"))
+MAX_ENTRIES = int(os.getenv("FIRST_AVAILABLE_CACHE_SIZE", "128"))
+MAX_CANDIDATES = int(os.getenv("FIRST_AVAILABLE_MAX_CANDIDATES", "1000"))
+
+_lock = threading.Lock()
+_entries = OrderedDict()   # clé -> (expire_à, classement, ids)
+_state = {"generation": 0}
+
+
+def rank(candidates, now: datetime = None, conn=None) -> list:
+    """
+    [(id, premier créneau libre | None)] trié par prochaine disponibilité. `candidates` :
+    lignes (id, durée, marge) dans l'ordre de la recherche, qui départage les ex aequo.
+    """
+    candidates = list(candidates)
+    if not candidates:
+        return []
+    now = now or datetime.utcnow()  # même horloge que patient_availability et la confirmation
+    calendars = slot_engine.load_many(candidates, now.date(), HORIZON_DAYS, conn)
+    firsts = [(c.id, calendars[c.id].first_free(not_before=now)) for c in candidates]
+    order = sorted(range(len(firsts)), key=lambda i: (firsts[i][1] is None, firsts[i][1] or now, i))
+    return [firsts[i] for i in order]
+
+
+def get_or_compute(key, compute) -> list:
+    """Classement en cache pour `key`, sinon `compute()` (mis en cache si aucune invalidation entre-temps)."""
+    now = time.monotonic()
+    with _lock:
+        found = _entries.get(key)
+        if found is not None and found[0] > now and not _has_past_slot(found[1]):
+            _entries.move_to_end(key)
+            return found[1]
+        generation = _state["generation"]
+
+    ranked = compute()
+
+    with _lock:
+        if generation == _state["generation"]:
+            _entries[key] = (now + TTL_SECONDS, ranked, frozenset(pid for pid, _ in ranked))
+            _entries.move_to_end(key)
+            while len(_entries) > MAX_ENTRIES:
+                _entries.popitem(last=False)
+    return ranked
+
+
+def _has_past_slot(ranked) -> bool:
+    # Classement trié : le premier créneau est le plus proche ; passé, il n'est plus réservable
+    return bool(ranked) and ranked[0][1] is not None and ranked[0][1] < datetime.utcnow()
+
+
+def invalidate(pids=None):
+    """Supprime les classements contenant l'un des `pids` (tous si None)."""
+    with _lock:
+        _state["generation"] += 1
+        if pids is None:
+            _entries.clear()
+            return
+        pids = set(pids)
+        for key in [k for k, (_, _, ids) in _entries.items() if ids & pids]:
+            del _entries[key]
+
+
+def size() -> int:
+    with _lock:
+        return len(_entries)
+
+
+# -------------------------------------------------------------------
+# Invalidation sur écriture
+# -------------------------------------------------------------------
+@event.listens_for(db.session, "after_flush")
+def _mark_touched_professionals(session, flush_context):
+    days, pros = availability_bitmap.collect_writes(session)
+    touched = pros | {pid for pid, _ in days}
+    if touched:
+        session.info.setdefault("first_available_dirty", set()).update(touched)
+
+
+@event.listens_for(db.session, "after_commit")
+def _invalidate_after_commit(session):
+    pids = session.info.pop("first_available_dirty", None)
+    if pids:
+        invalidate(pids)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("first_available_dirty", None)
@@ -0,0 +1,214 @@
+# geo_search.py
+# Recherche "près de moi" : rayon, k plus proches, tri par distance.
+#
+# Chaque Professional géolocalisé porte un `geohash` (précision 9, ~5 m) indexé en
+# B-tree (varchar_pattern_ops). Un cercle (centre, rayon) est couvert par quelques
+# cellules geohash ; le filtre "geohash LIKE 'cellule%'" est un parcours d'index par
+# préfixe, puis la distance exacte (haversine) élimine les coins et sert au tri.
+# Les autres filtres (spécialité, mode, ville…) restent dans la même requête.
+# Sans rayon ni k, pas de plafond : l'annuaire trié par distance se pagine sur
+# (distance, id) jusqu'au dernier pro géolocalisé.
+
+import math
+import os
+
+from sqlalchemy import event, func, literal_column, or_, text
+
+from extensions import db
+from models import Professional
+
+EARTH_RADIUS_KM = 6371.0
+GEOHASH_PRECISION = 9
+MAX_COVER_CELLS = 16
+KNN_MAX_KM = 1000.0          # rayon explicite maximal
+KNN_SEARCH_KM = float(os.getenv("GEO_KNN_SEARCH_KM", "100"))  # rayon des candidats en mode k plus proches
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+# -------------------------------------------------------------------
+# Geohash
+# -------------------------------------------------------------------
+def geohash_encode(lat: float, lng: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    out, bits, ch, even = [], 0, 0, True
+    while len(out) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                ch = (ch << 1) | 1
+                lng_lo = mid
+            else:
+                ch <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_BASE32[ch])
+            bits, ch = 0, 0
+    return "".join(out)
+
+
+def _cell_size_deg(precision: int):
+    total = 5 * precision
+    lng_bits = (total + 1) // 2
+    lat_bits = total // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def cover_cells(lat: float, lng: float, radius_km: float):
+    """Préfixes geohash couvrant le cercle (au plus MAX_COVER_CELLS cellules)."""
+    dlat = radius_km / 111.32
+    dlng = radius_km / (111.32 * max(math.cos(math.radians(lat)), 0.01))
+    lat_min, lat_max = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    lng_min, lng_max = max(lng - dlng, -180.0), min(lng + dlng, 180.0)
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        cell_lat, cell_lng = _cell_size_deg(precision)
+        n_lat = int((lat_max - lat_min) / cell_lat) + 2
+        n_lng = int((lng_max - lng_min) / cell_lng) + 2
+        if n_lat * n_lng > MAX_COVER_CELLS and precision > 1:
+            continue
+        cells = set()
+        for i in range(n_lat):
+            y = min(lat_min + i * cell_lat, lat_max)
+            for j in range(n_lng):
+                x = min(lng_min + j * cell_lng, lng_max)
+                cells.add(geohash_encode(y, x, precision))
+        return sorted(cells)
+    return []
+
+
+# -------------------------------------------------------------------
+# Requêtes
+# -------------------------------------------------------------------
+def distance_km_expr(lat: float, lng: float):
+    """Distance haversine (km) entre le pro et (lat, lng), calculée par PostgreSQL."""
+    dlat = func.radians(Professional.latitude - lat) / 2
+    dlng = func.radians(Professional.longitude - lng) / 2
+    a = (
+        func.power(func.sin(dlat), 2)
+        + math.cos(math.radians(lat)) * func.cos(func.radians(Professional.latitude)) * func.power(func.sin(dlng), 2)
+    )
+    return 2 * EARTH_RADIUS_KM * func.asin(func.sqrt(func.least(a, 1.0)))
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Même formule que distance_km_expr, côté Python (affichage)."""
+    dlat = math.radians(lat2 - lat1) / 2
+    dlng = math.radians(lng2 - lng1) / 2
+    a = math.sin(dlat) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def within_radius(query, lat: float, lng: float, radius_km: float):
+    """Filtre (index geohash puis distance exacte). Retourne (query, distance_expr)."""
+    cells = cover_cells(lat, lng, radius_km)
+    dist = distance_km_expr(lat, lng)
+    if cells:
+        # Préfixes en littéraux (alphabet base32 uniquement) : un LIKE paramétré
+        # ne pourrait pas utiliser l'index une fois le plan générique choisi.
+        query = query.filter(or_(*[
+            Professional.geohash.like(literal_column(f"'{c}%'"))
+            for c in cells if all(ch in _BASE32 for ch in c)
+        ]))
+    query = query.filter(dist <= radius_km)
+    return query, dist
+
+
+def knn_radius(query, lat: float, lng: float, k: int) -> float:
+    """
+    Rayon contenant les k pros les plus proches pour ces filtres : une seule requête
+    "ORDER BY distance LIMIT k" sur les candidats à moins de KNN_SEARCH_KM (cellules
+    geohash de ce rayon, donc jamais toute la table). Moins de k candidats : KNN_SEARCH_KM.
+    """
+    q, dist = within_radius(query, lat, lng, KNN_SEARCH_KM)
+    rows = q.order_by(None).with_entities(dist).order_by(dist.asc()).limit(k).all()
+    if len(rows) < k:
+        return KNN_SEARCH_KM
+    return max(float(rows[-1][0]), 0.1)
+
+
+def parse_geo_args(args):
+    """(lat, lng, radius_km|None, k|None) ou None si pas de position valide."""
+    lat = args.get("lat", type=float)
+    lng = args.get("lng", type=float)
+    if lat is None or lng is None or not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
+        return None
+    radius = args.get("radius_km", type=float)
+    if radius is not None:
+        radius = max(0.1, min(radius, KNN_MAX_KM))
+    k = args.get("k", type=int)
+    if k is not None:
+        k = max(1, min(k, 100))
+    return lat, lng, radius, k
+
+
+def apply_geo(query, args):
+    """
+    Applique les paramètres lat/lng/radius_km/k à une requête Professional.
+    Retourne (query, distance_expr|None, limit|None) ; limit vaut k en mode k plus proches.
+    Rayon explicite : filtre par cercle. k explicite : rayon des k plus proches (knn_radius).
+    Sinon aucun plafond : tous les pros géolocalisés, à paginer sur (distance, id) (keyset.page).
+    """
+    geo = parse_geo_args(args)
+    if geo is None:
+        return query, None, None
+    lat, lng, radius, k = geo
+    if radius is None and k is None:
+        query = query.filter(Professional.latitude.isnot(None), Professional.longitude.isnot(None))
+        return query, distance_km_expr(lat, lng), None
+    if radius is None:
+        radius = knn_radius(query, lat, lng, k)
+    query, dist = within_radius(query, lat, lng, radius)
+    return query, dist, k
+
+
+# -------------------------------------------------------------------
+# Maintenance du geohash
+# -------------------------------------------------------------------
+def _sync_geohash(target):
+    if target.latitude is None or target.longitude is None:
+        target.geohash = None
+        return
+    try:
+        target.geohash = geohash_encode(float(target.latitude), float(target.longitude))
+    except (TypeError, ValueError):
+        target.geohash = None
+
+
+@event.listens_for(Professional, "before_insert")
+def _geohash_before_insert(mapper, connection, target):
+    _sync_geohash(target)
+
+
+@event.listens_for(Professional, "before_update")
+def _geohash_before_update(mapper, connection, target):
+    _sync_geohash(target)
+
+
+def backfill_geohashes(batch_size: int = 500) -> int:
+    """Boot : calcule le geohash des pros géolocalisés qui n'en ont pas encore."""
+    rows = db.session.execute(text(
+        "SELECT id, latitude, longitude FROM professionals "
+        "WHERE geohash IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL"
+    )).all()
+    done = 0
+    for i in range(0, len(rows), batch_size):
+        params = [
+            {"id": r[0], "gh": geohash_encode(float(r[1]), float(r[2]))}
+            for r in rows[i:i + batch_size]
+        ]
+        db.session.execute(text("UPDATE professionals SET geohash = :gh WHERE id = :id"), params)
+        done += len(params)
+    db.session.commit()
+    return done
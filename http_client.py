@@ -0,0 +1,178 @@
+# http_client.py
+# Client HTTP sortant partagé (photos de profil hébergées ailleurs, etc.).
+#
+# Un hôte tiers lent ne doit jamais immobiliser tous les workers :
+#   - une requests.Session par process, pool keep-alive par hôte (pas de poignée TLS
+#     à chaque avatar) ;
+#   - sémaphore global (OUTBOUND_MAX_CONCURRENCY) et par hôte (OUTBOUND_PER_HOST) ;
+#     si aucune place ne se libère en ACQUIRE_TIMEOUT, HostBusy est levée aussitôt ;
+#   - délais courts (connexion OUTBOUND_CONNECT_TIMEOUT, lecture OUTBOUND_READ_TIMEOUT)
+#     et durée totale bornée pendant la lecture du corps (OUTBOUND_TOTAL_TIMEOUT) ;
+#   - plafond d'octets (iter_body) vérifié sur Content-Length puis pendant la lecture ;
+#   - disjoncteur par hôte : après BREAKER_THRESHOLD échecs consécutifs (connexion,
+#     délai, 5xx), l'hôte est court-circuité (CircuitOpen) pendant BREAKER_COOLDOWN
+#     secondes, puis une seule requête d'essai décide de la réouverture.
+# Les appelants traitent ces exceptions comme une indisponibilité (avatar par défaut…).
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+MAX_CONCURRENCY = int(os.getenv("OUTBOUND_MAX_CONCURRENCY", "8"))
+PER_HOST = int(os.getenv("OUTBOUND_PER_HOST", "2"))
+ACQUIRE_TIMEOUT = float(os.getenv("OUTBOUND_ACQUIRE_TIMEOUT", "0.5"))
+CONNECT_TIMEOUT = float(os.getenv("OUTBOUND_CONNECT_TIMEOUT", "2"))
+READ_TIMEOUT = float(os.getenv("OUTBOUND_READ_TIMEOUT", "5"))
+TOTAL_TIMEOUT = float(os.getenv("OUTBOUND_TOTAL_TIMEOUT", "10"))
+BREAKER_THRESHOLD = int(os.getenv("OUTBOUND_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("OUTBOUND_BREAKER_COOLDOWN", "60"))
+CHUNK_SIZE = 64 * 1024
+
+
+class OutboundError(RuntimeError):
+    pass
+
+
+class CircuitOpen(OutboundError):
+    pass
+
+
+class HostBusy(OutboundError):
+    pass
+
+
+class ResponseTooLarge(ValueError):
+    pass
+
+
+_lock = threading.Lock()
+_global_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_hosts = {}  # hôte -> {"slots", "failures", "open_until", "probing", "calls", "short_circuits"}
+_session = {"value": None}
+
+
+def _get_session() -> requests.Session:
+    with _lock:
+        if _session["value"] is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=32, pool_maxsize=PER_HOST, max_retries=0)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session["value"] = s
+        return _session["value"]
+
+
+def _host_state(host: str) -> dict:
+    with _lock:
+        state = _hosts.get(host)
+        if state is None:
+            state = _hosts[host] = {
+                "slots": threading.BoundedSemaphore(PER_HOST),
+                "failures": 0, "open_until": 0.0, "probing": False,
+                "calls": 0, "short_circuits": 0,
+            }
+        return state
+
+
+def _enter_breaker(host: str, state: dict):
+    with _lock:
+        if state["open_until"] > time.monotonic():
+            state["short_circuits"] += 1
+            raise CircuitOpen(f"{host}: disjoncteur ouvert")
+        if state["failures"] >= BREAKER_THRESHOLD:
+            # Délai écoulé : une seule requête d'essai à la fois
+            if state["probing"]:
+                state["short_circuits"] += 1
+                raise CircuitOpen(f"{host}: essai de réouverture en cours")
+            state["probing"] = True
+        state["calls"] += 1
+
+
+def _record(state: dict, ok: bool):
+    with _lock:
+        state["probing"] = False
+        if ok:
+            state["failures"] = 0
+            state["open_until"] = 0.0
+        else:
+            state["failures"] += 1
+            if state["failures"] >= BREAKER_THRESHOLD:
+                state["open_until"] = time.monotonic() + BREAKER_COOLDOWN
+
+
+def _record_neutral(state: dict):
+    # Refus local (saturation) : ni succès ni échec de l'hôte, mais l'essai éventuel est libéré
+    with _lock:
+        state["probing"] = False
+
+
+@contextmanager
+def get(url: str, headers: dict = None, timeout=None):
+    """
+    GET en streaming : `with http_client.get(url) as r:` (lire le corps via iter_body).
+    Lève CircuitOpen / HostBusy sans contacter l'hôte ; les erreurs de connexion, les
+    délais dépassés et les 5xx comptent comme des échecs de l'hôte (pas les 4xx).
+    """
+    host = (urlparse(url).hostname or "").lower()
+    state = _host_state(host)
+    _enter_breaker(host, state)
+
+    if not _global_slots.acquire(timeout=ACQUIRE_TIMEOUT):
+        _record_neutral(state)
+        raise HostBusy("trop de requêtes sortantes en cours")
+    try:
+        if not state["slots"].acquire(timeout=ACQUIRE_TIMEOUT):
+            _record_neutral(state)
+            raise HostBusy(f"{host}: trop de requêtes en cours")
+        try:
+            ok = False
+            try:
+                with _get_session().get(url, headers=headers, stream=True,
+                                        timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)) as r:
+                    r.deadline = time.monotonic() + TOTAL_TIMEOUT
+                    ok = r.status_code < 500
+                    yield r
+            except (requests.ConnectionError, requests.Timeout, TimeoutError):
+                ok = False  # l'hôte ne répond pas (ou trop lentement)
+                raise
+            finally:
+                _record(state, ok)
+        finally:
+            state["slots"].release()
+    finally:
+        _global_slots.release()
+
+
+def iter_body(response, max_bytes: int, chunk_size: int = CHUNK_SIZE):
+    """Corps par morceaux ; ResponseTooLarge au-delà de `max_bytes`, TimeoutError après TOTAL_TIMEOUT."""
+    declared = response.headers.get("Content-Length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise ResponseTooLarge(f"réponse trop volumineuse ({declared} octets)")
+    deadline = getattr(response, "deadline", None)
+    size = 0
+    for chunk in response.iter_content(chunk_size):
+        size += len(chunk)
+        if size > max_bytes:
+            raise ResponseTooLarge("réponse trop volumineuse")
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError("lecture trop longue")
+        yield chunk
+
+
+def stats() -> dict:
+    now = time.monotonic()
+    with _lock:
+        return {
+            host: {
+                "calls": s["calls"],
+                "failures": s["failures"],
+                "short_circuits": s["short_circuits"],
+                "open": s["open_until"] > now,
+            }
+            for host, s in _hosts.items()
+        }
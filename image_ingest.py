@@ -0,0 +1,76 @@
+# image_ingest.py
+# Décodage des photos uploadées, partagé par app.py et admin_server.py.
+#
+# Avant : img_no_exif.putdata(list(img.getdata())) — un tuple Python par pixel ;
+# une photo de téléphone de 12 Mpx montait à plusieurs Go et des secondes de CPU.
+# Ici la mémoire reste bornée quelle que soit la résolution d'entrée :
+#   - plafond de pixels (IMAGE_MAX_PIXELS) vérifié sur l'en-tête, avant tout décodage ;
+#   - JPEG : draft() demande au décodeur une réduction DCT (1/2, 1/4, 1/8) vers la
+#     plus petite taille >= DECODE_TARGET ; les autres formats sont réduits juste après ;
+#   - ImageOps.exif_transpose applique l'orientation, puis les métadonnées (EXIF, GPS,
+#     commentaires) sont simplement omises : save() ne les réécrit que si on les lui passe.
+
+import os
+
+try:
+    from PIL import Image, ImageOps
+    _PIL_OK = True
+except Exception:
+    _PIL_OK = False
+
+import image_variants
+
+MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(40_000_000)))
+DECODE_TARGET = max(image_variants.VARIANT_WIDTHS)
+
+
+def check_header(stream):
+    """Contrôle rapide (en-tête seulement, sans décodage) : ValueError si refusé."""
+    if not _PIL_OK:
+        raise RuntimeError("Le traitement d'image nécessite Pillow (PIL).")
+    try:
+        stream.seek(0)
+        width, height = Image.open(stream).size
+    except Exception:
+        raise ValueError("Fichier image invalide ou corrompu")
+    finally:
+        stream.seek(0)
+    if width * height > MAX_PIXELS:
+        raise ValueError("Image trop grande (résolution)")
+
+
+def open_image(stream, target: int = DECODE_TARGET):
+    """
+    Image PIL prête à redimensionner (RGB/RGBA, orientée, sans métadonnées), dont le
+    petit côté ne dépasse pas ~2×`target`. ValueError si le fichier est invalide ou trop grand.
+    """
+    check_header(stream)
+    try:
+        img = Image.open(stream)
+        img.verify()
+        stream.seek(0)
+        img = Image.open(stream)
+    except Exception:
+        raise ValueError("Fichier image invalide ou corrompu")
+
+    if img.format == "JPEG":
+        img.draft("RGB", (target, target))
+    img = ImageOps.exif_transpose(img)
+
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+
+    bound = 2 * target
+    if min(img.size) > bound:
+        ratio = bound / min(img.size)
+        img = img.resize((max(1, round(img.width * ratio)), max(1, round(img.height * ratio))),
+                         Image.Resampling.LANCZOS, reducing_gap=3.0)
+    img.info = {}
+    return img
+
+
+def ingest_profile_image(stream, out_dir, out_name: str) -> str:
+    """Décode un upload et écrit `out_name` + ses déclinaisons dans `out_dir`."""
+    img = open_image(stream)
+    image_variants.save_variants(img, out_dir, out_name)
+    return out_name
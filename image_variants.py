@@ -0,0 +1,106 @@
+# image_variants.py
+# Déclinaisons multi-tailles des photos de profil (WebP + JPEG) et résolution ?w=.
+#
+# À l'upload, pour une photo enregistrée sous "<stem>.jpg" (512×512, nom historique
+# conservé pour les URL déjà en base), on écrit aussi, dans le même dossier :
+#   <stem>_w96.webp   <stem>_w96.jpg
+#   <stem>_w256.webp  <stem>_w256.jpg
+#   <stem>_w512.webp  <stem>_w512.jpg
+#   <stem>_w1024.webp <stem>_w1024.jpg   (seulement si la source est assez grande)
+# /u/profiles/<stem>.jpg?w=256 sert la plus petite déclinaison >= 256 px, en WebP si
+# le navigateur l'accepte ; sans déclinaison (anciennes photos) → le fichier d'origine.
+
+import os
+from pathlib import Path
+
+VARIANT_WIDTHS = (96, 256, 512, 1024)
+BASE_SIZE = 512
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+
+def variant_name(filename: str, width: int, fmt: str) -> str:
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return f"{stem}_w{width}.{fmt}"
+
+
+def _flatten(img):
+    """RGB pour le JPEG (les PNG transparents passent sur fond blanc)."""
+    from PIL import Image
+    if img.mode == "RGB":
+        return img
+    if img.mode in ("RGBA", "LA"):
+        bg = Image.new("RGB", img.size, (255, 255, 255))
+        bg.paste(img, mask=img.getchannel("A"))
+        return bg
+    return img.convert("RGB")
+
+
+def _save(img, path: Path, **params):
+    # Écriture sous un nom temporaire puis renommage : jamais de fichier à moitié écrit servi
+    tmp = path.with_name(f".tmp-{path.name}")
+    try:
+        img.save(tmp, **params)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def save_variants(img, out_dir, filename: str) -> list:
+    """
+    Écrit les déclinaisons puis `filename` (JPEG BASE_SIZE carré) à partir de `img`
+    (image PIL déjà nettoyée). `filename` est écrit en dernier : sa présence signifie
+    que toutes les déclinaisons sont prêtes. Retourne les noms de fichiers écrits.
+    """
+    from PIL import Image, ImageOps
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+
+    source_side = min(img.size)
+    for width in VARIANT_WIDTHS:
+        if width > BASE_SIZE and width > source_side:
+            continue  # pas d'agrandissement au-delà de la taille de base
+        square = ImageOps.fit(img, (width, width), Image.Resampling.LANCZOS)
+        webp_name = variant_name(filename, width, "webp")
+        _save(square, out_dir / webp_name, format="WEBP", quality=WEBP_QUALITY, method=4)
+        jpg_name = variant_name(filename, width, "jpg")
+        _save(_flatten(square), out_dir / jpg_name, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        written += [webp_name, jpg_name]
+
+    base = ImageOps.fit(img, (BASE_SIZE, BASE_SIZE), Image.Resampling.LANCZOS)
+    _save(_flatten(base), out_dir / filename, format="JPEG", quality=88, optimize=True)
+    written.append(filename)
+    return written
+
+
+def available_widths(folder, filename: str) -> list:
+    folder = Path(folder)
+    return [w for w in VARIANT_WIDTHS if (folder / variant_name(filename, w, "jpg")).exists()]
+
+
+def resolve(folder, filename: str, width: int, accept_webp: bool) -> str:
+    """Nom du fichier à servir pour `filename` affiché sur `width` px."""
+    widths = available_widths(folder, filename)
+    if not widths or not width:
+        return os.path.basename(filename)
+    chosen = next((w for w in widths if w >= width), widths[-1])
+    if accept_webp:
+        webp = variant_name(filename, chosen, "webp")
+        if (Path(folder) / webp).exists():
+            return webp
+    return variant_name(filename, chosen, "jpg")
+
+
+def srcset(folder, url: str) -> str:
+    """Attribut srcset ("url?w=96 96w, …") pour une photo locale ; "" sans déclinaisons."""
+    if not url:
+        return ""
+    base = url.split("?", 1)[0]
+    widths = available_widths(folder, base)
+    return ", ".join(f"{base}?w={w} {w}w" for w in widths)
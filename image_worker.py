@@ -0,0 +1,228 @@
+# image_worker.py
+# Traitement des photos uploadées hors requête (pool de processus).
+#
+# La requête d'upload ne fait plus que : contrôle d'en-tête, copie brute du fichier
+# dans UPLOAD_ROOT/incoming (une écriture disque), mise à jour de image_url vers le
+# nom final. Un ProcessPoolExecutor (IMAGE_WORKERS process, démarrés en "spawn" pour
+# ne pas hériter des connexions PostgreSQL du worker gunicorn) décode l'image et
+# écrit les déclinaisons (image_ingest / image_variants) ; le fichier final est
+# renommé en dernier, ce qui rend la photo visible d'un coup.
+#
+# En attendant, /u/profiles/<nom> sert l'avatar par défaut en "no-store" (is_pending).
+# Si le traitement échoue, le champ est remis à sa valeur précédente par un UPDATE
+# conditionnel (… WHERE champ = nouvelle_url) : un upload plus récent n'est jamais écrasé.
+# Les travaux interrompus (redémarrage, process de traitement perdu) sont repris au boot
+# puis au plus toutes les RESUME_INTERVAL secondes par worker, depuis submit() et
+# is_pending() (resume_pending) : un placeholder "no-store" ne reste pas indéfiniment.
+#
+# IMAGE_WORKERS=0 : traitement synchrone dans la requête (comportement historique).
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import upload_stream
+
+_UPLOAD_ROOT = Path(os.getenv("UPLOAD_ROOT", Path(__file__).resolve().parent / "uploads"))
+INCOMING_DIR = Path(os.getenv("IMAGE_INCOMING_DIR", _UPLOAD_ROOT / "incoming"))
+WORKERS = int(os.getenv("IMAGE_WORKERS", "1"))
+RESUME_AFTER_SECONDS = 600
+RESUME_INTERVAL = int(os.getenv("IMAGE_RESUME_INTERVAL", "60"))
+PHOTO_FIELDS = ("image_url", "image_url2", "image_url3")
+
+log = logging.getLogger(__name__)
+
+_pool_lock = threading.Lock()
+_pool = {"executor": None}
+_resume = {"next": 0.0}
+_inflight = set()  # out_name des travaux lancés par ce process
+
+
+# -------------------------------------------------------------------
+# Côté process de traitement (aucun accès base)
+# -------------------------------------------------------------------
+def _process(raw_path: str, out_dir: str, out_name: str) -> None:
+    import image_ingest
+    with open(raw_path, "rb") as fh:
+        image_ingest.ingest_profile_image(fh, out_dir, out_name)
+
+
+# -------------------------------------------------------------------
+# Côté application
+# -------------------------------------------------------------------
+def _executor():
+    if WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool["executor"] is None:
+            _pool["executor"] = ProcessPoolExecutor(
+                max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool["executor"]
+
+
+def _job_paths(out_name: str):
+    stem = os.path.splitext(os.path.basename(out_name))[0]
+    return INCOMING_DIR / f"{stem}.upload", INCOMING_DIR / f"{stem}.json"
+
+
+def is_pending(out_name: str) -> bool:
+    """Vrai si `out_name` est en cours de traitement (afficher un placeholder non mis en cache)."""
+    if not _job_paths(out_name)[1].exists():
+        return False
+    maybe_resume_pending()
+    return True
+
+
+def content_name(stream) -> str:
+    """
+    Nom final dérivé du contenu uploadé : la même photo envoyée deux fois n'est traitée qu'une fois.
+    UploadTooLarge (plafond image) avant tout hachage.
+    """
+    limit = upload_stream.SIZE_LIMITS["image"]
+    upload_stream.check_size(stream, limit)
+    digest = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(256 * 1024), b""):
+        size += len(chunk)
+        if size > limit:
+            raise upload_stream.UploadTooLarge(f"Fichier trop volumineux (max {limit // (1024 * 1024)} Mo)")
+        digest.update(chunk)
+    stream.seek(0)
+    return f"{digest.hexdigest()[:32]}.jpg"
+
+
+def submit(stream, out_dir, out_name: str, revert=None) -> str:
+    """
+    Enregistre l'upload brut et planifie son traitement. Retourne `out_name`.
+    `revert` = (professional_id, champ, valeur_précédente, nouvelle_url) : restauré si échec.
+    ValueError / RuntimeError si l'en-tête est refusé (remonté tel quel à la requête).
+    """
+    import image_ingest
+    upload_stream.check_size(stream, upload_stream.SIZE_LIMITS["image"])  # sur tous les chemins
+    image_ingest.check_header(stream)
+    maybe_resume_pending()
+    if (Path(out_dir) / out_name).exists() or is_pending(out_name):
+        return out_name  # contenu déjà traité (ou en cours)
+
+    executor = _executor()
+    if executor is None:
+        return image_ingest.ingest_profile_image(stream, out_dir, out_name)
+
+    raw_path, meta_path = _job_paths(out_name)
+    stream.seek(0)
+    tmp, _sha256, _size = upload_stream.stream_to_temp(stream, INCOMING_DIR, upload_stream.SIZE_LIMITS["image"])
+    os.replace(tmp, raw_path)
+
+    job = {"out_dir": str(out_dir), "out_name": out_name, "revert": list(revert) if revert else None}
+    with open(meta_path, "w", encoding="utf-8") as fh:
+        json.dump(job, fh)
+
+    _start(executor, job)
+    return out_name
+
+
+def _start(executor, job):
+    from flask import current_app
+    app = current_app._get_current_object()
+    raw_path, _meta_path = _job_paths(job["out_name"])
+    with _pool_lock:
+        _inflight.add(job["out_name"])
+    future = executor.submit(_process, str(raw_path), job["out_dir"], job["out_name"])
+    future.add_done_callback(lambda f: _finish(app, job, f))
+
+
+def _finish(app, job, future):
+    raw_path, meta_path = _job_paths(job["out_name"])
+    with _pool_lock:
+        _inflight.discard(job["out_name"])
+    error = future.exception()
+    if error is not None:
+        log.warning("Traitement image %s en échec: %s", job["out_name"], error)
+        if job.get("revert"):
+            with app.app_context():
+                _revert(*job["revert"])
+    for path in (raw_path, meta_path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _revert(professional_id, field, previous, new_url):
+    from sqlalchemy import text
+    from extensions import db
+    if field not in PHOTO_FIELDS or not professional_id:
+        return
+    try:
+        import avatar_cache
+        with db.engine.begin() as conn:
+            res = conn.execute(
+                text(f"UPDATE professionals SET {field} = :previous WHERE id = :id AND {field} = :new_url"),
+                {"previous": previous, "id": professional_id, "new_url": new_url},
+            )
+            if res.rowcount:
+                avatar_cache.bump_version(conn)  # UPDATE hors ORM : autres workers
+        if not res.rowcount:
+            log.warning("Photo %s du pro %s non restaurée (valeur modifiée entre-temps)", field, professional_id)
+        avatar_cache.invalidate(professional_id)  # UPDATE hors ORM : pas d'invalidation automatique
+    except Exception as e:
+        log.warning("Restauration photo %s du pro %s: %s", field, professional_id, e)
+
+
+def resume_pending():
+    """Relance les travaux abandonnés (plus vieux que RESUME_AFTER_SECONDS, hors ce process)."""
+    executor = _executor()
+    if executor is None or not INCOMING_DIR.is_dir():
+        return 0
+    resumed = 0
+    now = time.time()
+    for meta_path in INCOMING_DIR.glob("*.json"):
+        try:
+            if now - meta_path.stat().st_mtime < RESUME_AFTER_SECONDS:
+                continue
+            # Réclamation atomique : un seul worker gunicorn reprend ce travail
+            claimed = meta_path.with_name(f"{meta_path.name}.{os.getpid()}")
+            os.rename(meta_path, claimed)
+        except OSError:
+            continue
+        try:
+            with open(claimed, "r", encoding="utf-8") as fh:
+                job = json.load(fh)
+        except (OSError, ValueError) as e:
+            log.warning("Travail image %s illisible: %s", meta_path.name, e)
+            job = None
+        finally:
+            # Toujours rendre le nom d'origine (aucun .json.<pid> orphelin)
+            try:
+                os.replace(claimed, meta_path)
+                os.utime(meta_path)
+            except OSError:
+                pass
+        if job is None:
+            continue
+        with _pool_lock:
+            if job.get("out_name") in _inflight:
+                continue  # encore en cours ici, seulement lent
+        _start(executor, job)
+        resumed += 1
+    return resumed
+
+
+def maybe_resume_pending():
+    now = time.monotonic()
+    with _pool_lock:
+        if now < _resume["next"]:
+            return
+        _resume["next"] = now + RESUME_INTERVAL
+    try:
+        resume_pending()
+    except Exception as e:
+        log.warning("Reprise des travaux image: %s", e)
@@ -0,0 +1,196 @@
+# keyset.py
+# Pagination par curseur (keyset) sur le classement de l'annuaire.
+#
+# Clé de tri composite (identique à la page d'accueil) :
+#   order_priority ASC, is_featured DESC, featured_rank ASC, created_at DESC, id DESC
+# précédée de la pertinence ts_rank DESC quand une recherche texte est active.
+# order_priority est lue dans professionals.ranking_priority, copie de
+# professional_order.order_priority tenue à jour dans la même transaction (hook
+# after_flush ci-dessous) : sans jointure, l'index ix_professionals_ranking_priority
+# sert l'ORDER BY et la borne de tête du curseur.
+# ts_rank (float4) est converti en float8 avant lecture et comparaison : la valeur
+# stockée dans le curseur (JSON, float8) est alors exactement celle de la base.
+# Le curseur "next" encode les valeurs de clé de la dernière ligne servie :
+# la page suivante est un simple "WHERE clé > curseur ORDER BY clé LIMIT n",
+# donc un coût constant quelle que soit la profondeur.
+
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import Float, and_, bindparam, cast, event, or_, func, literal, literal_column, text
+
+from extensions import db
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 60
+
+# Constantes en littéral SQL (et non en paramètre) pour correspondre
+# aux expressions de l'index ix_professionals_ranking_priority.
+_NO_PRIORITY = literal_column("999999")
+_NO_RANK = literal_column("999999")
+_EPOCH = literal_column("'1970-01-01'::timestamp")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def ranking_columns(rank=None):
+    """[(expression, ascendant?)] dans l'ordre de tri."""
+    from models import Professional
+    cols = []
+    if rank is not None:
+        cols.append((cast(rank, Float(53)), False))
+    cols += [
+        (func.coalesce(Professional.ranking_priority, _NO_PRIORITY), True),
+        (func.coalesce(Professional.is_featured, literal_column("false")), False),
+        (func.coalesce(Professional.featured_rank, _NO_RANK), True),
+        (func.coalesce(Professional.created_at, _EPOCH), False),
+        (Professional.id, False),
+    ]
+    return cols
+
+
+def ranked(query, rank=None):
+    """Remplace l'ORDER BY par celui du classement."""
+    return query.order_by(None).order_by(
+        *[(expr.asc() if asc else expr.desc()) for expr, asc in ranking_columns(rank)]
+    )
+
+
+# -------------------------------------------------------------------
+# Curseur opaque
+# -------------------------------------------------------------------
+def encode_cursor(values) -> str:
+    payload = [{"t": v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, size: int) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw.decode("utf-8"))
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError("longueur")
+        out = []
+        for v in values:
+            if isinstance(v, dict):
+                v = datetime.fromisoformat(v["t"])
+            elif not isinstance(v, (bool, int, float)):
+                raise ValueError("type")
+            out.append(v)
+        return out
+    except Exception as e:
+        raise InvalidCursor(str(e))
+
+
+def _after(cols, values):
+    """
+    Prédicat "strictement après" pour une clé à sens mixtes, forme imbriquée :
+    k1 >= v1 AND (k1 > v1 OR (k2 ... )) — la borne de tête reste exploitable par un index.
+    """
+    (expr, asc), v = cols[0], literal(values[0])  # literal() : True/False comparables avec < et >
+    strictly = expr > v if asc else expr < v
+    if len(cols) == 1:
+        return strictly
+    bound = expr >= v if asc else expr <= v
+    return and_(bound, or_(strictly, _after(cols[1:], values[1:])))
+
+
+def page(query, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE, rank=None, distance=None):
+    """
+    Une page de professionnels triés selon le classement (ou par distance croissante
+    si `distance` est fourni, cf. geo_search). Retourne (professionnels, next_cursor | None).
+    Lève InvalidCursor si le curseur est illisible.
+    """
+    from models import Professional
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE * 2))
+
+    if distance is not None:
+        cols = [(distance, True), (Professional.id, True)]
+        q = query.order_by(None).order_by(distance.asc(), Professional.id.asc())
+    else:
+        cols = ranking_columns(rank)
+        q = ranked(query, rank)
+
+    # Les valeurs de clé reviennent avec chaque ligne : le curseur suivant s'en déduit
+    q = q.add_columns(*[expr for expr, _ in cols])
+    if cursor:
+        q = q.filter(_after(cols, decode_cursor(cursor, len(cols))))
+
+    rows = q.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = [r[0] for r in rows]
+    next_cursor = encode_cursor(list(rows[-1][1:])) if (has_more and rows) else None
+    return items, next_cursor
+
+
+# -------------------------------------------------------------------
+# Pages servies depuis une liste de clés (result_cache)
+# -------------------------------------------------------------------
+def ordered_keys(query, rank=None, limit: int = 1000) -> list:
+    """Clés de classement [(…, id)] des `limit` premières lignes, dans l'ordre."""
+    q = ranked(query, rank).with_entities(*[expr for expr, _ in ranking_columns(rank)])
+    return [tuple(r) for r in q.limit(limit).all()]
+
+
+def page_from_keys(keys, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE, cap: int = None):
+    """
+    Tranche (ids, next_cursor) de `keys` après `cursor`, avec les mêmes curseurs que page().
+    Retourne None si la tranche ne peut pas être servie depuis la liste (curseur absent
+    de la liste, ou liste tronquée à `cap` avant la fin de la page) : passer alors par page().
+    """
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE * 2))
+    start = 0
+    if cursor:
+        if not keys:
+            return None
+        last_id = decode_cursor(cursor, len(keys[0]))[-1]
+        pos = next((i for i, k in enumerate(keys) if k[-1] == last_id), None)
+        if pos is None:
+            return None
+        start = pos + 1
+
+    end = start + limit
+    truncated = cap is not None and len(keys) > cap
+    if truncated and end >= cap:
+        return None
+    chunk = keys[start:end]
+    next_cursor = encode_cursor(list(chunk[-1])) if (chunk and len(keys) > end) else None
+    return [k[-1] for k in chunk], next_cursor
+
+
+# -------------------------------------------------------------------
+# Priorité dénormalisée (professionals.ranking_priority)
+# -------------------------------------------------------------------
+def sync_priorities(conn, ids=None):
+    """Recopie order_priority dans professionals.ranking_priority (`ids`, ou les lignes divergentes)."""
+    sql = (
+        "UPDATE professionals AS p SET ranking_priority = "
+        "(SELECT o.order_priority FROM professional_order o WHERE o.professional_id = p.id)"
+    )
+    if ids is None:
+        conn.execute(text(
+            sql + " WHERE p.ranking_priority IS DISTINCT FROM "
+            "(SELECT o.order_priority FROM professional_order o WHERE o.professional_id = p.id)"
+        ))
+        return
+    ids = sorted({int(i) for i in ids if i is not None})
+    if ids:
+        conn.execute(text(sql + " WHERE p.id IN :ids").bindparams(bindparam("ids", expanding=True)), {"ids": ids})
+
+
+@event.listens_for(db.session, "after_flush")
+def _sync_after_flush(session, flush_context):
+    from admin_server import ProfessionalOrder
+    ids = {
+        obj.professional_id
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+        if isinstance(obj, ProfessionalOrder)
+    }
+    if ids:
+        sync_priorities(session.connection(), ids)
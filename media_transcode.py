@@ -0,0 +1,138 @@
+# media_transcode.py
+# Version allégée (débit réduit) des audios servis par /u/attachments/ — ?q=low.
+#
+# Notes vocales et exercices audio (relaxation de 40 min…) sont souvent enregistrés
+# à 128–320 kb/s ; sur réseau mobile lent, une version AAC mono à TRANSCODE_AUDIO_BITRATE
+# démarre plus vite et consomme 3 à 6 fois moins. Seuls les blobs (noms sha256, contenu
+# immuable) sont transcodés : la version allégée ne peut jamais être périmée.
+#
+# Optionnel : MEDIA_TRANSCODE=1 et ffmpeg présent (FFMPEG_BIN). La conversion tourne en
+# arrière-plan (TRANSCODE_CONCURRENCY à la fois) ; tant qu'elle n'est pas prête, les pages
+# émettent l'URL de l'original, et ?q=low (qui ne sert que la version allégée) ensuite.
+# Cache : TRANSCODE_DIR/ab/<sha256>.low.m4a (faststart, donc lisible et "seekable" en
+# Range dès les premiers octets). Un fichier verrou (O_EXCL) évite deux ffmpeg sur le même
+# audio entre workers ; la version allégée est supprimée avec son blob (discard).
+
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import upload_stream
+
+_UPLOAD_ROOT = Path(os.getenv("UPLOAD_ROOT", Path(__file__).resolve().parent / "uploads"))
+TRANSCODE_DIR = Path(os.getenv("TRANSCODE_DIR", _UPLOAD_ROOT / "transcoded"))
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+AUDIO_BITRATE = os.getenv("TRANSCODE_AUDIO_BITRATE", "48k")
+TIMEOUT_SECONDS = int(os.getenv("TRANSCODE_TIMEOUT", "600"))
+ENABLED = os.getenv("MEDIA_TRANSCODE", "0") == "1" and shutil.which(FFMPEG_BIN) is not None
+
+log = logging.getLogger(__name__)
+
+_slots = threading.BoundedSemaphore(int(os.getenv("TRANSCODE_CONCURRENCY", "1")))
+_state_lock = threading.Lock()
+_pending = set()
+_failed = set()  # pas de nouvelle tentative avant redémarrage
+
+
+def low_path(name: str) -> Path:
+    stem = os.path.splitext(name)[0]
+    return TRANSCODE_DIR / stem[:2] / f"{stem}.low.m4a"
+
+
+def ready(name: str):
+    """Chemin de la version allégée de `name` si elle existe déjà, sinon None (rien n'est lancé)."""
+    if not ENABLED or upload_stream.kind_for(os.path.splitext(name)[1]) != "audio":
+        return None
+    target = low_path(name)
+    return target if target.exists() else None
+
+
+def lookup(name: str, source: Path):
+    """
+    Chemin de la version allégée de l'audio `name` (fichier `source`) si elle est prête,
+    sinon None — la conversion est alors lancée en arrière-plan.
+    """
+    if not ENABLED or upload_stream.kind_for(os.path.splitext(name)[1]) != "audio":
+        return None
+    target = low_path(name)
+    if target.exists():
+        return target
+    with _state_lock:
+        if name in _pending or name in _failed:
+            return None
+        _pending.add(name)
+    threading.Thread(target=_run, args=(name, Path(source), target), daemon=True).start()
+    return None
+
+
+def _claim(target: Path) -> Path:
+    """
+    Verrou inter-processus (fichier créé en O_EXCL) : un seul ffmpeg par audio, tous
+    workers confondus. Un verrou plus vieux que TIMEOUT_SECONDS (process tué) est repris.
+    Renvoie le chemin du verrou, ou None s'il est tenu ailleurs.
+    """
+    lock = target.with_name(f".lock-{target.name}")
+    for _ in range(2):
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return lock
+        except FileExistsError:
+            try:
+                if time.time() - lock.stat().st_mtime <= TIMEOUT_SECONDS + 60:
+                    return None
+                os.unlink(lock)
+            except OSError:
+                pass
+    return None
+
+
+def _run(name: str, source: Path, target: Path):
+    # Fichier temporaire propre à ce process et à cette conversion
+    tmp = target.with_name(f".tmp-{os.getpid()}-{uuid.uuid4().hex}-{target.name}")
+    lock = None
+    try:
+        with _slots:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            lock = _claim(target)
+            if lock is None or target.exists():
+                return  # conversion en cours dans un autre worker, ou déjà faite
+            subprocess.run(
+                [FFMPEG_BIN, "-nostdin", "-v", "error", "-y", "-i", str(source),
+                 "-vn", "-ac", "1", "-c:a", "aac", "-b:a", AUDIO_BITRATE,
+                 "-movflags", "+faststart", "-f", "mp4", str(tmp)],
+                check=True, timeout=TIMEOUT_SECONDS,
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            )
+            # Inutile de garder une "version allégée" plus lourde que l'original
+            if tmp.stat().st_size >= source.stat().st_size:
+                raise ValueError("version allégée non plus légère")
+            os.replace(tmp, target)
+    except Exception as e:
+        log.warning("Transcodage %s: %s", name, e)
+        with _state_lock:
+            _failed.add(name)
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+    finally:
+        if lock is not None:
+            try:
+                os.unlink(lock)
+            except OSError:
+                pass
+        with _state_lock:
+            _pending.discard(name)
+
+
+def discard(name: str) -> None:
+    """Supprime la version allégée de `name` (blob supprimé par blob_store.collect_garbage)."""
+    try:
+        os.unlink(low_path(name))
+    except OSError:
+        pass
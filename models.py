@@ -1,6 +1,8 @@
 # models.py — version alignée (contrat-fix)
 from extensions import db
 from flask_login import UserMixin
+from sqlalchemy import event, literal_column
+from sqlalchemy.dialects.postgresql import ARRAY, TSRANGE, TSVECTOR
 from datetime import datetime, date  # 'date' peut rester utile
 
 
@@ -143,14 +145,17 @@ class Professional(db.Model):
 
     # Dispo & types de consultation
     availability = db.Column(db.String(50), default="disponible")
-    # ex: "cabinet,domicile,en_ligne"
+    # ex: "cabinet,domicile,en_ligne" (saisie des formulaires, conservée telle quelle)
     consultation_types = db.Column(db.String(120))
+    # Masque dérivé de consultation_types (cf. CONSULTATION_MODE_BITS), indexé pour les filtres
+    consultation_modes = db.Column(db.SmallInteger)
 
     # Localisation et contact
     location = db.Column(db.String(120))
     address = db.Column(db.String(255))
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))  # dérivé de latitude/longitude (geo_search.py)
     phone = db.Column(db.String(30))
 
     # Réseaux sociaux + approbation admin
@@ -173,6 +178,16 @@ class Professional(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Recherche plein texte (maintenue par search_engine.py, jamais lue côté Python)
+    search_vector = db.deferred(db.Column(TSVECTOR))
+    # Familles du pro, en minuscules (maintenues par family_index.py, jamais lues côté Python)
+    family_keys = db.deferred(db.Column(ARRAY(db.Text)))
+    # Copie de professional_order.order_priority (maintenue par keyset.py) : clé de tête indexable
+    ranking_priority = db.Column(db.Integer)
+    # Renseigné au premier enregistrement des plages hebdomadaires : sans lui, slot_engine
+    # applique FALLBACK_WINDOWS ; avec lui, aucune plage = fermé
+    availability_saved_at = db.Column(db.DateTime)
+
     __table_args__ = (
         db.Index("ix_professionals_name", "name"),
         db.Index("ix_professionals_specialty", "specialty"),
@@ -184,6 +199,12 @@ class Professional(db.Model):
         db.Index("ix_professionals_search", "name", "specialty", "location", "address"),
         db.Index("ix_professionals_is_featured", "is_featured"),
         db.Index("ix_professionals_featured_rank", "featured_rank"),
+        db.Index("ix_professionals_search_vector", "search_vector", postgresql_using="gin"),
+        db.Index("ix_professionals_geohash", "geohash", postgresql_ops={"geohash": "varchar_pattern_ops"}),
+        db.Index("ix_professionals_family_keys", "family_keys", postgresql_using="gin"),
+        db.Index("ix_professionals_mode_cabinet", "id", postgresql_where=literal_column("(consultation_modes & 1) <> 0")),
+        db.Index("ix_professionals_mode_domicile", "id", postgresql_where=literal_column("(consultation_modes & 2) <> 0")),
+        db.Index("ix_professionals_mode_en_ligne", "id", postgresql_where=literal_column("(consultation_modes & 4) <> 0")),
     )
 
     def __repr__(self):
@@ -194,6 +215,67 @@ class Professional(db.Model):
         raw = (self.consultation_types or "").strip()
         return [t for t in (raw.split(",") if raw else []) if t]
 
+    @property
+    def consultation_modes_list(self):
+        """Modes normalisés (cabinet / domicile / en_ligne), dans l'ordre canonique."""
+        mask = self.consultation_modes
+        if mask is None:
+            mask = consultation_modes_mask(self.consultation_types)
+        return [m for m, bit in CONSULTATION_MODE_BITS.items() if mask & bit]
+
+    @staticmethod
+    def mode_filter(mode):
+        """
+        Critère SQL "propose ce mode" (None si mode inconnu). Le bit est inliné pour que
+        PostgreSQL reconnaisse le prédicat de l'index partiel ix_professionals_mode_<mode>.
+        """
+        bit = CONSULTATION_MODE_BITS.get(normalize_consultation_mode(mode))
+        if bit is None:
+            return None
+        return Professional.consultation_modes.op("&")(literal_column(str(bit))) != literal_column("0")
+
+
+# Modes de consultation : bits du masque + synonymes rencontrés dans les formulaires / seeds
+CONSULTATION_MODE_BITS = {"cabinet": 1, "domicile": 2, "en_ligne": 4}
+_CONSULTATION_MODE_ALIASES = {
+    "office": "cabinet", "presentiel": "cabinet", "présentiel": "cabinet",
+    "home": "domicile",
+    "visio": "en_ligne", "video": "en_ligne", "online": "en_ligne", "en ligne": "en_ligne",
+}
+
+
+def normalize_consultation_mode(value):
+    v = (value or "").strip().lower()
+    return _CONSULTATION_MODE_ALIASES.get(v, v)
+
+
+def consultation_modes_mask(types) -> int:
+    """"cabinet,visio" -> 5 ; valeurs inconnues ignorées."""
+    mask = 0
+    for t in (types or "").split(","):
+        mask |= CONSULTATION_MODE_BITS.get(normalize_consultation_mode(t), 0)
+    return mask
+
+
+@event.listens_for(Professional, "before_insert")
+@event.listens_for(Professional, "before_update")
+def _sync_consultation_modes(mapper, connection, target):
+    target.consultation_modes = consultation_modes_mask(target.consultation_types)
+
+
+def backfill_consultation_modes(batch_size: int = 500) -> int:
+    """Boot : calcule consultation_modes pour les lignes antérieures à la colonne."""
+    rows = db.session.execute(db.text(
+        "SELECT id, consultation_types FROM professionals WHERE consultation_modes IS NULL"
+    )).all()
+    for i in range(0, len(rows), batch_size):
+        db.session.execute(
+            db.text("UPDATE professionals SET consultation_modes = :m WHERE id = :id"),
+            [{"id": r[0], "m": consultation_modes_mask(r[1])} for r in rows[i:i + batch_size]],
+        )
+    db.session.commit()
+    return len(rows)
+
 
 # ======================
 # Dossier patient (profil)
@@ -390,6 +472,8 @@ class Appointment(db.Model):
     status = db.Column(db.String(20), default="en_attente")  # 'en_attente' | 'confirme' | 'annule'
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # [début, début + durée + marge) : rempli par trigger, contrainte d'exclusion (booking_guard.py)
+    slot_range = db.deferred(db.Column(TSRANGE))
 
     patient = db.relationship(
         "User",
@@ -519,6 +603,69 @@ class FileAttachment(db.Model):
     patient = db.relationship("User", foreign_keys=[patient_id], lazy="joined")
 
 
+class Blob(db.Model):
+    """Contenu stocké une seule fois (blob_store.py) ; name = sha256 + extension."""
+    __tablename__ = "blobs"
+
+    name = db.Column(db.String(80), primary_key=True)
+    size_bytes = db.Column(db.BigInteger)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_blobs_unreferenced", "created_at", postgresql_where=db.text("ref_count <= 0")),
+    )
+
+
+class AvailabilityDay(db.Model):
+    """
+    Disponibilité matérialisée d'un professionnel pour un jour (availability_bitmap.py) :
+    un bit par quantum de 5 min, 288 bits = 36 octets par bitmap.
+    """
+    __tablename__ = "availability_days"
+
+    professional_id = db.Column(
+        db.Integer, db.ForeignKey("professionals.id", ondelete="CASCADE"), primary_key=True
+    )
+    day = db.Column(db.Date, primary_key=True)
+    open_bits = db.Column(db.LargeBinary, nullable=False)  # plages hebdomadaires du jour
+    busy_bits = db.Column(db.LargeBinary, nullable=False)  # indisponibilités, RDV et séances (+ marge)
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class SlotHold(db.Model):
+    """
+    Option temporaire d'un patient sur un créneau (slot_holds.py) : au plus une par
+    créneau, ignorée (puis balayée) une fois expires_at passé.
+    """
+    __tablename__ = "slot_holds"
+
+    professional_id = db.Column(
+        db.Integer, db.ForeignKey("professionals.id", ondelete="CASCADE"), primary_key=True
+    )
+    slot_at = db.Column(db.DateTime, primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_slot_holds_expires_at", "expires_at"),
+        db.Index("ix_slot_holds_patient", "patient_id", "professional_id"),
+    )
+
+
+class RankingVersion(db.Model):
+    """
+    Compteur partagé du classement de la page d'accueil (ranking_snapshot.py) : une seule
+    ligne, incrémentée par toute transaction qui modifie le classement.
+    """
+    __tablename__ = "ranking_version"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 # ======================
 # Messages (liés à MessageThread)
 # ======================
@@ -585,6 +732,18 @@ class Exercise(db.Model):
     )
 
 
+class SharedVersion(db.Model):
+    """
+    Version d'un cache process-local (shared_version.py), une ligne par cache : incrémentée
+    dans la transaction qui modifie les données, comparée à chaque lecture par les workers.
+    """
+    __tablename__ = "shared_versions"
+
+    name = db.Column(db.String(40), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class ExerciseAssignment(db.Model):
     __tablename__ = "exercise_assignments"
 
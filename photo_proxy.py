@@ -0,0 +1,147 @@
+# photo_proxy.py
+# Cache disque des photos de profil hébergées ailleurs (image_url = https://…).
+#
+# Avant : chaque affichage d'un avatar externe déclenchait un requests.get (jusqu'à 8 s
+# de worker bloqué) et bufferisait tout le corps en mémoire ; une liste de 24 pros
+# = 24 appels vers des hôtes tiers à chaque rendu.
+#
+# Maintenant : une entrée par URL (clé = sha256 de l'URL) dans PHOTO_PROXY_CACHE_DIR :
+#   <clé>.bin  — le corps, écrit en streaming puis renommé atomiquement ;
+#   <clé>.json — content-type, ETag, Last-Modified, date de récupération.
+# Servie depuis le disque (send_file) tant que l'entrée a moins de PHOTO_PROXY_TTL
+# secondes ; au-delà, revalidation conditionnelle (If-None-Match / If-Modified-Since) :
+# un 304 prolonge l'entrée sans retransférer l'image. Si l'hôte distant est en panne,
+# l'entrée périmée est servie telle quelle. Les appels sortants passent par http_client
+# (pool keep-alive, concurrence bornée, disjoncteur par hôte).
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import file_delivery
+import http_client
+
+_UPLOAD_ROOT = Path(os.getenv("UPLOAD_ROOT", Path(__file__).resolve().parent / "uploads"))
+CACHE_DIR = Path(os.getenv("PHOTO_PROXY_CACHE_DIR", _UPLOAD_ROOT / "remote_cache"))
+TTL_SECONDS = int(os.getenv("PHOTO_PROXY_TTL", str(24 * 3600)))
+MAX_BYTES = int(os.getenv("PHOTO_PROXY_MAX_BYTES", str(8 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; TighriBot/1.0; +https://www.tighri.com)",
+    "Referer": "https://www.tighri.com",
+}
+
+_locks_guard = threading.Lock()
+_locks = {}
+
+
+def _lock_for(key: str) -> threading.Lock:
+    # Un seul téléchargement par URL et par process (les autres requêtes attendent le disque)
+    with _locks_guard:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = threading.Lock()
+        return lock
+
+
+def _paths(url: str):
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return key, CACHE_DIR / f"{key}.bin", CACHE_DIR / f"{key}.json"
+
+
+def _read_meta(meta_path: Path):
+    try:
+        with open(meta_path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path: Path, write):
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            write(fh)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _write_meta(meta_path: Path, meta: dict):
+    _write_atomic(meta_path, lambda fh: fh.write(json.dumps(meta).encode("utf-8")))
+
+
+def _download(url: str, body_path: Path, meta_path: Path, headers: dict, meta=None):
+    """Récupère (ou revalide) `url`. Retourne la méta à jour, ou lève une exception."""
+    req_headers = dict(headers)
+    if meta and body_path.exists():
+        if meta.get("etag"):
+            req_headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            req_headers["If-Modified-Since"] = meta["last_modified"]
+
+    # Pool keep-alive, concurrence bornée par hôte, disjoncteur (http_client)
+    with http_client.get(url, headers=req_headers) as r:
+        if r.status_code == 304 and meta:
+            meta["fetched_at"] = time.time()
+            _write_meta(meta_path, meta)
+            return meta
+        r.raise_for_status()
+        content_type = (r.headers.get("Content-Type") or "image/jpeg").split(";")[0].strip()
+        if not content_type.startswith("image/"):
+            raise ValueError(f"type non image: {content_type}")
+
+        def _copy(fh):
+            for chunk in http_client.iter_body(r, MAX_BYTES, CHUNK_SIZE):
+                fh.write(chunk)
+
+        _write_atomic(body_path, _copy)
+        meta = {
+            "url": url,
+            "content_type": content_type,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+        }
+    _write_meta(meta_path, meta)
+    return meta
+
+
+def fetch(url: str, headers: dict = None):
+    """(chemin local, méta) pour `url`, en passant par le cache ; None si indisponible."""
+    key, body_path, meta_path = _paths(url)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+    meta = _read_meta(meta_path)
+    if meta and body_path.exists() and (time.time() - meta.get("fetched_at", 0)) < TTL_SECONDS:
+        return body_path, meta
+
+    with _lock_for(key):
+        meta = _read_meta(meta_path)  # un autre thread a pu rafraîchir pendant l'attente
+        if meta and body_path.exists() and (time.time() - meta.get("fetched_at", 0)) < TTL_SECONDS:
+            return body_path, meta
+        try:
+            meta = _download(url, body_path, meta_path, headers or DEFAULT_HEADERS, meta)
+        except Exception:
+            if meta and body_path.exists():
+                return body_path, meta  # périmé mais servable
+            return None
+    return body_path, meta
+
+
+def send(url: str, headers: dict = None, max_age: int = 86400):
+    """Réponse Flask servie depuis le cache disque ; None si l'image n'a pas pu être obtenue."""
+    found = fetch(url, headers)
+    if found is None:
+        return None
+    body_path, meta = found
+    return file_delivery.send(body_path, mimetype=meta.get("content_type") or "image/jpeg", max_age=max_age)
@@ -1,9 +1,13 @@
 # pro_office.py — Contrat-fix : ajouts isolés, compatibles app.py/models.py actuels
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
+import os
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, current_app
 from flask_login import login_required, current_user
 from sqlalchemy import or_, and_
 from datetime import datetime
 
+import taxonomy_cache
+import upload_stream
+import file_delivery
 from models import (
     db, User, Professional, Appointment, Specialty,
     # objets ajoutés dans models.py (contrat-fix)
@@ -89,11 +93,9 @@ def exercises_index():
 
     rows = query.all()
 
-    # Taxonomies pour UI
-    families = [r[0] for r in db.session.query(Specialty.category).filter(
-        Specialty.category.isnot(None), Specialty.category != ""
-    ).distinct().order_by(Specialty.category.asc()).all()]
-    specialties = Specialty.query.order_by(Specialty.name.asc()).all()
+    # Taxonomies pour UI (cache process-wide)
+    families = [f["name"] for f in taxonomy_cache.families()]
+    specialties = taxonomy_cache.specialties()
     types = ExerciseType.query.order_by(ExerciseType.name.asc()).all()
     techniques = Technique.query.order_by(Technique.name.asc()).all()
 
@@ -267,7 +269,15 @@ def messages_thread(patient_user_id: int):
             safe = secure_filename(att.filename)
             unique = f"{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{safe}"
             fpath = files_dir / unique
-            att.save(fpath)
+            # Copie en flux, plafond selon le type, renommage atomique
+            try:
+                tmp, _sha256, _size = upload_stream.stream_to_temp(
+                    att.stream, files_dir, upload_stream.size_limit(Path(safe).suffix)
+                )
+            except upload_stream.UploadTooLarge as e:
+                flash(str(e), "warning")
+                return redirect(url_for("pro_office.messages_thread", patient_user_id=user.id))
+            os.replace(tmp, fpath)
             attachment_url = url_for("pro_office.secure_file", filename=unique)
 
         if body or attachment_url:
@@ -299,10 +309,8 @@ def secure_file(filename: str):
     if current_user.user_type not in ("professional", "patient"):
         abort(403)
     root = Path(os.getenv("UPLOAD_ROOT", Path(current_app.root_path).parent / "uploads")) / "patient_files"
-    target = root / filename
-    if not target.exists():
-        abort(404)
-    return send_from_directory(str(root), filename, as_attachment=True, conditional=True)
+    # Autorisation ici ; l'envoi des octets peut être délégué au proxy (file_delivery)
+    return file_delivery.send_from(root, filename, as_attachment=True, cache_control="private, no-cache")
 
 # === Attacher/éditer le lien Google Meet sur une séance ===
 @pro_office_bp.route("/sessions/<int:appointment_id>/meet", methods=["POST"])
@@ -0,0 +1,215 @@
+# ranking_snapshot.py
+# Classement de la page d'accueil, précalculé en mémoire.
+#
+# Le snapshot contient, pour chaque pro validé, sa clé de classement
+# (order_priority, is_featured, featured_rank, created_at, id) — la même que keyset.py —
+# triée une fois pour toutes. La page d'accueil lit une tranche du snapshot :
+# aucune requête de tri, seulement un chargement des pros par clé primaire.
+#
+# Mise à jour incrémentale (bisect) depuis les routes admin qui touchent au classement ;
+# `version` change à chaque modification. Pour les autres workers gunicorn, la version du
+# classement est en base (table ranking_version, une ligne) : toute transaction qui modifie
+# un ordre admin ou un champ de la clé d'un pro l'incrémente (after_flush, même
+# transaction), et chaque lecture compare cette version à celle du snapshot — une lecture
+# par clé primaire — avant de le reconstruire si elle a changé. RANKING_SNAPSHOT_MAX_AGE
+# reste un filet (écritures SQL hors ORM, table de version illisible).
+
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, inspect, text
+
+from extensions import db
+
+MAX_AGE_SECONDS = int(os.getenv("RANKING_SNAPSHOT_MAX_AGE", "300"))
+_EPOCH = datetime(1970, 1, 1)
+
+# Champs de Professional qui entrent dans la clé (ou l'appartenance) du classement
+_RANKED_FIELDS = ("status", "is_featured", "featured_rank", "created_at")
+
+
+def _sort_key(raw):
+    """Clé croissante équivalente à l'ORDER BY du classement."""
+    priority, featured, featured_rank, created_at, pro_id = raw
+    return (priority, not featured, featured_rank, _EPOCH - created_at, -pro_id)
+
+
+class RankingSnapshot:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = []   # [(sort_key, raw_key)] triés
+        self._by_id = {}     # id -> raw_key
+        self.version = 0
+        self.built_at = 0.0
+        self.db_version = None   # ranking_version lue avant la dernière reconstruction
+
+    # --- lecture ---------------------------------------------------
+    def _query(self, ids=None):
+        from models import Professional
+        from admin_server import ProfessionalOrder
+        q = (
+            db.session.query(
+                db.func.coalesce(ProfessionalOrder.order_priority, 999999),
+                Professional.is_featured,
+                Professional.featured_rank,
+                Professional.created_at,
+                Professional.id,
+                Professional.status,
+            )
+            .outerjoin(ProfessionalOrder, ProfessionalOrder.professional_id == Professional.id)
+        )
+        if ids is None:
+            q = q.filter(Professional.status == 'valide')
+        else:
+            q = q.filter(Professional.id.in_(list(ids)))
+        return q.all()
+
+    @staticmethod
+    def _raw(row):
+        priority, featured, featured_rank, created_at, pro_id, _status = row
+        return (
+            int(priority),
+            bool(featured),
+            int(featured_rank if featured_rank is not None else 999999),
+            created_at or _EPOCH,
+            int(pro_id),
+        )
+
+    def rebuild(self, db_version=None):
+        raws = [self._raw(r) for r in self._query()]
+        entries = sorted((_sort_key(k), k) for k in raws)
+        with self._lock:
+            self._entries = entries
+            self._by_id = {k[-1]: k for k in raws}
+            self.version += 1
+            self.built_at = time.monotonic()
+            self.db_version = db_version
+
+    def _ensure_fresh(self):
+        # Version lue avant les lignes : une modification commitée entre les deux sera
+        # revue au prochain accès, jamais manquée
+        current = stored_version()
+        if (
+            not self.built_at
+            or (time.monotonic() - self.built_at) > MAX_AGE_SECONDS
+            or (current is not None and current != self.db_version)
+        ):
+            self.rebuild(current)
+
+    def head(self, n: int):
+        """Les n premières clés du classement (format keyset : [.., id])."""
+        self._ensure_fresh()
+        with self._lock:
+            return [raw for _, raw in self._entries[:n]]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    # --- écriture incrémentale ------------------------------------
+    def _remove(self, pro_id):
+        old = self._by_id.pop(pro_id, None)
+        if old is None:
+            return
+        item = (_sort_key(old), old)
+        i = bisect_left(self._entries, item)
+        if i < len(self._entries) and self._entries[i] == item:
+            del self._entries[i]
+
+    def refresh(self, ids):
+        """Repositionne `ids` (ou les retire s'ils ne sont plus validés / supprimés)."""
+        ids = {int(i) for i in ids if i is not None}
+        if not ids or not self.built_at:
+            return  # snapshot jamais construit : il le sera au prochain accès
+        # La transaction de l'appelant a incrémenté la version une fois ; une autre valeur
+        # signifie qu'un autre worker a aussi modifié le classement : reconstruction au
+        # prochain accès
+        current = stored_version()
+        rows = self._query(ids)
+        with self._lock:
+            if self.db_version is not None and current == self.db_version + 1:
+                self.db_version = current
+            for pro_id in ids:
+                self._remove(pro_id)
+            for row in rows:
+                if row[-1] != 'valide':
+                    continue
+                raw = self._raw(row)
+                self._by_id[raw[-1]] = raw
+                insort(self._entries, (_sort_key(raw), raw))
+            self.version += 1
+
+    def invalidate(self):
+        with self._lock:
+            self.built_at = 0.0
+
+
+snapshot = RankingSnapshot()
+
+
+def refresh(ids):
+    snapshot.refresh(ids)
+
+
+def head(n: int):
+    return snapshot.head(n)
+
+
+# -------------------------------------------------------------------
+# Version partagée (table ranking_version)
+# -------------------------------------------------------------------
+def stored_version():
+    """Version du classement en base (0 si jamais incrémentée), None si illisible."""
+    try:
+        return int(db.session.execute(text("SELECT version FROM ranking_version WHERE id = 1")).scalar() or 0)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning("Version du classement illisible, repli sur RANKING_SNAPSHOT_MAX_AGE: %s", e)
+        return None
+
+
+def bump_version(conn):
+    conn.execute(text(
+        "INSERT INTO ranking_version (id, version, updated_at) VALUES (1, 1, :now) "
+        "ON CONFLICT (id) DO UPDATE SET version = ranking_version.version + 1, updated_at = EXCLUDED.updated_at"
+    ), {"now": datetime.utcnow()})
+
+
+def _changes_ranking(session, obj) -> bool:
+    from models import Professional
+    from admin_server import ProfessionalOrder
+    if isinstance(obj, ProfessionalOrder):
+        return True
+    if not isinstance(obj, Professional):
+        return False
+    if obj in session.deleted:
+        return True
+    if obj in session.new:
+        return obj.status == 'valide'
+    state = inspect(obj)
+    return any(state.attrs[f].history.has_changes() for f in _RANKED_FIELDS)
+
+
+@event.listens_for(db.session, "after_flush")
+def _bump_after_flush(session, flush_context):
+    # Une incrémentation par transaction : refresh() reconnaît ainsi sa propre écriture
+    if session.info.get("ranking_bumped"):
+        return
+    objs = list(session.new) + list(session.dirty) + list(session.deleted)
+    if any(_changes_ranking(session, o) for o in objs):
+        bump_version(session.connection())
+        session.info["ranking_bumped"] = True
+
+
+@event.listens_for(db.session, "after_commit")
+def _forget_after_commit(session):
+    session.info.pop("ranking_bumped", None)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("ranking_bumped", None)
@@ -0,0 +1,125 @@
+# result_cache.py
+# Cache des résultats de recherche de l'annuaire (ids ordonnés).
+#
+# Les visiteurs anonymes relancent sans cesse les mêmes filtres populaires
+# (city_id=…&family=Psychothérapie). Pour un jeu de filtres normalisé, on garde la
+# liste ordonnée des ids des premières pages (MAX_IDS, RESULT_CACHE_MAX_IDS) : elles se
+# servent par tranche, sans requête de tri ; au-delà, keyset.page() prend le relais.
+#
+# - LRU (RESULT_CACHE_SIZE entrées) + TTL (RESULT_CACHE_TTL secondes) ;
+# - "génération" : tout flush qui écrit dans Professional, ProfessionalOrder, le pivot
+#   des spécialités ou les référentiels incrémente la version partagée "results"
+#   (shared_version.py) dans sa transaction ; chaque lecture compare l'entrée à cette
+#   version, si bien que tous les workers écartent les entrées antérieures dès le commit.
+#   Le worker qui écrit vide aussi son cache au commit ;
+# - compteurs hits / misses / evictions exposés dans /admin/api/stats.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+from extensions import db
+import shared_version
+
+TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL", "120"))
+MAX_ENTRIES = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+MAX_IDS = int(os.getenv("RESULT_CACHE_MAX_IDS", "120"))  # ~5 pages de l'annuaire
+VERSION_NAME = "results"
+
+# Paramètres sans effet sur l'ensemble de résultats (pagination, cache-busting)
+_IGNORED_ARGS = {"after", "limit", "_"}
+# Paramètres texte comparés sans casse ni espaces superflus
+_FOLDED_ARGS = {"q", "city", "specialty", "family", "mode"}
+
+# Tables dont l'écriture invalide le cache
+_WATCHED_TABLES = {"professionals", "professional_order", "professional_specialties", "specialties", "cities"}
+
+_lock = threading.Lock()
+_entries = OrderedDict()   # clé -> ((génération, version partagée), expire_à, valeur)
+_state = {"generation": 0}
+_metrics = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+
+def cache_key(scope: str, args) -> tuple:
+    """Clé normalisée (scope, ((arg, (valeurs…)), …)) indépendante de l'ordre des paramètres."""
+    items = []
+    for name in sorted(set(args.keys())):
+        if name in _IGNORED_ARGS:
+            continue
+        values = [v.strip() for v in args.getlist(name) if v and v.strip()]
+        if not values:
+            continue
+        if name in _FOLDED_ARGS:
+            values = [" ".join(v.split()).casefold() for v in values]
+        items.append((name, tuple(sorted(values))))
+    return scope, tuple(items)
+
+
+def get_or_compute(key, compute):
+    """Valeur en cache pour `key`, sinon `compute()` (mise en cache si aucune écriture entre-temps)."""
+    now = time.monotonic()
+    shared = shared_version.current(VERSION_NAME)
+    with _lock:
+        generation = (_state["generation"], shared)
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == generation and entry[1] > now:
+            _entries.move_to_end(key)
+            _metrics["hits"] += 1
+            return entry[2]
+        _metrics["misses"] += 1
+
+    value = compute()
+
+    with _lock:
+        if generation[0] == _state["generation"]:
+            _entries[key] = (generation, now + TTL_SECONDS, value)
+            _entries.move_to_end(key)
+            while len(_entries) > MAX_ENTRIES:
+                _entries.popitem(last=False)
+                _metrics["evictions"] += 1
+    return value
+
+
+def invalidate():
+    with _lock:
+        _state["generation"] += 1
+        _entries.clear()
+        _metrics["invalidations"] += 1
+
+
+def stats() -> dict:
+    with _lock:
+        out = dict(_metrics)
+        out["size"] = len(_entries)
+        out["generation"] = _state["generation"]
+    lookups = out["hits"] + out["misses"]
+    out["hit_ratio"] = round(out["hits"] / lookups, 3) if lookups else None
+    return out
+
+
+# -------------------------------------------------------------------
+# Invalidation sur écriture
+# -------------------------------------------------------------------
+@event.listens_for(db.session, "after_flush")
+def _mark_directory_writes(session, flush_context):
+    if session.info.get("results_dirty"):
+        return  # une incrémentation par transaction suffit
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if getattr(obj, "__tablename__", None) in _WATCHED_TABLES:
+            shared_version.bump(session.connection(), VERSION_NAME)
+            session.info["results_dirty"] = True
+            return
+
+
+@event.listens_for(db.session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("results_dirty", False):
+        invalidate()
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("results_dirty", None)
@@ -0,0 +1,202 @@
+# search_engine.py
+# Recherche plein texte de l'annuaire (PostgreSQL tsvector + GIN + ts_rank).
+#
+# Chaque Professional porte une colonne `search_vector` pondérée :
+#   A = nom
+#   B = spécialité principale / secondaires (+ familles) / ancienne spécialité texte
+#   C = ville, location, adresse
+#   D = description
+# Le texte est replié (unaccent + minuscules + normalisation arabe) côté SQL,
+# aussi bien à l'indexation qu'à la requête, pour que "Psychologue", "psychologué"
+# ou "أحمد" / "احمد" se rejoignent.
+# La colonne est maintenue à l'écriture (hook after_flush) : aucun trigger requis.
+
+import re
+import unicodedata
+
+from sqlalchemy import event, func, literal_column, or_, text, bindparam
+
+from extensions import db
+
+SEARCH_CONFIG = "simple"  # FR + AR : pas de stemming, on replie seulement
+
+# Normalisation arabe (translate) : alef hamza → alef, alef maqsura → ya,
+# ta marbuta → ha ; harakat + tatweel supprimés (pas d'équivalent dans _AR_TO).
+_AR_FROM = "\u0623\u0625\u0622\u0649\u0629" + "\u064b\u064c\u064d\u064e\u064f\u0650\u0651\u0652\u0640"
+_AR_TO = "\u0627\u0627\u0627\u064a\u0647"
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+_AR_TABLE = str.maketrans(_AR_FROM[:5], _AR_TO, _AR_FROM[5:])
+
+
+def fold_text(value: str) -> str:
+    """Équivalent Python du repli SQL (accents, casse, variantes arabes) — pour les index en mémoire."""
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return stripped.casefold().translate(_AR_TABLE)
+
+_state = {"unaccent": False, "ready": False}
+
+
+def _fold_sql(expr: str) -> str:
+    """Repli SQL d'une expression texte (même règle à l'indexation et à la requête)."""
+    inner = f"unaccent({expr})" if _state["unaccent"] else expr
+    return f"translate(lower({inner}), '{_AR_FROM}', '{_AR_TO}')"
+
+
+def _vector_sql() -> str:
+    cfg = f"'{SEARCH_CONFIG}'"
+    specialties = (
+        "coalesce((SELECT string_agg(s.name || ' ' || coalesce(s.category, ''), ' ')"
+        " FROM professional_specialties x JOIN specialties s ON s.id = x.specialty_id"
+        " WHERE x.professional_id = p.id), '')"
+    )
+    primary = (
+        "coalesce((SELECT s.name || ' ' || coalesce(s.category, '')"
+        " FROM specialties s WHERE s.id = p.primary_specialty_id), '')"
+    )
+    city = "coalesce((SELECT c.name FROM cities c WHERE c.id = p.city_id), '')"
+    name_txt = "coalesce(p.name, '')"
+    spec_txt = f"{primary} || ' ' || {specialties} || ' ' || coalesce(p.specialty, '')"
+    place_txt = f"{city} || ' ' || coalesce(p.location, '') || ' ' || coalesce(p.address, '')"
+    desc_txt = "coalesce(p.description, '')"
+    return " || ".join(
+        f"setweight(to_tsvector({cfg}, {_fold_sql(expr)}), '{weight}')"
+        for expr, weight in ((name_txt, "A"), (spec_txt, "B"), (place_txt, "C"), (desc_txt, "D"))
+    )
+
+
+def refresh_vectors(conn, ids=None):
+    """Recalcule search_vector pour `ids` (ou pour les lignes jamais indexées si None)."""
+    sql = f"UPDATE professionals AS p SET search_vector = {_vector_sql()}"
+    if ids is None:
+        conn.execute(text(sql + " WHERE p.search_vector IS NULL"))
+        return
+    ids = sorted({int(i) for i in ids if i is not None})
+    if not ids:
+        return
+    stmt = text(sql + " WHERE p.id IN :ids").bindparams(bindparam("ids", expanding=True))
+    conn.execute(stmt, {"ids": ids})
+
+
+def install_search_schema(app=None):
+    """
+    Boot : extension unaccent (si autorisée) + rattrapage des lignes non indexées.
+    La colonne et l'index GIN sont créés par les mini-migrations de app.py.
+    """
+    try:
+        db.session.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent;"))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        if app is not None:
+            app.logger.warning("Extension unaccent indisponible (%s), repli sans accents désactivé.", e)
+
+    try:
+        row = db.session.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'unaccent'")).first()
+        _state["unaccent"] = bool(row)
+    except Exception:
+        db.session.rollback()
+        _state["unaccent"] = False
+
+    refresh_vectors(db.session.connection())
+    db.session.commit()
+    _state["ready"] = True
+
+
+def search_ready() -> bool:
+    return _state["ready"]
+
+
+# -------------------------------------------------------------------
+# Requête
+# -------------------------------------------------------------------
+def _tsquery_text(q: str) -> str:
+    """'Dr. Élise psy' → 'dr:* & élise:* & psy:*' (préfixes, ET logique)."""
+    # Un jeton vide une fois replié (tatweel seul) donnerait ':*', rejeté par to_tsquery
+    tokens = [t for t in _TOKEN_RE.findall(q or "") if fold_text(t)]
+    return " & ".join(f"{t}:*" for t in tokens)
+
+
+def _tsquery_expr(q: str):
+    raw = _tsquery_text(q)
+    if not raw:
+        return None
+    folded = func.lower(func.unaccent(raw) if _state["unaccent"] else raw)
+    folded = func.translate(folded, _AR_FROM, _AR_TO)
+    return func.to_tsquery(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), folded)
+
+
+def _legacy_filter(query, q: str):
+    from models import Professional
+    like = f"%{q}%"
+    conds = []
+    for attr in ("name", "full_name", "description", "specialty", "location", "address"):
+        if hasattr(Professional, attr):
+            conds.append(getattr(Professional, attr).ilike(like))
+    return query.filter(or_(*conds)) if conds else query
+
+
+def apply_text_search(query, q: str):
+    """
+    Filtre une requête Professional sur `q`.
+    Retourne (query, rank_expr) ; rank_expr vaut None si pas de classement possible
+    (q vide, ou index plein texte pas encore installé → ancien ILIKE).
+    """
+    from models import Professional
+    q = (q or "").strip()
+    if not q:
+        return query, None
+    if not _state["ready"]:
+        return _legacy_filter(query, q), None
+
+    tsq = _tsquery_expr(q)
+    if tsq is None:
+        return _legacy_filter(query, q), None
+    query = query.filter(Professional.search_vector.op("@@")(tsq))
+    return query, func.ts_rank(Professional.search_vector, tsq)
+
+
+# -------------------------------------------------------------------
+# Maintenance à l'écriture
+# -------------------------------------------------------------------
+def _ids_to_refresh(session):
+    from models import Professional, Specialty, City
+    pro_ids = set()
+    spec_ids = set()
+    city_ids = set()
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Professional):
+            pro_ids.add(obj.id)
+        elif isinstance(obj, Specialty) and obj in session.dirty:
+            spec_ids.add(obj.id)
+        elif isinstance(obj, City) and obj in session.dirty:
+            city_ids.add(obj.id)
+    return pro_ids, spec_ids, city_ids
+
+
+@event.listens_for(db.session, "after_flush")
+def _refresh_after_flush(session, flush_context):
+    if not _state["ready"]:
+        return
+    pro_ids, spec_ids, city_ids = _ids_to_refresh(session)
+    if not (pro_ids or spec_ids or city_ids):
+        return
+
+    conn = session.connection()
+    if spec_ids or city_ids:
+        # Renommage d'une spécialité / ville : ré-indexer les pros concernés
+        clauses, params = [], {}
+        if spec_ids:
+            clauses.append("primary_specialty_id IN :spec_ids")
+            clauses.append("id IN (SELECT professional_id FROM professional_specialties WHERE specialty_id IN :spec_ids)")
+            params["spec_ids"] = sorted(spec_ids)
+        if city_ids:
+            clauses.append("city_id IN :city_ids")
+            params["city_ids"] = sorted(city_ids)
+        stmt = text("SELECT id FROM professionals WHERE " + " OR ".join(clauses))
+        for name in params:
+            stmt = stmt.bindparams(bindparam(name, expanding=True))
+        pro_ids.update(r[0] for r in conn.execute(stmt, params))
+
+    refresh_vectors(conn, pro_ids)
@@ -0,0 +1,44 @@
+# shared_version.py
+# Versions partagées entre workers gunicorn pour les caches en mémoire.
+#
+# Chaque cache process-local (result_cache, taxonomy_cache, avatar_cache) a sa ligne dans
+# shared_versions. L'écriture qui rend le cache caduc incrémente la ligne dans sa propre
+# transaction (bump) ; chaque lecture du cache relit la version (clé primaire, une ligne)
+# et écarte les entrées construites sous une autre version. Même principe que
+# ranking_version pour le snapshot de la page d'accueil (ranking_snapshot.py).
+# Une lecture par cache et par requête HTTP au plus (mémorisée dans flask.g).
+# Table illisible : current() renvoie None et le cache retombe sur son seul TTL.
+
+from datetime import datetime
+
+from flask import current_app, g, has_request_context
+from sqlalchemy import text
+
+from extensions import db
+
+
+def current(name: str):
+    """Version de `name` (0 si jamais incrémentée), None si la table est illisible."""
+    seen = g.setdefault("shared_versions", {}) if has_request_context() else {}
+    if name in seen:
+        return seen[name]
+    try:
+        version = int(db.session.execute(
+            text("SELECT version FROM shared_versions WHERE name = :name"), {"name": name}
+        ).scalar() or 0)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning("Version partagée %s illisible, repli sur le TTL: %s", name, e)
+        version = None
+    seen[name] = version
+    return version
+
+
+def bump(conn, name: str) -> None:
+    """Incrémente `name` dans la transaction de `conn` (visible des autres workers au commit)."""
+    if has_request_context():
+        g.pop("shared_versions", None)  # la requête en cours relira la nouvelle version
+    conn.execute(text(
+        "INSERT INTO shared_versions (name, version, updated_at) VALUES (:name, 1, :now) "
+        "ON CONFLICT (name) DO UPDATE SET version = shared_versions.version + 1, updated_at = EXCLUDED.updated_at"
+    ), {"name": name, "now": datetime.utcnow()})
@@ -0,0 +1,280 @@
+# slot_engine.py
+# Calcul des créneaux réservables d'un professionnel.
+#
+# Sources (une requête groupée chacune, colonnes utiles seulement ; load_many charge
+# plusieurs professionnels avec les mêmes quatre requêtes) :
+#   - ProfessionalAvailability : plages hebdomadaires (day_of_week 0 = lundi, "HH:MM") ;
+#   - UnavailableSlot          : indisponibilités datées (aucune marge ajoutée) ;
+#   - Appointment              : rendez-vous actifs (ACTIVE_APPOINTMENT_STATUSES) ;
+#   - TherapySession           : séances non annulées.
+# Durée et marge viennent de consultation_duration_minutes / buffer_between_appointments_minutes.
+#
+# Arithmétique d'intervalles en minutes depuis minuit du premier jour : les occupations
+# (rendez-vous et séances élargis de la marge de chaque côté, indisponibilités telles
+# quelles) sont triées et fusionnées une fois ; un créneau [t, t + durée) est libre si
+# aucune occupation ne le chevauche (bisect sur les fins triées, O(log n)).
+# La grille part du début de chaque plage, au pas durée + marge : les créneaux proposés
+# ne bougent pas quand un rendez-vous est pris.
+#
+# Un professionnel qui n'a jamais enregistré ses plages (availability_saved_at vide, sans
+# plage en base) garde FALLBACK_WINDOWS (9 h – 17 h, tous les jours), comme auparavant ;
+# une grille enregistrée vide ou entièrement indisponible le rend fermé.
+# Mesure : python bench_slot_engine.py
+
+from bisect import bisect_right
+from datetime import datetime, time, timedelta
+
+DEFAULT_DURATION = 45
+DEFAULT_BUFFER = 15
+FALLBACK_WINDOWS = ((9 * 60, 17 * 60),)
+ACTIVE_APPOINTMENT_STATUSES = ("en_attente", "confirme", "requested", "confirmed")
+INACTIVE_SESSION_STATUSES = ("annule",)
+_DAY = 24 * 60
+
+
+def _to_minutes(value):
+    """'HH:MM' ou time -> minutes depuis minuit ; None si illisible."""
+    if isinstance(value, time):
+        return value.hour * 60 + value.minute
+    if isinstance(value, str) and ":" in value:
+        try:
+            hh, mm = value.strip().split(":")[:2]
+            minutes = int(hh) * 60 + int(mm)
+        except ValueError:
+            return None
+        return minutes if 0 <= minutes <= _DAY else None
+    return None
+
+
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def session_settings(pro):
+    """(durée, marge) en minutes pour `pro`, bornées à des valeurs raisonnables."""
+    duration = getattr(pro, "consultation_duration_minutes", None) or DEFAULT_DURATION
+    buffer_m = getattr(pro, "buffer_between_appointments_minutes", None)
+    buffer_m = DEFAULT_BUFFER if buffer_m is None else buffer_m
+    return max(15, min(int(duration), 180)), max(0, min(int(buffer_m), 60))
+
+
+class Calendar:
+    """Créneaux d'un professionnel sur [start_date, start_date + days)."""
+
+    __slots__ = ("start_date", "days", "duration", "buffer", "weekly", "_origin", "_starts", "_ends")
+
+    def __init__(self, start_date, days: int, weekly: dict, busy, duration: int = DEFAULT_DURATION,
+                 buffer: int = DEFAULT_BUFFER):
+        """
+        `weekly` : {jour 0..6: [(début, fin) en minutes]} ; `busy` : intervalles
+        (début, fin) en minutes depuis minuit de `start_date`, marges déjà incluses.
+        """
+        self.start_date = start_date
+        self.days = days
+        self.duration = duration
+        self.buffer = buffer
+        self.weekly = {wd: [tuple(w) for w in _merge(ws)] for wd, ws in weekly.items()}
+        self._origin = datetime.combine(start_date, time.min)
+        merged = _merge(busy)
+        self._starts = [s for s, _ in merged]
+        self._ends = [e for _, e in merged]
+
+    @property
+    def step(self) -> int:
+        return self.duration + self.buffer
+
+    def minutes(self, dt: datetime) -> int:
+        return int((dt - self._origin).total_seconds() // 60)
+
+    def _is_free(self, start: int) -> bool:
+        i = bisect_right(self._ends, start)
+        return i >= len(self._starts) or self._starts[i] >= start + self.duration
+
+    def grid(self, not_before: datetime = None):
+        """[(datetime, libre)] pour chaque créneau de la grille, dans l'ordre chronologique."""
+        limit = self.minutes(not_before) if not_before is not None else None
+        duration, step = self.duration, self.step
+        out = []
+        for d in range(self.days):
+            base = d * _DAY
+            for ws, we in self.weekly.get((self.start_date + timedelta(days=d)).weekday(), ()):
+                t, end = base + ws, base + we
+                if limit is not None and t < limit:
+                    t += -(-(limit - t) // step) * step  # premier créneau de la grille >= limit
+                while t + duration <= end:
+                    out.append((self._origin + timedelta(minutes=t), self._is_free(t)))
+                    t += step
+        return out
+
+    def free_slots(self, not_before: datetime = None):
+        return [dt for dt, free in self.grid(not_before) if free]
+
+    def first_free(self, not_before: datetime = None):
+        """Premier créneau libre (datetime) ou None."""
+        limit = self.minutes(not_before) if not_before is not None else None
+        duration, step = self.duration, self.step
+        for d in range(self.days):
+            base = d * _DAY
+            for ws, we in self.weekly.get((self.start_date + timedelta(days=d)).weekday(), ()):
+                t, end = base + ws, base + we
+                if limit is not None and t < limit:
+                    t += -(-(limit - t) // step) * step
+                while t + duration <= end:
+                    if self._is_free(t):
+                        return self._origin + timedelta(minutes=t)
+                    t += step
+        return None
+
+    def day_intervals(self, d: int):
+        """(plages, occupations) du jour d'indice `d`, en minutes depuis minuit de ce jour."""
+        base = d * _DAY
+        windows = list(self.weekly.get((self.start_date + timedelta(days=d)).weekday(), ()))
+        busy = []
+        for i in range(bisect_right(self._ends, base), len(self._starts)):
+            if self._starts[i] >= base + _DAY:
+                break
+            busy.append((max(self._starts[i], base) - base, min(self._ends[i], base + _DAY) - base))
+        return windows, busy
+
+    def is_free(self, dt: datetime) -> bool:
+        """Vrai si `dt` est un créneau de la grille, dans l'horizon, et libre."""
+        t = self.minutes(dt)
+        d, offset = divmod(t, _DAY)
+        if not 0 <= d < self.days or dt.second or dt.microsecond:
+            return False
+        for ws, we in self.weekly.get(dt.weekday(), ()):
+            if ws <= offset and offset + self.duration <= we and (offset - ws) % self.step == 0:
+                return self._is_free(t)
+        return False
+
+
+# -------------------------------------------------------------------
+# Chargement depuis la base
+# -------------------------------------------------------------------
+def load(pro, start_date, days: int, conn=None) -> Calendar:
+    """
+    Calendar de `pro` (objet Professional ou id) : une requête par source, bornée à
+    l'horizon demandé. `conn` : connexion à utiliser à la place de db.session.
+    """
+    if isinstance(pro, int):
+        from sqlalchemy import select
+        from extensions import db
+        from models import Professional
+
+        execute = (conn if conn is not None else db.session).execute
+        row = execute(select(
+            Professional.id, Professional.consultation_duration_minutes, Professional.buffer_between_appointments_minutes,
+        ).where(Professional.id == pro)).first()
+        if row is None:
+            return Calendar(start_date, days, {}, [])
+        pro = row
+    return load_many([pro], start_date, days, conn)[pro.id]
+
+
+def load_many(pros, start_date, days: int, conn=None) -> dict:
+    """
+    {id: Calendar} pour une liste de pros (objets ou lignes id / durée / marge) : toujours
+    une requête par source, filtrée par `professional_id IN (…)`, quel que soit le nombre de pros.
+    """
+    from sqlalchemy import select
+    from extensions import db
+    from models import Professional, ProfessionalAvailability, UnavailableSlot, Appointment, TherapySession
+
+    pros = {p.id: p for p in pros}
+    if not pros:
+        return {}
+    execute = (conn if conn is not None else db.session).execute
+    ids = list(pros)
+    settings = {pid: session_settings(p) for pid, p in pros.items()}
+    origin = datetime.combine(start_date, time.min)
+    horizon_end = origin + timedelta(days=days)
+    # une séance commencée la veille peut déborder
+    reach = timedelta(minutes=max(d + b for d, b in settings.values()))
+
+    def rel(dt: datetime) -> int:
+        return int((dt - origin).total_seconds() // 60)
+
+    weekly = {pid: {} for pid in ids}
+    seen = set()
+    for pid, wd, s, e in execute(select(
+        ProfessionalAvailability.professional_id, ProfessionalAvailability.day_of_week,
+        ProfessionalAvailability.start_time, ProfessionalAvailability.end_time,
+    ).where(
+        ProfessionalAvailability.professional_id.in_(ids),
+        ProfessionalAvailability.is_available.isnot(False),
+    )):
+        seen.add(pid)
+        s, e = _to_minutes(s), _to_minutes(e)
+        if wd is not None and 0 <= wd <= 6 and s is not None and e is not None and s < e:
+            weekly[pid].setdefault(wd, []).append((s, e))
+    unseen = [pid for pid in ids if pid not in seen]
+    if unseen:
+        configured = set(execute(select(ProfessionalAvailability.professional_id).where(
+            ProfessionalAvailability.professional_id.in_(unseen),
+        ).union(select(Professional.id).where(
+            Professional.id.in_(unseen), Professional.availability_saved_at.isnot(None),
+        ))).scalars())
+        for pid in unseen:
+            if pid not in configured:
+                weekly[pid] = {wd: list(FALLBACK_WINDOWS) for wd in range(7)}
+
+    busy = {pid: [] for pid in ids}
+    for pid, day, s, e in execute(select(
+        UnavailableSlot.professional_id, UnavailableSlot.date, UnavailableSlot.start_time, UnavailableSlot.end_time,
+    ).where(
+        UnavailableSlot.professional_id.in_(ids),
+        UnavailableSlot.date >= start_date,
+        UnavailableSlot.date < start_date + timedelta(days=days),
+    )):
+        s, e = _to_minutes(s), _to_minutes(e)
+        if s is not None and e is not None:
+            base = (day - start_date).days * _DAY
+            busy[pid].append((base + s, base + e))
+
+    for pid, at in execute(select(Appointment.professional_id, Appointment.appointment_date).where(
+        Appointment.professional_id.in_(ids),
+        Appointment.appointment_date >= origin - reach,
+        Appointment.appointment_date < horizon_end,
+        Appointment.status.in_(ACTIVE_APPOINTMENT_STATUSES),
+    )):
+        duration, buffer_m = settings[pid]
+        t = rel(at)
+        busy[pid].append((t - buffer_m, t + duration + buffer_m))
+
+    for pid, start_at, end_at, minutes in execute(select(
+        TherapySession.professional_id, TherapySession.start_at, TherapySession.end_at, TherapySession.duration_minutes,
+    ).where(
+        TherapySession.professional_id.in_(ids),
+        TherapySession.start_at >= origin - timedelta(days=1),
+        TherapySession.start_at < horizon_end,
+        db.or_(TherapySession.status.is_(None), TherapySession.status.notin_(INACTIVE_SESSION_STATUSES)),
+    )):
+        duration, buffer_m = settings[pid]
+        end_at = end_at or start_at + timedelta(minutes=minutes or duration)
+        busy[pid].append((rel(start_at) - buffer_m, rel(end_at) + buffer_m))
+
+    return {
+        pid: Calendar(start_date, days, weekly[pid], busy[pid], *settings[pid])
+        for pid in ids
+    }
+
+
+def grouped_by_day(calendar: Calendar, not_before: datetime = None) -> dict:
+    """{"YYYY-MM-DD": [{"iso", "time", "free"}…]} pour les gabarits de sélection de créneau."""
+    grouped = {}
+    for dt, free in calendar.grid(not_before):
+        grouped.setdefault(dt.strftime("%Y-%m-%d"), []).append({
+            "iso": dt.strftime("%Y-%m-%d %H:%M"),
+            "time": dt.strftime("%H:%M"),
+            "free": free,
+        })
+    return grouped
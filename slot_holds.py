@@ -0,0 +1,112 @@
+# slot_holds.py
+# Options temporaires sur un créneau, entre le choix et la confirmation.
+#
+# Sans option, un créneau affiché libre pouvait être pris par un autre patient pendant
+# que le premier confirmait : confirmations refusées en série sur les pros demandés.
+# Ici (table slot_holds, clé (professional_id, slot_at)) :
+#   - choisir un créneau pose une option de TTL_SECONDS (SLOT_HOLD_TTL) : un seul
+#     INSERT … ON CONFLICT qui ne reprend la ligne existante que si elle a expiré ou
+#     appartient déjà au même patient ; un patient n'a qu'une option par professionnel ;
+#   - la page de créneaux lit les options vivantes de l'horizon affiché (une requête) et
+#     montre ces créneaux comme « réservés temporairement » ;
+#   - une option expirée est ignorée partout ; sweep() les supprime par plage sur
+#     l'index ix_slot_holds_expires_at, au plus toutes les SWEEP_INTERVAL secondes par process ;
+#   - la confirmation consomme l'option en une seule instruction (claim), dans la
+#     transaction qui insère le rendez-vous ; la contrainte d'exclusion (booking_guard.py)
+#     reste l'arbitre final.
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from extensions import db
+
+TTL_SECONDS = int(os.getenv("SLOT_HOLD_TTL", "300"))
+SWEEP_INTERVAL = int(os.getenv("SLOT_HOLD_SWEEP_INTERVAL", "60"))
+
+_sweep_lock = threading.Lock()
+_state = {"next_sweep": 0.0}
+
+
+def acquire(professional_id: int, patient_id: int, slot_at: datetime):
+    """
+    Pose (ou prolonge) l'option de `patient_id` sur `slot_at`. Renvoie l'heure d'expiration,
+    ou None si un autre patient détient une option vivante. Le commit revient à l'appelant.
+    """
+    maybe_sweep()
+    now = datetime.utcnow()
+    row = db.session.execute(
+        text(
+            "INSERT INTO slot_holds (professional_id, slot_at, patient_id, expires_at, created_at) "
+            "VALUES (:pid, :at, :patient, :expires, :now) "
+            "ON CONFLICT (professional_id, slot_at) DO UPDATE "
+            "SET patient_id = EXCLUDED.patient_id, expires_at = EXCLUDED.expires_at, created_at = EXCLUDED.created_at "
+            "WHERE slot_holds.patient_id = EXCLUDED.patient_id OR slot_holds.expires_at <= :now "
+            "RETURNING expires_at"
+        ),
+        {"pid": professional_id, "at": slot_at, "patient": patient_id,
+         "expires": now + timedelta(seconds=TTL_SECONDS), "now": now},
+    ).first()
+    if row is None:
+        return None  # l'option déjà détenue ailleurs chez ce pro est conservée
+    db.session.execute(
+        text("DELETE FROM slot_holds WHERE patient_id = :patient AND professional_id = :pid AND slot_at <> :at"),
+        {"patient": patient_id, "pid": professional_id, "at": slot_at},
+    )
+    return row[0]
+
+
+def active(professional_id: int, start: datetime, end: datetime) -> dict:
+    """{slot_at: (patient_id, expires_at)} des options vivantes sur [start, end)."""
+    rows = db.session.execute(
+        text(
+            "SELECT slot_at, patient_id, expires_at FROM slot_holds "
+            "WHERE professional_id = :pid AND slot_at >= :start AND slot_at < :end AND expires_at > :now"
+        ),
+        {"pid": professional_id, "start": start, "end": end, "now": datetime.utcnow()},
+    )
+    return {slot_at: (patient_id, expires_at) for slot_at, patient_id, expires_at in rows}
+
+
+def claim(professional_id: int, patient_id: int, slot_at: datetime) -> bool:
+    """
+    Conversion à la confirmation, en une instruction : libère les options du patient chez
+    ce pro (et une option expirée sur le créneau) et vérifie qu'aucun autre patient ne
+    détient `slot_at`. À exécuter dans la transaction qui insère le rendez-vous.
+    """
+    row = db.session.execute(
+        text(
+            "WITH released AS ("
+            "  DELETE FROM slot_holds WHERE professional_id = :pid "
+            "  AND (patient_id = :patient OR (slot_at = :at AND expires_at <= :now)) RETURNING slot_at"
+            ") SELECT NOT EXISTS ("
+            "  SELECT 1 FROM slot_holds WHERE professional_id = :pid AND slot_at = :at "
+            "  AND patient_id <> :patient AND expires_at > :now"
+            ")"
+        ),
+        {"pid": professional_id, "patient": patient_id, "at": slot_at, "now": datetime.utcnow()},
+    ).first()
+    return bool(row[0])
+
+
+def sweep() -> int:
+    """Supprime les options expirées (parcours par plage de l'index sur expires_at)."""
+    with db.engine.begin() as conn:
+        result = conn.execute(text("DELETE FROM slot_holds WHERE expires_at <= :now"), {"now": datetime.utcnow()})
+    return result.rowcount or 0
+
+
+def maybe_sweep():
+    now = time.monotonic()
+    with _sweep_lock:
+        if now < _state["next_sweep"]:
+            return
+        _state["next_sweep"] = now + SWEEP_INTERVAL
+    try:
+        sweep()
+    except Exception as e:
+        from flask import current_app
+        current_app.logger.warning("Balayage des options de créneau: %s", e)
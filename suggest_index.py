@@ -0,0 +1,169 @@
+# suggest_index.py
+# Autocomplétion (typeahead) : noms des pros validés, spécialités, familles, villes.
+#
+# Index en mémoire = une liste triée de (clé repliée, rang du type, libellé, réf).
+# Chaque libellé est indexé à partir de chacun de ses mots ("Dr Ahmed Benani" répond
+# à "ahm" comme à "ben") ; une recherche = bisect sur le préfixe replié puis lecture
+# des entrées suivantes tant qu'elles commencent par ce préfixe.
+#
+# Les pros sont mis à jour incrémentalement après chaque commit (valeurs relevées au
+# flush, aucune requête) ; la partie référentiel est reconstruite quand
+# taxonomy_cache.version() change. Reconstruction complète au-delà de SUGGEST_INDEX_TTL.
+
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+
+from sqlalchemy import event
+
+from extensions import db
+from search_engine import fold_text, _TOKEN_RE
+import taxonomy_cache
+
+TTL_SECONDS = int(os.getenv("SUGGEST_INDEX_TTL", "900"))
+MIN_PREFIX = 1
+MAX_LIMIT = 20
+
+# Ordre d'affichage à préfixe égal
+KIND_RANK = {"specialty": 0, "family": 1, "city": 2, "professional": 3}
+
+_lock = threading.RLock()
+_state = {
+    "entries": [],         # [(clé, rang, libellé, kind, ref)] triés
+    "pro_entries": {},     # pro_id -> [entrées]
+    "tax_entries": [],
+    "taxonomy_version": None,
+    "built_at": 0.0,
+}
+
+
+def _keys_for(label: str):
+    """Clés repliées : le libellé entier puis chaque suffixe commençant à un mot."""
+    folded = fold_text(label).strip()
+    if not folded:
+        return []
+    keys = {folded}
+    for m in _TOKEN_RE.finditer(folded):
+        keys.add(folded[m.start():])
+    return sorted(keys)
+
+
+def _entries_for(kind: str, label: str, ref):
+    return [(key, KIND_RANK[kind], label, kind, ref) for key in _keys_for(label)]
+
+
+def _taxonomy_entries():
+    tax = taxonomy_cache.get()
+    out = []
+    for s in tax["specialties"]:
+        out += _entries_for("specialty", s["name"], s["id"])
+    for f in tax["families"]:
+        out += _entries_for("family", f["name"], f["name"])
+    for c in tax["cities"]:
+        out += _entries_for("city", c["name"], c["id"])
+    return out
+
+
+def _rebuild():
+    from models import Professional
+    pro_entries = {}
+    rows = db.session.query(Professional.id, Professional.name).filter(Professional.status == 'valide').all()
+    for pid, name in rows:
+        pro_entries[pid] = _entries_for("professional", name or "", pid)
+    tax_entries = _taxonomy_entries()
+
+    entries = list(tax_entries)
+    for lst in pro_entries.values():
+        entries += lst
+    entries.sort()
+
+    _state.update(
+        entries=entries, pro_entries=pro_entries, tax_entries=tax_entries,
+        taxonomy_version=taxonomy_cache.version(), built_at=time.monotonic(),
+    )
+
+
+def _refresh_taxonomy():
+    tax_entries = _taxonomy_entries()
+    entries = [e for e in _state["entries"] if e[3] == "professional"] + tax_entries
+    entries.sort()
+    _state.update(entries=entries, tax_entries=tax_entries, taxonomy_version=taxonomy_cache.version())
+
+
+def _ensure_fresh():
+    if not _state["built_at"] or (time.monotonic() - _state["built_at"]) > TTL_SECONDS:
+        _rebuild()
+        return
+    taxonomy_cache.get()  # recharge le référentiel si invalidé
+    if _state["taxonomy_version"] != taxonomy_cache.version():
+        _refresh_taxonomy()
+
+
+def suggest(q: str, limit: int = 8):
+    """Suggestions pour le préfixe `q` : [{"type", "label", "id"}]."""
+    prefix = fold_text(q or "").strip()
+    if len(prefix) < MIN_PREFIX:
+        return []
+    limit = max(1, min(int(limit or 8), MAX_LIMIT))
+
+    with _lock:
+        _ensure_fresh()
+        entries = _state["entries"]
+        i = bisect_left(entries, (prefix,))
+        seen, found = set(), []
+        while i < len(entries) and entries[i][0].startswith(prefix):
+            _key, rank, label, kind, ref = entries[i]
+            if (kind, ref) not in seen:
+                seen.add((kind, ref))
+                found.append((rank, len(label), label, kind, ref))
+            i += 1
+            if len(found) >= limit * 4:
+                break
+
+    found.sort()
+    return [{"type": kind, "label": label, "id": ref} for _r, _n, label, kind, ref in found[:limit]]
+
+
+# -------------------------------------------------------------------
+# Mise à jour incrémentale (pros)
+# -------------------------------------------------------------------
+def _apply_pro_changes(changes):
+    with _lock:
+        if not _state["built_at"]:
+            return  # index jamais construit : il le sera au premier appel
+        entries = _state["entries"]
+        for pid, name, status in changes:
+            for old in _state["pro_entries"].pop(pid, []):
+                j = bisect_left(entries, old)
+                if j < len(entries) and entries[j] == old:
+                    del entries[j]
+            if status == 'valide' and name:
+                new = _entries_for("professional", name, pid)
+                for e in new:
+                    insort(entries, e)
+                _state["pro_entries"][pid] = new
+
+
+@event.listens_for(db.session, "after_flush")
+def _collect_pro_changes(session, flush_context):
+    from models import Professional
+    pending = session.info.setdefault("suggest_changes", {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Professional) and obj.id is not None:
+            pending[obj.id] = (obj.id, obj.name, obj.status)
+    for obj in session.deleted:
+        if isinstance(obj, Professional) and obj.id is not None:
+            pending[obj.id] = (obj.id, None, None)
+
+
+@event.listens_for(db.session, "after_commit")
+def _apply_after_commit(session):
+    pending = session.info.pop("suggest_changes", None)
+    if pending:
+        _apply_pro_changes(pending.values())
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("suggest_changes", None)
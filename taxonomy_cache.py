@@ -0,0 +1,136 @@
+# taxonomy_cache.py
+# Cache process-wide des référentiels (villes, spécialités, familles).
+#
+# Les tables `cities` / `specialties` ne changent presque jamais, mais leurs listes
+# sont affichées sur la plupart des pages (filtres de recherche, formulaires pro).
+# On les charge une fois, avec des structures prêtes à rendre :
+#   cities, specialties, families (lignes {"id", "name"}), families_grouped
+#   (famille + ses spécialités), et des index par id.
+#
+# Invalidation :
+#   - toute transaction qui écrit dans City / Specialty (bootstrap, scripts de seed,
+#     admin, création de spécialité par un pro) incrémente la version partagée
+#     "taxonomy" (shared_version.py) ; chaque lecture la compare à celle du chargement,
+#     donc tous les workers — et les écritures faites par un script à part — sont vus
+#     dès le commit ;
+#   - explicite via invalidate() (process courant) ;
+#   - filet de sécurité TTL (TAXONOMY_CACHE_TTL) si la version est illisible.
+
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+from extensions import db
+import shared_version
+
+VERSION_NAME = "taxonomy"
+TTL_SECONDS = int(os.getenv("TAXONOMY_CACHE_TTL", "600"))
+
+_lock = threading.Lock()
+_state = {"data": None, "version": 0, "built_at": 0.0, "shared": None}
+
+
+def _load():
+    from models import City, Specialty
+
+    cities = [{"id": c.id, "name": c.name} for c in City.query.order_by(City.name.asc()).all()]
+    specialties = [
+        {"id": s.id, "name": s.name, "category": s.category}
+        for s in Specialty.query.order_by(Specialty.name.asc()).all()
+    ]
+
+    grouped = {}
+    for s in specialties:
+        cat = (s["category"] or "").strip()
+        if cat:
+            grouped.setdefault(cat, []).append(s)
+
+    families = []
+    families_grouped = []
+    for i, name in enumerate(sorted(grouped), start=1):
+        families.append({"id": i, "name": name})
+        families_grouped.append({"id": i, "name": name, "specialties": grouped[name]})
+
+    return {
+        "cities": cities,
+        "specialties": specialties,
+        "families": families,
+        "families_grouped": families_grouped,
+        "city_by_id": {c["id"]: c for c in cities},
+        "specialty_by_id": {s["id"]: s for s in specialties},
+    }
+
+
+def _fresh(shared) -> bool:
+    return (
+        _state["data"] is not None
+        and (time.monotonic() - _state["built_at"]) <= TTL_SECONDS
+        and (shared is None or shared == _state["shared"])
+    )
+
+
+def get() -> dict:
+    """Structures de référentiel (partagées : ne pas les modifier)."""
+    shared = shared_version.current(VERSION_NAME)
+    if _fresh(shared):
+        return _state["data"]
+    with _lock:
+        if not _fresh(shared):
+            _state["data"] = _load()
+            _state["built_at"] = time.monotonic()
+            _state["shared"] = shared
+            _state["version"] += 1
+        return _state["data"]
+
+
+def version() -> int:
+    return _state["version"]
+
+
+def invalidate():
+    with _lock:
+        _state["data"] = None
+        _state["built_at"] = 0.0
+
+
+def cities():
+    return get()["cities"]
+
+
+def specialties():
+    return get()["specialties"]
+
+
+def families():
+    return get()["families"]
+
+
+def families_grouped():
+    return get()["families_grouped"]
+
+
+# -------------------------------------------------------------------
+# Invalidation sur écriture
+# -------------------------------------------------------------------
+@event.listens_for(db.session, "after_flush")
+def _mark_taxonomy_writes(session, flush_context):
+    from models import City, Specialty
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (City, Specialty)):
+            if not session.info.get("taxonomy_dirty"):
+                shared_version.bump(session.connection(), VERSION_NAME)
+            session.info["taxonomy_dirty"] = True
+            return
+
+
+@event.listens_for(db.session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("taxonomy_dirty", False):
+        invalidate()
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("taxonomy_dirty", None)
@@ -0,0 +1,101 @@
+# upload_stream.py
+# Copie en flux des fichiers uploadés : morceaux de taille fixe vers un fichier
+# temporaire, SHA-256 et taille calculés au fil de l'eau, plafond par type de fichier
+# vérifié pendant la copie (on s'arrête dès le dépassement, sans tout lire).
+#
+# Werkzeug place déjà les gros uploads dans un fichier temporaire : avec cette copie,
+# la mémoire d'un worker reste de l'ordre de CHUNK_SIZE quelle que soit la taille
+# du fichier, ce qui permet de relever MAX_CONTENT_LENGTH sur les routes qui reçoivent
+# de l'audio et de la vidéo (app.MEDIA_UPLOAD_ENDPOINTS) ; ailleurs il reste bas.
+# Aucune dépendance base de données (importé aussi par les process image_worker).
+
+import hashlib
+import os
+import uuid
+from pathlib import Path
+
+CHUNK_SIZE = 256 * 1024
+_MB = 1024 * 1024
+
+SIZE_LIMITS = {
+    "image": int(os.getenv("UPLOAD_LIMIT_IMAGE", str(10 * _MB))),
+    "document": int(os.getenv("UPLOAD_LIMIT_DOCUMENT", str(20 * _MB))),
+    "audio": int(os.getenv("UPLOAD_LIMIT_AUDIO", str(50 * _MB))),
+    "video": int(os.getenv("UPLOAD_LIMIT_VIDEO", str(200 * _MB))),
+}
+
+IMAGE_EXT = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+AUDIO_EXT = {".mp3", ".m4a", ".aac", ".ogg", ".oga", ".opus", ".wav", ".weba"}
+VIDEO_EXT = {".mp4", ".m4v", ".mov", ".webm"}
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def kind_for(suffix: str) -> str:
+    suffix = (suffix or "").lower()
+    if suffix in IMAGE_EXT:
+        return "image"
+    if suffix in AUDIO_EXT:
+        return "audio"
+    if suffix in VIDEO_EXT:
+        return "video"
+    return "document"
+
+
+def size_limit(suffix: str) -> int:
+    return SIZE_LIMITS[kind_for(suffix)]
+
+
+def max_upload_bytes() -> int:
+    """Plus grand plafond par type : borne haute naturelle de MAX_CONTENT_LENGTH."""
+    return max(SIZE_LIMITS.values())
+
+
+def check_size(stream, max_bytes: int):
+    """
+    Taille de `stream` lue par seek, sans rien lire ; UploadTooLarge au-delà de `max_bytes`.
+    None si le flux n'est pas positionnable (la copie vérifiera alors au fil de l'eau).
+    """
+    try:
+        pos = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(pos)
+    except (AttributeError, OSError, ValueError):
+        return None
+    if size > max_bytes:
+        raise UploadTooLarge(f"Fichier trop volumineux (max {max_bytes // _MB} Mo)")
+    return size
+
+
+def stream_to_temp(stream, directory, max_bytes: int = None):
+    """
+    Copie `stream` dans un fichier temporaire de `directory` (même système de fichiers
+    que la destination, pour un os.replace atomique). Retourne (chemin, sha256 hex, taille).
+    UploadTooLarge si `max_bytes` est dépassé (le temporaire est supprimé).
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    tmp = directory / f".tmp-{uuid.uuid4().hex}"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp, "wb") as fh:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLarge(f"Fichier trop volumineux (max {max_bytes // _MB} Mo)")
+                digest.update(chunk)
+                fh.write(chunk)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return tmp, digest.hexdigest(), size